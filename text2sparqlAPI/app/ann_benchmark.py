@@ -0,0 +1,151 @@
+"""
+Recall / latency / memory benchmark of the FAISS index types (t2sparql_ann.py) on the retrieval corpora.
+
+Part of the corpus is held out as queries; recall@k of every index is measured against exact Flat search
+on the same vectors, so the report shows what an approximate index costs in quality and what it saves:
+
+    python ann_benchmark.py --corpus rag --k 10
+    python ann_benchmark.py --corpus corporate --index flat --index hnsw:M=48,efSearch=128 --index ivf-pq:m=48
+    python ann_benchmark.py --corpus synthetic --size 1000000 --dim 384 --out ann.json
+
+The chosen spec is then configured via T2SPARQL_RAG_INDEX / T2SPARQL_CORPORATE_INDEX.
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from typing import Dict, List, Tuple
+
+import faiss
+import numpy as np
+
+from t2sparql_ann import INDEX_KINDS, IndexSpec, index_memory
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+CORPORA = ("rag", "corporate", "synthetic")
+DEFAULT_SOURCES = [os.path.join(script_dir, "prod-inst.ttl"), os.path.join(script_dir, "prod-vocab.ttl")]
+
+
+def rag_vectors() -> Tuple[np.ndarray, int]:
+    """Эмбеддинги вопросов RAG-корпуса DBpedia, как в RAGSystem (L2)"""
+    from benchmark import available_datasets
+    from t2sparql_dbpedia_model import RAG_DATASETS, RAGSystem
+    # Индекс RAGSystem по умолчанию - Flat, векторы восстанавливаются из него без потерь;
+    # датасеты те же, что у пайплайна DBpedia (из имеющихся в репозитории)
+    index = RAGSystem(available_datasets(RAG_DATASETS)).index
+    return index.reconstruct_n(0, index.ntotal), faiss.METRIC_L2
+
+
+def corporate_vectors(sources: List[str]) -> Tuple[np.ndarray, int]:
+    """Нормализованные эмбеддинги чанков корпоративного графа, как в GPTEnhancedSemanticSearcher (косинус)"""
+    from sentence_transformers import SentenceTransformer
+    from t2sparql_chunker import StreamingChunker
+    from t2sprql_corporate_model import EMBEDDING_MODEL
+    model = SentenceTransformer(EMBEDDING_MODEL)
+    parts = []
+    StreamingChunker(lambda texts: parts.append(model.encode(texts, normalize_embeddings=True))).run(sources)
+    return np.asarray(np.concatenate(parts), dtype=np.float32), faiss.METRIC_INNER_PRODUCT
+
+
+def synthetic_vectors(size: int, dimension: int, seed: int) -> Tuple[np.ndarray, int]:
+    """Нормализованные векторы из смеси гауссиан - грубая модель кластеров эмбеддингов больших корпусов"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, size // 1000), dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), size)] + 0.5 * rng.standard_normal((size, dimension),
+                                                                                         dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors, faiss.METRIC_INNER_PRODUCT
+
+
+def latency_percentiles(samples: List[float]) -> Dict[str, float]:
+    return {f"p{p}": float(np.percentile(samples, p)) for p in (50, 95, 99)}
+
+
+def measure(spec: IndexSpec, corpus: np.ndarray, queries: np.ndarray, metric: int, k: int,
+            exact: np.ndarray) -> Dict:
+    started = time.perf_counter()
+    index = spec.build(corpus, metric)
+    build_seconds = time.perf_counter() - started
+    memory = index_memory(index)
+
+    single = []
+    for row in range(len(queries)):
+        started = time.perf_counter()
+        index.search(queries[row:row + 1], k)
+        single.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    _, found = index.search(queries, k)
+    batch_seconds = time.perf_counter() - started
+
+    recall = np.mean([len(set(found[row]) & set(exact[row])) / k for row in range(len(queries))])
+    return {
+        "spec": str(spec),
+        "factory": spec.factory_string(len(corpus), corpus.shape[1]),
+        "build_seconds": build_seconds,
+        "index_bytes": memory,
+        "bytes_per_vector": memory / len(corpus),
+        f"recall@{k}": float(recall),
+        "query_latency_seconds": latency_percentiles(single),
+        "batch_qps": len(queries) / batch_seconds if batch_seconds else None,
+    }
+
+
+def run_benchmark(args) -> Dict:
+    if args.corpus == "rag":
+        vectors, metric = rag_vectors()
+    elif args.corpus == "corporate":
+        vectors, metric = corporate_vectors(args.sources)
+    else:
+        vectors, metric = synthetic_vectors(args.size, args.dim, args.seed)
+
+    # Отложенные запросы в индекс не входят, иначе ближайшим соседом всегда оказывался бы сам запрос
+    order = np.random.default_rng(args.seed).permutation(len(vectors))
+    held_out = min(args.queries, len(vectors) // 10 or 1)
+    queries, corpus = vectors[order[:held_out]], vectors[order[held_out:]]
+    _, exact = IndexSpec("flat").build(corpus, metric).search(queries, args.k)
+
+    specs = [IndexSpec.parse(text) for text in (args.index or INDEX_KINDS)]
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "out"},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "faiss": faiss.__version__},
+        "corpus": {"vectors": len(corpus), "queries": len(queries), "dimension": int(corpus.shape[1]),
+                   "metric": "l2" if metric == faiss.METRIC_L2 else "inner_product"},
+        "indexes": [measure(spec, corpus, queries, metric, args.k, exact) for spec in specs],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall / latency / memory benchmark of FAISS index types")
+    parser.add_argument("--corpus", choices=CORPORA, default="rag", help="vectors to index")
+    parser.add_argument("--sources", nargs="*", default=DEFAULT_SOURCES, help="corporate graph TTL files")
+    parser.add_argument("--size", type=int, default=100000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=384, help="synthetic vector dimension")
+    parser.add_argument("--index", action="append",
+                        help="index spec to measure, repeatable (default: every type with default parameters)")
+    parser.add_argument("--queries", type=int, default=500, help="held-out query vectors")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0, help="FAISS OpenMP threads (0 - library default)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+    # RAG-датасеты читаются по относительным путям, как в пайплайне
+    os.chdir(script_dir)
+    report = run_benchmark(args)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
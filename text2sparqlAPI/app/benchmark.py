@@ -0,0 +1,362 @@
+"""
+Offline latency / throughput benchmark of the DBpedia and corporate pipelines.
+
+OpenAI, DBpedia SPARQL and Spotlight are replaced by local stand-ins (t2sparql_bench_services.py) with
+configurable latency, so results are reproducible and comparable between releases:
+
+    python benchmark.py --questions 50 --concurrency 1,4,16 --llm-latency 0.3 --out bench.json
+    python benchmark.py --baseline bench.json   # exit code 1 on regressions
+
+Accuracy of the DBpedia pipeline is the answer F1 of generated queries against the gold queries on the local graph.
+It is measured only with real completions: the stub LLM answers with the gold query, so with it accuracy is "n/a (stub)".
+Staged and fused preprocessing can be compared side by side with real completions via --openai-url. Completions of
+such a run can be recorded once and then replayed offline, so the comparison is repeated without API calls:
+
+    OPENAI_API_KEY=... python benchmark.py --pipelines dbpedia --preprocessing staged,fused \\
+        --openai-url https://api.openai.com/v1 --record-completions completions.json
+    python benchmark.py --pipelines dbpedia --preprocessing staged,fused --replay-completions completions.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from t2sparql_bench_services import DBPEDIA_PREFIXES, BenchmarkCorpus, CompletionRecorder, FakeLLMResponder, \
+    RecordedLLMResponder, fake_openai, seed_graph, sparql_endpoint, spotlight
+from t2sparql_dag import StageExecutor
+from t2sparql_http import HttpTransport
+from t2sparql_metrics import metrics
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_QALD = os.path.join(script_dir, "qald_9_plus_test_dbpedia.json")
+DEFAULT_TRAIN = os.path.join(script_dir, "train-data.json")
+DEFAULT_SOURCES = [os.path.join(script_dir, "prod-inst.ttl"), os.path.join(script_dir, "prod-vocab.ttl")]
+PIPELINES = ("dbpedia", "corporate")
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+    return {"count": len(ordered), "mean": sum(ordered) / len(ordered),
+            "p50": rank(50), "p95": rank(95), "p99": rank(99), "max": ordered[-1]}
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def available_datasets(paths: List[str]) -> List[str]:
+    """
+    Датасеты RAG, которые есть в репозитории: часть (qald_9_plus_train_dbpedia.json) не поставляется,
+    а бенчмарку для сравнения версий достаточно имеющихся. Сервер по-прежнему требует все
+    """
+    available = [path for path in paths if os.path.exists(path)]
+    if not available:
+        raise FileNotFoundError(f"No RAG datasets found: {', '.join(paths)}")
+    return available
+
+
+def build_dbpedia(services: Dict, cache_dir: str, speculative: List[str], preprocessing: str = "staged",
+                  fused_model: str = "gpt-4o"):
+    from t2sparql_dbpedia_model import RAG_DATASETS, DBpediaPipeline
+    return DBpediaPipeline(
+        os.environ.get("OPENAI_API_KEY", "benchmark"),
+        dbpedia_endpoint=f"{services['sparql'].url}/sparql",
+        neighbors_endpoint=f"{services['sparql'].url}/sparql",
+        spotlight_endpoint=f"{services['spotlight'].url}/{{language}}/annotate",
+        cache_dir=cache_dir,
+        transport=HttpTransport(),
+        stage_executor=StageExecutor(speculative=speculative),
+        preprocessing=preprocessing,
+        fused_model=fused_model,
+        rag_datasets=available_datasets(RAG_DATASETS)
+    )
+
+
+def build_corporate(sources: List[str], snapshot_dir: str):
+    from t2sprql_corporate_model import GPTEnhancedSemanticSearcher
+    pipeline = GPTEnhancedSemanticSearcher(openai_api_key=os.environ.get("OPENAI_API_KEY", "benchmark"))
+    if GPTEnhancedSemanticSearcher.snapshot_is_current(snapshot_dir, sources):
+        pipeline.load_snapshot(snapshot_dir)
+    else:
+        pipeline.build_from_ttl(sources)
+        pipeline.save_snapshot(snapshot_dir, source_paths=sources)
+    return pipeline
+
+
+def answer_set(graph, query: Optional[str]):
+    """Ответы запроса на локальном графе (множество значений или результат ASK), None - запрос не выполняется"""
+    if not query:
+        return None
+    try:
+        result = graph.query(query, initNs=DBPEDIA_PREFIXES)
+    except Exception:
+        return None
+    if result.type == "ASK":
+        return {bool(result.askAnswer)}
+    return {str(value) for row in result for value in row if value is not None}
+
+
+def answer_f1(gold, predicted) -> float:
+    if not gold and not predicted:
+        return 1.0
+    if not gold or not predicted:
+        return 0.0
+    common = len(gold & predicted)
+    if not common:
+        return 0.0
+    precision, recall = common / len(predicted), common / len(gold)
+    return 2 * precision * recall / (precision + recall)
+
+
+def accuracy(graph, items: List[Dict], queries: List[Optional[str]]) -> Dict:
+    """Macro F1 по ответам сгенерированных запросов относительно эталонных (как в QALD)"""
+    scores, exact, answered = [], 0, 0
+    for item, query in zip(items, queries):
+        gold = answer_set(graph, item["sparql"])
+        if gold is None:
+            continue
+        predicted = answer_set(graph, query)
+        answered += predicted is not None
+        exact += predicted == gold
+        scores.append(answer_f1(gold, predicted))
+    return {"evaluated": len(scores), "answered": answered, "exact": exact,
+            "macro_f1": sum(scores) / len(scores) if scores else 0.0}
+
+
+async def run_level(kind: str, pipeline, questions: List[str], concurrency: int) -> Dict:
+    """Прогон всех вопросов с ограничением числа одновременных запросов"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    queries: List[Optional[str]] = [None] * len(questions)
+    errors = 0
+
+    async def one(position: int, question: str):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if kind == "dbpedia":
+                    result = await pipeline.aexecute_pipeline(question)
+                    ok = result.get("status") == "success"
+                    queries[position] = result.get("sparql")
+                else:
+                    result = await pipeline.agenerate_sparql(question, top_k=25)
+                    ok = bool(result and result.get("generated_sparql"))
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(position, question) for position, question in enumerate(questions)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "questions": len(questions),
+        "failed": errors,
+        "seconds": elapsed,
+        "throughput_qps": len(questions) / elapsed if elapsed else 0.0,
+        "latency": percentiles(latencies),
+        "queries": queries,
+    }
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Регрессии относительно прошлого отчёта: падение пропускной способности и рост p95 шагов"""
+    regressions = []
+    for name, result in report["pipelines"].items():
+        old = baseline.get("pipelines", {}).get(name)
+        if not old:
+            continue
+        old_levels = {level["concurrency"]: level for level in old.get("throughput", [])}
+        for level in result["throughput"]:
+            previous = old_levels.get(level["concurrency"])
+            if previous and level["throughput_qps"] < previous["throughput_qps"] * (1 - tolerance):
+                regressions.append(f"{name} throughput at concurrency {level['concurrency']}: "
+                                   f"{previous['throughput_qps']:.2f} -> {level['throughput_qps']:.2f} q/s")
+        for stage, stats in result["stages"].items():
+            previous = old.get("stages", {}).get(stage)
+            # Шаги быстрее миллисекунды слишком шумные для сравнения
+            if previous and previous.get("p95", 0) > 0.001 and stats.get("p95", 0) > previous["p95"] * (1 + tolerance):
+                regressions.append(f"{name} stage {stage} p95: {previous['p95']:.4f}s -> {stats['p95']:.4f}s")
+    return regressions
+
+
+async def run_benchmark(args) -> Dict:
+    corpus = BenchmarkCorpus.from_files(args.qald, args.train, args.train_samples, seed=args.seed)
+    items = corpus.items[:args.questions] if args.questions else corpus.items
+    questions = [item["languages"].get(args.language, item["question"]) for item in items]
+
+    graph = seed_graph(corpus)
+    services = {
+        "sparql": sparql_endpoint(graph, args.sparql_latency).start(),
+        "spotlight": spotlight(corpus, args.spotlight_latency).start(),
+    }
+    # Ответы LLM: настоящий API (напрямую или через запись), воспроизведение записи или заглушка
+    responder = None
+    if args.openai_url and args.record_completions:
+        responder = CompletionRecorder(args.openai_url, os.environ.get("OPENAI_API_KEY", ""), args.record_completions)
+    elif args.replay_completions:
+        responder = RecordedLLMResponder(args.replay_completions)
+    elif not args.openai_url:
+        responder = FakeLLMResponder(corpus)
+    if responder is None:
+        os.environ["OPENAI_BASE_URL"] = args.openai_url
+    else:
+        services["openai"] = fake_openai(responder, args.llm_latency, args.llm_jitter).start()
+        os.environ["OPENAI_BASE_URL"] = f"{services['openai'].url}/v1"
+    real_completions = not isinstance(responder, FakeLLMResponder)
+
+    samples: Dict[tuple, List[float]] = {}
+
+    def observe(pipeline, stage, seconds, error):
+        samples.setdefault((pipeline, stage), []).append(seconds)
+
+    metrics.add_observer(observe)
+    work_dir = tempfile.mkdtemp(prefix="t2sparql-bench-")
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("out", "baseline", "openai_url")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "startup": {},
+        "pipelines": {},
+    }
+    try:
+        # Прогоны: корпоративный пайплайн и DBpedia в каждом режиме предобработки ("dbpedia", "dbpedia-fused")
+        runs = []
+        for kind in args.pipelines:
+            if kind == "dbpedia":
+                for mode in args.preprocessing:
+                    name = "dbpedia" if mode == "staged" else f"dbpedia-{mode}"
+                    runs.append((name, kind, lambda mode=mode: build_dbpedia(
+                        services, os.path.join(work_dir, "index_cache"), args.speculative, mode, args.fused_model)))
+            else:
+                runs.append((kind, kind, lambda: build_corporate(args.sources,
+                                                                 os.path.join(work_dir, "corporate_snapshot"))))
+
+        for name, kind, build in runs:
+            # Первая сборка - с нуля (эмбеддинги, индекс), вторая - из кэша / снапшота, как при перезапуске.
+            # Шаги сборки с нуля (например, chunking корпоративного графа) сохраняются отдельно
+            samples.clear()
+            _, cold = timed(build)
+            build_stages = {stage: sum(values) for (pipeline_name, stage), values in sorted(samples.items())
+                            if pipeline_name == kind}
+            pipeline, warm = timed(build)
+            report["startup"][name] = {"cold_seconds": cold, "warm_seconds": warm, "cold_stages": build_stages}
+
+            samples.clear()
+            levels = []
+            for concurrency in args.concurrency:
+                levels.append(await run_level(kind, pipeline, questions, concurrency))
+            report["pipelines"][name] = {
+                "throughput": levels,
+                "stages": {stage: percentiles(values)
+                           for (pipeline_name, stage), values in sorted(samples.items()) if pipeline_name == kind},
+            }
+            report["pipelines"][name]["memory"] = pipeline.memory_usage()
+            if kind == "dbpedia":
+                # Заглушка LLM отвечает эталонным запросом - F1 на ней всегда около 1 и ничего не измеряет
+                report["pipelines"][name]["accuracy"] = (accuracy(graph, items, levels[0]["queries"])
+                                                         if real_completions else "n/a (stub)")
+            for level in levels:
+                del level["queries"]
+            aclose = getattr(pipeline, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    finally:
+        metrics.remove_observer(observe)
+        for service in services.values():
+            service.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if isinstance(responder, CompletionRecorder):
+            responder.save()
+
+    if isinstance(responder, CompletionRecorder):
+        report["completions"] = {"recorded": len(responder.completions)}
+    elif isinstance(responder, RecordedLLMResponder):
+        # Промахи - запросы, которых нет в записи (промпты изменились): точность такого прогона занижена
+        report["completions"] = {"replayed": responder.hits, "missing": responder.misses}
+
+    report["peak_rss_bytes"] = peak_rss_bytes()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Text2SPARQL pipelines")
+    parser.add_argument("--qald", default=DEFAULT_QALD, help="QALD-9-plus questions to replay")
+    parser.add_argument("--train", default=DEFAULT_TRAIN, help="train-data.json for extra samples")
+    parser.add_argument("--train-samples", type=int, default=50, help="questions sampled from train-data.json")
+    parser.add_argument("--questions", type=int, default=0, help="limit on replayed questions (0 - all)")
+    parser.add_argument("--language", default="en", help="question language to replay (translation is stubbed)")
+    parser.add_argument("--pipelines", type=lambda value: value.split(","), default=list(PIPELINES),
+                        help="comma-separated: dbpedia,corporate")
+    parser.add_argument("--speculative", type=lambda value: [v for v in value.split(",") if v],
+                        default=["spotlight_en"], help="speculative DBpedia stages started eagerly: spotlight_en,ner")
+    parser.add_argument("--preprocessing", type=lambda value: value.split(","), default=["staged"],
+                        help="DBpedia preprocessing modes to compare: staged,fused")
+    parser.add_argument("--fused-model", default="gpt-4o", help="model of the fused preprocessing call")
+    parser.add_argument("--openai-url", help="real OpenAI-compatible API (key from OPENAI_API_KEY) instead of the stub")
+    parser.add_argument("--record-completions", help="with --openai-url: save the real completions to this JSON file")
+    parser.add_argument("--replay-completions", help="answer from completions saved by --record-completions (offline)")
+    parser.add_argument("--sources", nargs="*", default=DEFAULT_SOURCES, help="corporate graph TTL files")
+    parser.add_argument("--concurrency", type=lambda value: [int(v) for v in value.split(",")], default=[1, 4, 16],
+                        help="comma-separated concurrency levels")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake OpenAI response latency, seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.05, help="random extra OpenAI latency, seconds")
+    parser.add_argument("--sparql-latency", type=float, default=0.02, help="SPARQL endpoint latency, seconds")
+    parser.add_argument("--spotlight-latency", type=float, default=0.02, help="Spotlight latency, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+    if args.record_completions and not args.openai_url:
+        parser.error("--record-completions requires --openai-url")
+    if args.replay_completions and args.openai_url:
+        parser.error("--replay-completions and --openai-url are mutually exclusive")
+
+    # Пайплайны читают датасеты RAG по относительным путям
+    os.chdir(script_dir)
+    report = asyncio.run(run_benchmark(args))
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        exit_code = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Offline build of the corporate knowledge graph snapshot.
+
+Parses the TTL dumps, builds chunks, embeddings and the FAISS index once and writes them
+into a snapshot directory that the API loads at startup instead of parsing Turtle:
+
+    python build_corporate_snapshot.py --out corporate_snapshot prod-inst.ttl prod-vocab.ttl
+"""
+import argparse
+import os
+import time
+
+from t2sprql_corporate_model import GPTEnhancedSemanticSearcher
+from t2sparql_ann import IndexSpec
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SOURCES = [os.path.join(script_dir, "prod-inst.ttl"), os.path.join(script_dir, "prod-vocab.ttl")]
+DEFAULT_SNAPSHOT_DIR = os.path.join(script_dir, "corporate_snapshot")
+
+
+def build_snapshot(source_paths, snapshot_dir, index_spec=None):
+    started = time.perf_counter()
+
+    # Ключ OpenAI для сборки не нужен: LLM вызывается только при генерации SPARQL
+    searcher = GPTEnhancedSemanticSearcher(openai_api_key="", index_spec=index_spec)
+    searcher.build_from_ttl(source_paths)
+    searcher.save_snapshot(snapshot_dir, source_paths=source_paths)
+
+    print(f"Snapshot with {len(searcher.chunks)} chunks written to {snapshot_dir} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the corporate knowledge graph snapshot")
+    parser.add_argument("sources", nargs="*", default=DEFAULT_SOURCES, help="TTL files of the corporate graph")
+    parser.add_argument("--out", default=DEFAULT_SNAPSHOT_DIR, help="snapshot directory to write")
+    parser.add_argument("--index", default=os.environ.get("T2SPARQL_CORPORATE_INDEX", "flat"),
+                        help="FAISS index type, e.g. flat, sq-fp16, sq-int8, ivf-flat, hnsw:M=32, ivf-pq:m=48")
+    args = parser.parse_args()
+
+    build_snapshot(args.sources, args.out, IndexSpec.parse(args.index))
+
+
+if __name__ == "__main__":
+    main()
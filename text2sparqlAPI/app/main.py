@@ -1,18 +1,113 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
 import os
+import warnings
 import uvicorn
 from t2sparql_dbpedia_model import DBpediaPipeline
 from t2sprql_corporate_model import GPTEnhancedSemanticSearcher
+from t2sparql_registry import PipelineRegistry
+from t2sparql_batch import CORPORATE_TOP_K, generate_batch
+from t2sparql_cache import CompletionCache, SparqlResultCache
+from t2sparql_langid import LanguageRouter
+from t2sparql_http import HttpTransport
+from t2sparql_repair import QueryRepairEngine
+from t2sparql_probe import ValidationProber
+from t2sparql_deadline import Deadline, DeadlineExceeded
+from t2sparql_metrics import metrics
+from t2sparql_dag import StageExecutor
+from t2sparql_progress import ProgressStream
+from t2sparql_ann import IndexSpec
 
 # Получаем путь к директории текущего скрипта
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Создание приложения
-app = FastAPI(title="TEXT2SPARQL API")
-
 # API-ключ для OpenAI
 api_key = ""
 
+# Кэш эмбеддингов и FAISS-индексов между перезапусками
+cache_dir = os.environ.get("T2SPARQL_CACHE_DIR", os.path.join(script_dir, ".index_cache"))
+
+# Кэш ответов LLM: память + SQLite, общий для обоих пайплайнов
+llm_cache = CompletionCache(
+    memory_entries=int(os.environ.get("T2SPARQL_LLM_CACHE_ENTRIES", 2048)),
+    sqlite_path=os.environ.get("T2SPARQL_LLM_CACHE_DB", os.path.join(cache_dir, "llm_cache.sqlite")) or None,
+    ttl=float(os.environ.get("T2SPARQL_LLM_CACHE_TTL", 7 * 24 * 3600))
+)
+
+# Кэш ответов DBpedia SPARQL endpoint (проверка запросов, соседи сущностей);
+# ошибки и пустые результаты хранятся меньше
+sparql_cache = SparqlResultCache(
+    memory_entries=int(os.environ.get("T2SPARQL_SPARQL_CACHE_ENTRIES", 4096)),
+    sqlite_path=os.environ.get("T2SPARQL_SPARQL_CACHE_DB", os.path.join(cache_dir, "sparql_cache.sqlite")) or None,
+    ttl=float(os.environ.get("T2SPARQL_SPARQL_CACHE_TTL", 3600)),
+    negative_ttl=float(os.environ.get("T2SPARQL_SPARQL_CACHE_NEGATIVE_TTL", 300))
+)
+
+# Проверка и исправление сгенерированных запросов: число проверок на вопрос и бюджет времени (секунды)
+repair_engine = QueryRepairEngine(
+    max_attempts=int(os.environ.get("T2SPARQL_REPAIR_ATTEMPTS", 3)),
+    time_budget=float(os.environ.get("T2SPARQL_REPAIR_BUDGET", 20)) or None
+)
+
+# Проверка запросов на endpoint: "probe" - ASK / LIMIT 1 вместо полной выборки, "full" - исходный запрос
+validation_prober = ValidationProber(enabled=os.environ.get("T2SPARQL_VALIDATION_MODE", "probe") == "probe")
+
+# Шаги DBpedia-пайплайна выполняются графом; спекулятивные ветки, запускаемые заранее (через запятую):
+# "spotlight_en" - Spotlight по английскому вопросу до переписывания, "ner" - GPT-4 NER до ответа Spotlight
+stage_executor = StageExecutor(speculative=[
+    name.strip() for name in os.environ.get("T2SPARQL_SPECULATIVE_STAGES", "spotlight_en").split(",") if name.strip()
+])
+
+# Предобработка вопроса DBpedia: "staged" - перевод, уточнение и NER отдельными вызовами GPT-4,
+# "fused" - один структурированный вызов T2SPARQL_FUSED_MODEL
+PREPROCESSING = os.environ.get("T2SPARQL_PREPROCESSING", "staged")
+FUSED_MODEL = os.environ.get("T2SPARQL_FUSED_MODEL", "gpt-4o")
+
+# Типы FAISS-индексов RAG-примеров DBpedia и чанков корпоративного графа: flat, ivf-flat, hnsw, ivf-pq,
+# sq-fp16 / sq-int8 (точный поиск по квантованным векторам - в 2 / 4 раза меньше памяти, чем flat)
+# с параметрами, например "hnsw:M=32,efSearch=64" (выбор по размеру корпуса - ann_benchmark.py)
+RAG_INDEX = IndexSpec.parse(os.environ.get("T2SPARQL_RAG_INDEX", "flat"))
+CORPORATE_INDEX = IndexSpec.parse(os.environ.get("T2SPARQL_CORPORATE_INDEX", "flat"))
+
+# Локальное определение языка: английские вопросы не отправляются на перевод
+language_router = LanguageRouter(threshold=float(os.environ.get("T2SPARQL_ENGLISH_THRESHOLD", 0.65)))
+
+# Общий пул исходящих HTTP-соединений (Spotlight, DBpedia SPARQL) с повторами и circuit breaker
+transport = HttpTransport(
+    timeout=float(os.environ.get("T2SPARQL_HTTP_TIMEOUT", 15)),
+    max_connections_per_host=int(os.environ.get("T2SPARQL_HTTP_CONNECTIONS_PER_HOST", 20)),
+    retries=int(os.environ.get("T2SPARQL_HTTP_RETRIES", 2))
+)
+
+# Параллелизм батчевого эндпоинта по умолчанию и его верхняя граница
+BATCH_CONCURRENCY = int(os.environ.get("T2SPARQL_BATCH_CONCURRENCY", 8))
+MAX_BATCH_CONCURRENCY = 64
+
+# Крайний срок запроса по умолчанию (секунды, 0 - без ограничения) и верхняя граница для заданного клиентом
+REQUEST_TIMEOUT = float(os.environ.get("T2SPARQL_REQUEST_TIMEOUT", 0)) or None
+MAX_REQUEST_TIMEOUT = float(os.environ.get("T2SPARQL_MAX_REQUEST_TIMEOUT", 300))
+
+# Потоковая выдача (SSE): интервал keep-alive комментариев, пока шаги не завершились (секунды)
+SSE_KEEPALIVE = float(os.environ.get("T2SPARQL_SSE_KEEPALIVE", 15))
+
+# Корпоративный граф: исходные TTL и собранный из них снапшот; сколько чанков сущностей, названных в вопросе,
+# закрепляется в контексте до плотного поиска (0 - только плотный поиск)
+CORPORATE_PINNED = int(os.environ.get("T2SPARQL_CORPORATE_PINNED", 10))
+# Гибридный поиск по чанкам: веса плотного поиска и BM25 в reciprocal-rank fusion (0 - ранжирование не используется),
+# константа RRF и число кандидатов из каждого ранжирования
+CORPORATE_DENSE_WEIGHT = float(os.environ.get("T2SPARQL_CORPORATE_DENSE_WEIGHT", 1.0))
+CORPORATE_SPARSE_WEIGHT = float(os.environ.get("T2SPARQL_CORPORATE_SPARSE_WEIGHT", 1.0))
+CORPORATE_RRF_K = int(os.environ.get("T2SPARQL_CORPORATE_RRF_K", 60))
+CORPORATE_FUSION_DEPTH = int(os.environ.get("T2SPARQL_CORPORATE_FUSION_DEPTH", 50))
+corporate_sources = [os.path.join(script_dir, "prod-inst.ttl"), os.path.join(script_dir, "prod-vocab.ttl")]
+corporate_snapshot_dir = os.environ.get("T2SPARQL_CORPORATE_SNAPSHOT", os.path.join(script_dir, "corporate_snapshot"))
+
 # Известные датасеты
 KNOWN_DATASETS = [
     "https://text2sparql.aksw.org/2025/dbpedia/",
@@ -20,22 +115,154 @@ KNOWN_DATASETS = [
 ]
 
 
+def build_dbpedia_pipeline():
+    return DBpediaPipeline(api_key, cache_dir=cache_dir, llm_cache=llm_cache, language_router=language_router,
+                           transport=transport, sparql_cache=sparql_cache,
+                           repair_engine=repair_engine, validation_prober=validation_prober,
+                           stage_executor=stage_executor, preprocessing=PREPROCESSING, fused_model=FUSED_MODEL,
+                           rag_index=RAG_INDEX)
+
+
+def build_corporate_pipeline():
+    pipeline = GPTEnhancedSemanticSearcher(openai_api_key=api_key, llm_cache=llm_cache,
+                                           language_router=language_router, max_pinned=CORPORATE_PINNED,
+                                           dense_weight=CORPORATE_DENSE_WEIGHT, sparse_weight=CORPORATE_SPARSE_WEIGHT,
+                                           rrf_k=CORPORATE_RRF_K, fusion_depth=CORPORATE_FUSION_DEPTH,
+                                           index_spec=CORPORATE_INDEX)
+
+    # Предсобранный снапшот (build_corporate_snapshot.py) грузится без разбора TTL
+    if GPTEnhancedSemanticSearcher.snapshot_is_current(corporate_snapshot_dir, corporate_sources, CORPORATE_INDEX):
+        try:
+            pipeline.load_snapshot(corporate_snapshot_dir)
+            return pipeline
+        except (OSError, ValueError) as e:
+            # Например, другой воркер как раз заменил снапшот: собираем из TTL
+            warnings.warn(f"Corporate snapshot {corporate_snapshot_dir} not loaded: {e}")
+
+    pipeline.build_from_ttl(corporate_sources)
+    # Снапшот только ускоряет следующий запуск: ошибка его записи не мешает работе пайплайна
+    try:
+        pipeline.save_snapshot(corporate_snapshot_dir, source_paths=corporate_sources)
+    except (OSError, RuntimeError) as e:
+        warnings.warn(f"Corporate snapshot {corporate_snapshot_dir} not saved: {e}")
+    return pipeline
+
+
+# Пайплайны строятся один раз на процесс и разделяются между запросами
+registry = PipelineRegistry({
+    KNOWN_DATASETS[0]: build_dbpedia_pipeline,
+    KNOWN_DATASETS[1]: build_corporate_pipeline
+})
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Прогрев идёт в фоне: сервер сразу принимает запросы, /ready показывает готовность
+    warm_up = asyncio.create_task(registry.warm_up())
+    yield
+    warm_up.cancel()
+    await registry.aclose()
+    await transport.aclose()
+
+
+# Создание приложения
+app = FastAPI(title="TEXT2SPARQL API", lifespan=lifespan)
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 when all pipelines are built, 503 otherwise
+    """
+    status = registry.status()
+    if not status["ready"]:
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Prometheus metrics: latency histograms and error counts per pipeline stage (LLM stages are named as in /stats,
+    plus spotlight, neighbours, validation, encode, rag_retrieval, search and the whole pipeline),
+    OpenAI prompt/completion tokens, LLM and SPARQL cache lookups
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/stats")
+async def stats():
+    """
+    Runtime statistics: LLM completion cache hits/misses per pipeline stage, SPARQL result cache hits,
+    query repair loop (remote validations saved by the local syntax check), probe / full validation timings,
+    translation routing per language, circuit breaker state per outbound host, speculative pipeline branches,
+    memory of the built pipelines per component (FAISS index, texts, BM25)
+    """
+    return {
+        "llm_cache": llm_cache.stats(),
+        "sparql_cache": sparql_cache.stats(),
+        "query_repair": repair_engine.stats(),
+        "validation": validation_prober.stats(),
+        "language_routing": language_router.stats(),
+        "circuit_breakers": transport.stats(),
+        "speculation": stage_executor.stats(),
+        "memory": registry.memory_usage()
+    }
+
+
+class BatchItem(BaseModel):
+    question: str
+    dataset: str
+
+
+def request_deadline(timeout: Optional[float], header_timeout: Optional[float]) -> Deadline:
+    """Крайний срок из параметра timeout или заголовка X-Request-Timeout (параметр важнее)"""
+    timeout = timeout if timeout is not None else header_timeout
+    if timeout is None:
+        timeout = REQUEST_TIMEOUT
+    return Deadline(min(timeout, MAX_REQUEST_TIMEOUT) if timeout is not None else None)
+
+
+def extract_query(dataset: str, result: dict) -> str:
+    if dataset == KNOWN_DATASETS[0]:
+        return result['sparql'].replace('\n', '')
+    return result['generated_sparql'].replace('\n', '')
+
+
+def build_response(dataset: str, question: str, result: dict, deadline: Deadline) -> dict:
+    if dataset == KNOWN_DATASETS[0] and "sparql" not in result and deadline.expired():
+        raise DeadlineExceeded(f"Request deadline of {deadline.timeout}s exceeded")
+
+    response = {
+        "dataset": dataset,
+        "question": question,
+        "query": extract_query(dataset, result)
+    }
+    if result.get("degraded"):
+        response["degraded"] = True
+    return response
+
+
 @app.get("/generate-sparql-get")
-async def generate_sparql_get(question: str, dataset: str):
+async def generate_sparql_get(question: str, dataset: str,
+                              timeout: Optional[float] = Query(None, gt=0, description="Request deadline, seconds"),
+                              x_request_timeout: Optional[float] = Header(None, gt=0)):
     """
-    GET-method to generate SPARQL
+    GET-method to generate SPARQL.
+    With a deadline (timeout parameter or X-Request-Timeout header) optional stages are skipped when time runs low;
+    such answers carry "degraded": true
     """
+    deadline = request_deadline(timeout, x_request_timeout)
+
     if dataset == KNOWN_DATASETS[0]:
 
         try:
-            pipeline = DBpediaPipeline(api_key)
-            sparql_query = pipeline.execute_pipeline(question)
+            pipeline = await run_in_threadpool(registry.get, dataset)
+            sparql_query = await pipeline.aexecute_pipeline(question, deadline=deadline)
+            return build_response(dataset, question, sparql_query, deadline)
 
-            return {
-                "dataset": dataset,
-                "question": question,
-                "query": sparql_query['sparql'].replace('\n', '')
-            }
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
 
         except Exception as e:
             raise HTTPException(
@@ -45,19 +272,13 @@ async def generate_sparql_get(question: str, dataset: str):
 
     elif dataset == KNOWN_DATASETS[1]:
         try:
-            pipeline = GPTEnhancedSemanticSearcher(openai_api_key=api_key)
-
-            pipeline.load_ttl(["prod-inst.ttl", "prod-vocab.ttl"])
-            pipeline.create_chunks()
-            pipeline.build_index()
-
-            sparql_query = pipeline.generate_sparql(question, top_k=25)
+            pipeline = await run_in_threadpool(registry.get, dataset)
+            with deadline.activate():
+                sparql_query = await pipeline.agenerate_sparql(question, top_k=CORPORATE_TOP_K)
+            return build_response(dataset, question, sparql_query, deadline)
 
-            return {
-                "dataset": dataset,
-                "question": question,
-                "query": sparql_query['generated_sparql'].replace('\n', '')
-            }
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
 
         except Exception as e:
             raise HTTPException(
@@ -70,5 +291,124 @@ async def generate_sparql_get(question: str, dataset: str):
             detail=f"Unknown dataset. Supported datasets: {', '.join(KNOWN_DATASETS)}"
         )
 
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/generate-sparql-stream")
+async def generate_sparql_stream(request: Request, question: str, dataset: str,
+                                 timeout: Optional[float] = Query(None, gt=0, description="Request deadline, seconds"),
+                                 x_request_timeout: Optional[float] = Header(None, gt=0)):
+    """
+    Streaming variant of /generate-sparql-get (Server-Sent Events).
+    Events: "translated", "clarified", "tagged", "uris", "candidate", "validation" as stages finish,
+    "token" for the SPARQL generation completion, then "result" (the /generate-sparql-get payload) or "error".
+    Closing the connection cancels the in-flight OpenAI / Spotlight / SPARQL calls
+    """
+    if dataset not in KNOWN_DATASETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown dataset. Supported datasets: {', '.join(KNOWN_DATASETS)}"
+        )
+
+    deadline = request_deadline(timeout, x_request_timeout)
+    # Ошибка сборки пайплайна - до начала потока, поэтому ответ такой же, как у /generate-sparql-get
+    try:
+        pipeline = await run_in_threadpool(registry.get, dataset)
+
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error during SPARQL generating: {str(e)} for dataset {dataset}"
+        )
+    progress = ProgressStream()
+
+    async def run():
+        try:
+            with progress.activate(), deadline.activate():
+                if dataset == KNOWN_DATASETS[0]:
+                    return await pipeline.aexecute_pipeline(question, deadline=deadline)
+                return await pipeline.agenerate_sparql(question, top_k=CORPORATE_TOP_K)
+        finally:
+            progress.close()
+
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            async for item in progress.events(keepalive=SSE_KEEPALIVE):
+                if item is None:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_event(*item)
+
+            try:
+                yield sse_event("result", build_response(dataset, question, await task, deadline))
+            except DeadlineExceeded as e:
+                yield sse_event("error", {"status": 504, "detail": str(e)})
+            except Exception as e:
+                yield sse_event("error", {
+                    "status": 500,
+                    "detail": f"Error during SPARQL generating: {str(e)} for dataset {dataset}"
+                })
+        finally:
+            # Клиент отключился раньше: незавершённые вызовы отменяются
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/generate-sparql-batch")
+async def generate_sparql_batch(items: List[BatchItem],
+                                concurrency: int = Query(BATCH_CONCURRENCY, ge=1, le=MAX_BATCH_CONCURRENCY)):
+    """
+    POST-method to generate SPARQL for many questions.
+    Results are streamed as NDJSON lines in completion order, each line carries the item index
+    """
+    pipelines = {}
+    # Ошибка сборки пайплайна не прерывает пакет: вопросы этого датасета получают строки с ошибкой
+    errors = {}
+    for dataset in {item.dataset for item in items if item.dataset in registry}:
+        try:
+            pipelines[dataset] = await run_in_threadpool(registry.get, dataset)
+        except Exception as e:
+            errors[dataset] = f"Error during SPARQL generating: {str(e)} for dataset {dataset}"
+
+    async def stream():
+        known = [(index, item) for index, item in enumerate(items) if item.dataset in pipelines]
+
+        for index, item in enumerate(items):
+            if item.dataset not in pipelines:
+                yield json.dumps({
+                    "index": index,
+                    "dataset": item.dataset,
+                    "question": item.question,
+                    "error": errors.get(item.dataset,
+                                        f"Unknown dataset. Supported datasets: {', '.join(KNOWN_DATASETS)}")
+                }, ensure_ascii=False) + "\n"
+
+        batch = [(item.question, pipelines[item.dataset]) for _, item in known]
+        async for position, result in generate_batch(batch, concurrency):
+            index, item = known[position]
+            line = {"index": index, "dataset": item.dataset, "question": item.question}
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                line["query"] = extract_query(item.dataset, result)
+            except Exception as e:
+                line["error"] = f"Error during SPARQL generating: {str(e)} for dataset {item.dataset}"
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
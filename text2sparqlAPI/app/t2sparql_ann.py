@@ -0,0 +1,134 @@
+import math
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+# Параметры каждого типа индекса и значения по умолчанию; 0 - подобрать по размеру корпуса
+INDEX_KINDS = {
+    "flat": {},
+    "ivf-flat": {"nlist": 0, "nprobe": 16},
+    "hnsw": {"M": 32, "efConstruction": 80, "efSearch": 64},
+    "ivf-pq": {"nlist": 0, "nprobe": 16, "m": 0, "nbits": 8},
+    # Точный перебор по скалярно квантованным векторам: float16 (в 2 раза меньше float32) и int8 (в 4 раза)
+    "sq-fp16": {},
+    "sq-int8": {},
+}
+SCALAR_QUANTIZERS = {"sq-fp16": "SQfp16", "sq-int8": "SQ8"}
+# Параметры поиска: на построенный индекс не влияют, поэтому не входят в ключ кэша
+SEARCH_PARAMS = ("nprobe", "efSearch")
+# faiss рекомендует не меньше 39 обучающих векторов на центроид k-means
+MIN_POINTS_PER_CENTROID = 39
+
+
+class IndexSpec:
+    """
+    Тип FAISS-индекса и его параметры, задаются строкой конфигурации: "flat", "hnsw:M=48,efSearch=128",
+    "ivf-pq:nlist=1024,m=48,nprobe=32". Индексы IVF и PQ обучаются при построении на самом корпусе
+    """
+
+    def __init__(self, kind: str = "flat", **params):
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index type {kind!r}, expected one of {tuple(INDEX_KINDS)}")
+        unknown = set(params) - set(INDEX_KINDS[kind])
+        if unknown:
+            raise ValueError(f"Unknown parameters for {kind} index: {', '.join(sorted(unknown))}")
+        self.kind = kind
+        self.params: Dict[str, int] = {**INDEX_KINDS[kind], **{name: int(value) for name, value in params.items()}}
+
+    @classmethod
+    def parse(cls, text: Optional[str]) -> "IndexSpec":
+        kind, _, options = (text or "flat").strip().lower().partition(":")
+        params = {}
+        for option in filter(None, (item.strip() for item in options.split(","))):
+            name, _, value = option.partition("=")
+            # Имена параметров faiss регистрозависимы (M, efSearch), а строка конфигурации - нет
+            name = next((known for known in INDEX_KINDS.get(kind, {}) if known.lower() == name.strip()), name.strip())
+            params[name] = value.strip()
+        return cls(kind, **params)
+
+    def __str__(self) -> str:
+        options = ",".join(f"{name}={value}" for name, value in sorted(self.params.items()))
+        return f"{self.kind}:{options}" if options else self.kind
+
+    def __repr__(self) -> str:
+        return f"IndexSpec({str(self)!r})"
+
+    def build_key(self) -> str:
+        """Описание для ключей кэша и манифестов снапшотов: без параметров поиска"""
+        options = ",".join(f"{name}={value}" for name, value in sorted(self.params.items())
+                           if name not in SEARCH_PARAMS)
+        return f"{self.kind}:{options}" if options else self.kind
+
+    def factory_string(self, count: int, dimension: int) -> str:
+        """Строка для faiss.index_factory с параметрами, подобранными под размер корпуса"""
+        if self.kind == "flat":
+            return "Flat"
+        if self.kind == "hnsw":
+            return f"HNSW{self.params['M']}"
+        if self.kind in SCALAR_QUANTIZERS:
+            return SCALAR_QUANTIZERS[self.kind]
+
+        nlist = self.params["nlist"] or round(4 * math.sqrt(count))
+        if not self.params["nlist"]:
+            nlist = min(nlist, count // MIN_POINTS_PER_CENTROID)
+        nlist = max(1, min(nlist, count))
+        if self.kind == "ivf-flat":
+            return f"IVF{nlist},Flat"
+
+        m = self.params["m"] or next(size for size in (dimension // 4, dimension // 2, dimension)
+                                     if size and dimension % size == 0)
+        if dimension % m:
+            raise ValueError(f"PQ m={m} must divide the embedding dimension {dimension}")
+        # Кодовая книга PQ обучается k-means на 2^nbits центроидов - их не может быть больше векторов
+        nbits = max(1, min(self.params["nbits"], int(math.log2(max(count, 2)))))
+        return f"IVF{nlist},PQ{m}x{nbits}"
+
+    def build(self, vectors: np.ndarray, metric: int = faiss.METRIC_L2) -> faiss.Index:
+        """
+        Построение, обучение (IVF, PQ, int8 - диапазоны значений) и заполнение индекса.
+        Индекс хранит собственную копию векторов (или их коды), поэтому исходную матрицу после этого можно не держать
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        index = faiss.index_factory(vectors.shape[1], self.factory_string(len(vectors), vectors.shape[1]), metric)
+        if self.kind == "hnsw":
+            faiss.downcast_index(index).hnsw.efConstruction = self.params["efConstruction"]
+        if not index.is_trained:
+            if not len(vectors):
+                raise ValueError(f"{self.kind} index needs training vectors, the corpus is empty")
+            index.train(vectors)
+        index.add(vectors)
+        return self.configure(index)
+
+    def configure(self, index: faiss.Index) -> faiss.Index:
+        """Параметры поиска; вызывается и для индекса, загруженного из кэша или снапшота"""
+        if self.kind in ("ivf-flat", "ivf-pq"):
+            faiss.extract_index_ivf(index).nprobe = self.params["nprobe"]
+        elif self.kind == "hnsw":
+            faiss.downcast_index(index).hnsw.efSearch = self.params["efSearch"]
+        return index
+
+
+def index_memory(index: faiss.Index) -> int:
+    """
+    Память под данные индекса: коды векторов, списки IVF с id, граф HNSW, центроиды и кодовые книги.
+    Считается по размерам структур, без сериализации (она скопировала бы весь индекс)
+    """
+    # Обёртка downcast_index не владеет индексом: исходный объект должен жить до конца подсчёта
+    concrete = faiss.downcast_index(index)
+    if isinstance(concrete, faiss.IndexHNSW):
+        hnsw = concrete.hnsw
+        graph = hnsw.neighbors.size() * 4 + hnsw.offsets.size() * 8 + hnsw.levels.size() * 4
+        return int(graph) + index_memory(concrete.storage)
+
+    ivf = faiss.try_extract_index_ivf(concrete)
+    if ivf is not None:
+        ivf = faiss.downcast_index(ivf)
+        lists = ivf.invlists.compute_ntotal() * (ivf.code_size + 8)
+        codebooks = ivf.pq.centroids.size() * 4 if isinstance(ivf, faiss.IndexIVFPQ) else 0
+        return int(lists + codebooks) + index_memory(ivf.quantizer)
+
+    if isinstance(concrete, faiss.IndexFlatCodes):
+        trained = concrete.sq.trained.size() * 4 if isinstance(concrete, faiss.IndexScalarQuantizer) else 0
+        return int(concrete.codes.size() + trained)
+    return int(faiss.serialize_index(concrete).nbytes)
@@ -0,0 +1,87 @@
+import asyncio
+import os
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from t2sparql_dbpedia_model import DBpediaPipeline
+from t2sprql_corporate_model import GPTEnhancedSemanticSearcher
+
+# top_k поиска по корпоративному графу и RAG-примеров DBpedia, как в одиночном запросе.
+# Чанки сущностей, названных в вопросе, добавляются к top_k корпоративного поиска, а коды и названия находит BM25,
+# поэтому top_k меньше, чем при одном плотном поиске (был 25)
+CORPORATE_TOP_K = int(os.environ.get("T2SPARQL_CORPORATE_TOP_K", 10))
+DBPEDIA_RAG_TOP_K = 7
+
+
+async def generate_batch(items: List[Tuple[str, Any]], concurrency: int = 8) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Генерация SPARQL для списка (вопрос, пайплайн).
+
+    1) переводы всех вопросов выполняются параллельно (не больше concurrency одновременных вызовов);
+       для DBpedia с объединённой предобработкой (preprocessing="fused") перевод входит в её единственный вызов,
+       поэтому заранее не выполняется, и RAG-поиск для таких вопросов делает сам пайплайн;
+    2) RAG-поиск для каждого пайплайна делается одним батчем: один encode и один index.search;
+    3) остальные шаги идут параллельно, результаты отдаются по мере готовности.
+
+    Возвращает пары (номер элемента, результат пайплайна или исключение).
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def bounded(coroutine_fn, *args, **kwargs):
+        async with semaphore:
+            return await coroutine_fn(*args, **kwargs)
+
+    async def translate(question: str, pipeline):
+        if isinstance(pipeline, DBpediaPipeline) and pipeline.preprocessing == "fused":
+            return None
+        return await bounded(pipeline.ato_english, question)
+
+    # Шаг 1: перевод (английские вопросы проходят без обращения к LLM)
+    translated = await asyncio.gather(
+        *(translate(question, pipeline) for question, pipeline in items),
+        return_exceptions=True
+    )
+
+    # Шаг 2: батчевый RAG-поиск по каждому пайплайну
+    retrieved: Dict[int, Any] = {}
+    groups: Dict[int, List[int]] = {}
+    for position, (question, pipeline) in enumerate(items):
+        if translated[position] is not None and not isinstance(translated[position], Exception):
+            groups.setdefault(id(pipeline), []).append(position)
+
+    for positions in groups.values():
+        pipeline = items[positions[0]][1]
+        questions = [translated[position] for position in positions]
+        try:
+            if isinstance(pipeline, DBpediaPipeline):
+                contexts = await asyncio.to_thread(pipeline.rag.get_context_batch, questions, top_k=DBPEDIA_RAG_TOP_K)
+            else:
+                contexts = await asyncio.to_thread(pipeline.search_batch, questions, CORPORATE_TOP_K)
+        except Exception as e:
+            contexts = [e] * len(positions)
+        retrieved.update(zip(positions, contexts))
+
+    # Шаг 3: остальные шаги пайплайна
+    async def finish(position: int):
+        question, pipeline = items[position]
+        for value in (translated[position], retrieved.get(position)):
+            if isinstance(value, Exception):
+                return position, value
+        try:
+            if isinstance(pipeline, GPTEnhancedSemanticSearcher):
+                result = await bounded(pipeline.agenerate_sparql, question, CORPORATE_TOP_K,
+                                       translated_question=translated[position], rag_results=retrieved[position])
+            else:
+                result = await bounded(pipeline.aexecute_pipeline, question, en_question=translated[position],
+                                       rag_context=retrieved.get(position))
+            return position, result
+        except Exception as e:
+            return position, e
+
+    tasks = [asyncio.ensure_future(finish(position)) for position in range(len(items))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Клиент отключился - незавершённые элементы больше не нужны
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,424 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from rdflib import Graph, Literal, URIRef, Variable
+from rdflib.namespace import RDFS
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.parserutils import CompValue
+
+# Префиксы, которые DBpedia (Virtuoso) знает без объявления в запросе
+DBPEDIA_PREFIXES = {
+    "dbo": "http://dbpedia.org/ontology/",
+    "dbr": "http://dbpedia.org/resource/",
+    "res": "http://dbpedia.org/resource/",
+    "dbp": "http://dbpedia.org/property/",
+    "dbc": "http://dbpedia.org/resource/Category:",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
+    "owl": "http://www.w3.org/2002/07/owl#",
+    "xsd": "http://www.w3.org/2001/XMLSchema#",
+    "foaf": "http://xmlns.com/foaf/0.1/",
+    "skos": "http://www.w3.org/2004/02/skos/core#",
+    "dct": "http://purl.org/dc/terms/",
+    "yago": "http://dbpedia.org/class/yago/",
+}
+
+RESOURCE_NS = "http://dbpedia.org/resource/"
+RESOURCE_URI = re.compile(r'(?:<http://dbpedia\.org/resource/([^>\s]+)>|\b(?:dbr|res):([\w()\-.,%]+))')
+
+# Ответ корпоративного пайплайна: граф заглушкой не моделируется
+CORPORATE_QUERY = "SELECT DISTINCT ?s WHERE { ?s ?p ?o } LIMIT 10"
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r'[<>"]', '', text).split()).lower()
+
+
+class BenchmarkCorpus:
+    """
+    Вопросы с эталонными запросами (QALD и выборка train-data.json), по которым заглушки LLM и Spotlight
+    отвечают так, как ответила бы модель, знающая правильный запрос
+    """
+
+    def __init__(self, items: List[Dict]):
+        self.items = items
+        self._by_text: Dict[str, Dict] = {}
+        for item in items:
+            for text in [item["question"], item.get("tagged")] + item.get("variants", []):
+                if text:
+                    self._by_text.setdefault(_normalize(text), item)
+
+    @classmethod
+    def from_files(cls, qald_path: str, train_path: Optional[str] = None, train_samples: int = 0,
+                   seed: int = 0) -> "BenchmarkCorpus":
+        items = []
+        with open(qald_path, encoding="utf-8") as f:
+            for question in json.load(f)["questions"]:
+                strings = [q["string"] for q in question["question"] if q.get("string")]
+                english = next((q["string"] for q in question["question"] if q.get("language") == "en"), None)
+                if not english or not question.get("query", {}).get("sparql"):
+                    continue
+                bindings = []
+                for answer in question.get("answers", []):
+                    bindings = answer.get("results", {}).get("bindings", [])
+                items.append({
+                    "id": f"qald-{question['id']}",
+                    "question": english,
+                    "variants": [text for text in strings if text != english],
+                    "languages": {q["language"]: q["string"] for q in question["question"] if q.get("string")},
+                    "sparql": question["query"]["sparql"],
+                    "bindings": bindings,
+                })
+
+        if train_path and train_samples:
+            with open(train_path, encoding="utf-8") as f:
+                train = json.load(f)
+            for row in random.Random(seed).sample(train, min(train_samples, len(train))):
+                if row.get("corrected_question") and row.get("sparql_query"):
+                    items.append({
+                        "id": f"train-{row['_id']}",
+                        "question": row["corrected_question"],
+                        "tagged": row.get("intermediary_question"),
+                        "languages": {"en": row["corrected_question"]},
+                        "sparql": row["sparql_query"],
+                        "bindings": [],
+                    })
+        return cls(items)
+
+    def find(self, text: Optional[str]) -> Optional[Dict]:
+        if not text:
+            return None
+        return self._by_text.get(_normalize(text))
+
+    @staticmethod
+    def resources(item: Dict) -> Dict[str, str]:
+        """Ресурсы эталонного запроса: подпись -> URI"""
+        found = {}
+        for match in RESOURCE_URI.finditer(item["sparql"]):
+            local = match.group(1) or match.group(2)
+            found[local.replace("_", " ")] = RESOURCE_NS + local
+        return found
+
+    def tagged_question(self, item: Dict) -> str:
+        if item.get("tagged"):
+            return item["tagged"]
+        tagged = item["question"]
+        for label in self.resources(item):
+            tagged = re.sub(re.escape(label), f"<{label}>", tagged, count=1, flags=re.IGNORECASE)
+        return tagged
+
+
+class FakeLLMResponder:
+    """
+    Ответы на запросы пайплайнов без обращения к OpenAI: тип запроса определяется по системному промпту,
+    вопрос - по месту, куда его подставляет пайплайн
+    """
+
+    # Где пайплайн подставляет вопрос в промпт; берётся последнее совпадение (примеры в промптах идут раньше)
+    SLOTS = {
+        "translate": r'Translate this to English exactly:\s*(.*)\Z',
+        "clarify": r'GIVEN QUESTION:[ \t]*([^\n]*)',
+        "entities": r'Question:[ \t]*([^\n]*)\nProvide output',
+        "uris": r'Tagged question:[ \t]*([^\n]*)',
+        "generation": r'Original Question:[ \t]*"([^\n]*)"',
+        "repair": r'- Question:[ \t]*([^\n]*)',
+        "corporate": r'A question for generating a query:\s*"([^\n]*)"',
+        "fused": r'Input question:[ \t]*([^\n]*)',
+    }
+
+    def __init__(self, corpus: BenchmarkCorpus):
+        self.corpus = corpus
+
+    def _kind(self, system: str, user: str) -> str:
+        if "question pre-processor" in system:
+            return "fused"
+        if "translation engine" in system:
+            return "translate"
+        if "clarified question" in system:
+            return "clarify"
+        if "named entity recognizer" in system:
+            return "entities"
+        if "URI Conversion" in system:
+            return "uris"
+        if "error correction expert" in system:
+            return "correction"
+        if "SPARQL repair expert" in system:
+            return "repair"
+        if "precise SPARQL query generator" in system:
+            return "generation"
+        if "expert SPARQL query generator" in system:
+            return "corporate"
+        return "unknown"
+
+    def _item(self, kind: str, user: str) -> Optional[Dict]:
+        pattern = self.SLOTS.get("generation" if kind == "correction" else kind)
+        matches = re.findall(pattern, user, re.DOTALL) if pattern else []
+        return self.corpus.find(matches[-1].strip()) if matches else None
+
+    def __call__(self, messages: List[Dict], request: Optional[Dict] = None) -> str:
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user = "\n".join(m["content"] for m in messages if m["role"] == "user")
+        kind = self._kind(system, user)
+        item = self._item(kind, user)
+
+        if kind == "translate":
+            return item["question"] if item else re.search(self.SLOTS["translate"], user, re.DOTALL).group(1).strip()
+        if kind == "clarify":
+            return item["question"] if item else ""
+        if kind == "fused":
+            question = item["question"] if item else re.findall(self.SLOTS["fused"], user)[-1].strip()
+            return json.dumps({
+                "english_question": question,
+                "clarified_question": question,
+                "analysis": "The question asks about the tagged entities.",
+                "intermediary_question": self.corpus.tagged_question(item) if item else question,
+            })
+        if kind == "corporate":
+            return f"```sparql\n{CORPORATE_QUERY}\n```"
+        if item is None:
+            return ""
+        if kind == "entities":
+            return (f"Let's think step by step. In the question \"{item['question']}\", we are asked about the "
+                    f"entities of the question.\nSo the intermediary_question is: {self.corpus.tagged_question(item)}")
+        if kind == "uris":
+            return "\n".join(f"- <{label}> : {uri}" for label, uri in self.corpus.resources(item).items())
+        if kind == "generation":
+            return f"Thought Process: the answer follows from the linked entities.\nSPARQL: {item['sparql']}"
+        if kind == "correction":
+            return f"ANALYSIS:\n1. No issues.\n\nCORRECTED SPARQL:\n{item['sparql']}"
+        if kind == "repair":
+            return item["sparql"]
+        return ""
+
+
+def completion_key(request: Dict) -> str:
+    """Ключ записанного ответа: модель, сообщения и формат ответа (stream и прочие параметры не влияют)"""
+    fields = {name: request.get(name) for name in ("model", "messages", "response_format")}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class CompletionRecorder:
+    """
+    Прокси к настоящему OpenAI-совместимому API, сохраняющий ответы в JSON-файл (ключ - completion_key).
+    Записанный один раз прогон затем воспроизводится офлайн через RecordedLLMResponder
+    """
+
+    def __init__(self, base_url: str, api_key: str, path: str):
+        from openai import OpenAI
+        self.client = OpenAI(base_url=base_url, api_key=api_key)
+        self.path = path
+        self.completions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, messages: List[Dict], request: Optional[Dict] = None) -> str:
+        request = dict(request or {"messages": messages})
+        for name in ("stream", "stream_options"):
+            request.pop(name, None)
+        content = self.client.chat.completions.create(**request).choices[0].message.content or ""
+        with self._lock:
+            self.completions[completion_key(request)] = content
+        return content
+
+    def save(self):
+        with self._lock, open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.completions, f, ensure_ascii=False, indent=1)
+
+
+class RecordedLLMResponder:
+    """
+    Ответы из записи CompletionRecorder. Запрос, которого нет в записи (промпт изменился после записи),
+    получает пустой ответ и учитывается в misses - такой прогон нужно перезаписать
+    """
+
+    def __init__(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            self.completions: Dict[str, str] = json.load(f)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, messages: List[Dict], request: Optional[Dict] = None) -> str:
+        content = self.completions.get(completion_key(request or {"messages": messages}))
+        with self._lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return content or ""
+
+
+def seed_graph(corpus: BenchmarkCorpus) -> Graph:
+    """
+    Граф для локального SPARQL endpoint: тройки базовых шаблонов эталонных запросов, где переменные
+    заменены значениями из эталонных ответов (или синтетическими ресурсами), плюс rdfs:label ресурсов
+    """
+    graph = Graph()
+
+    def patterns(node):
+        if isinstance(node, CompValue):
+            if node.name == "BGP":
+                yield from node.get("triples", [])
+            for value in node.values():
+                yield from patterns(value)
+        elif isinstance(node, (list, tuple)):
+            for value in node:
+                yield from patterns(value)
+
+    for item in corpus.items:
+        try:
+            query = prepareQuery(item["sparql"], initNs=DBPEDIA_PREFIXES)
+        except Exception:
+            continue
+        binding = item["bindings"][0] if item["bindings"] else {}
+
+        def instantiate(term):
+            if not isinstance(term, Variable):
+                return term
+            value = binding.get(str(term))
+            if value is None:
+                return URIRef(f"{RESOURCE_NS}Bench_{item['id']}_{term}")
+            if value.get("type") == "uri":
+                return URIRef(value["value"])
+            return Literal(value["value"], datatype=value.get("datatype"), lang=value.get("xml:lang"))
+
+        for s, p, o in patterns(query.algebra):
+            if not isinstance(p, (URIRef, Variable)):
+                continue
+            s, p, o = instantiate(s), instantiate(p), instantiate(o)
+            if isinstance(s, Literal) or isinstance(p, Literal):
+                continue
+            graph.add((s, p, o))
+            for node in (s, o):
+                if isinstance(node, URIRef) and str(node).startswith(RESOURCE_NS):
+                    graph.add((node, RDFS.label, Literal(str(node)[len(RESOURCE_NS):].replace("_", " "), lang="en")))
+    return graph
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _delay(self):
+        latency, jitter = self.server.latency, self.server.jitter
+        if latency or jitter:
+            time.sleep(latency + random.uniform(0, jitter))
+
+
+class _OpenAIHandler(_Handler):
+    def do_POST(self):
+        request = json.loads(self._body() or b"{}")
+        content = self.server.responder(request.get("messages", []), request)
+        self._delay()
+        prompt_tokens = sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        header = {"id": "chatcmpl-bench", "created": int(time.time()), "model": request.get("model", "gpt-4")}
+
+        if request.get("stream"):
+            # Потоковый ответ: фрагменты по словам, в конце usage (stream_options.include_usage) и [DONE]
+            chunks = [dict(header, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}])
+                for piece in re.findall(r'\s*\S+', content)]
+            chunks.append(dict(header, object="chat.completion.chunk",
+                               choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            chunks.append(dict(header, object="chat.completion.chunk", choices=[], usage=usage))
+            body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            self._reply(200, body.encode("utf-8"), "text/event-stream")
+            return
+
+        self._reply(200, json.dumps(dict(
+            header, object="chat.completion", usage=usage,
+            choices=[{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+        )).encode("utf-8"))
+
+
+class _SparqlHandler(_Handler):
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query).get("query", [""])[0]
+        self._delay()
+        try:
+            with self.server.lock:
+                body = self.server.graph.query(query, initNs=DBPEDIA_PREFIXES).serialize(format="json")
+        except Exception as e:
+            self._reply(400, f"Virtuoso 37000 Error SP030: {e}".encode("utf-8"), "text/plain")
+            return
+        self._reply(200, body, "application/sparql-results+json")
+
+
+class _SpotlightHandler(_Handler):
+    def do_POST(self):
+        text = parse_qs(self._body().decode("utf-8")).get("text", [""])[0]
+        self._delay()
+        item = self.server.corpus.find(text)
+        resources = []
+        if item is not None:
+            for label, uri in self.server.corpus.resources(item).items():
+                offset = text.lower().find(label.lower())
+                if offset >= 0:
+                    resources.append({"@URI": uri, "@surfaceForm": text[offset:offset + len(label)],
+                                      "@offset": str(offset), "@types": ""})
+        self._reply(200, json.dumps({"@text": text, "Resources": resources} if resources else {"@text": text})
+                    .encode("utf-8"))
+
+
+class StubService:
+    """HTTP-заглушка в потоке текущего процесса с настраиваемой задержкой ответа"""
+
+    def __init__(self, handler, latency: float = 0.0, jitter: float = 0.0, **attributes):
+        self.server = _Server(("127.0.0.1", 0), handler)
+        self.server.latency = latency
+        self.server.jitter = jitter
+        for name, value in attributes.items():
+            setattr(self.server, name, value)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self) -> "StubService":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fake_openai(responder: Callable[[List[Dict], Optional[Dict]], str], latency: float = 0.0, jitter: float = 0.0) -> StubService:
+    """Сервер, совместимый с OpenAI /v1/chat/completions (base_url клиента: url + /v1)"""
+    return StubService(_OpenAIHandler, latency, jitter, responder=responder)
+
+
+def sparql_endpoint(graph: Graph, latency: float = 0.0, jitter: float = 0.0) -> StubService:
+    """SPARQL endpoint на rdflib (GET ?query=..., ответы в application/sparql-results+json)"""
+    return StubService(_SparqlHandler, latency, jitter, graph=graph, lock=threading.Lock())
+
+
+def spotlight(corpus: BenchmarkCorpus, latency: float = 0.0, jitter: float = 0.0) -> StubService:
+    """DBpedia Spotlight /{language}/annotate, размечающий ресурсы эталонного запроса"""
+    return StubService(_SpotlightHandler, latency, jitter, corpus=corpus)
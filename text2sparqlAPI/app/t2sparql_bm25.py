@@ -0,0 +1,98 @@
+import math
+import re
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+# Составные токены: коды деталей (bom-part-1-C247-3833661), QName (prodi:hw-A145-1240844), числа с разделителями
+COMPOUND_TOKEN = re.compile(r'\w+(?:[-.:/]\w+)*')
+TOKEN_PARTS = re.compile(r'[-.:/]')
+
+
+def tokenize(text: str) -> List[str]:
+    """Составной токен целиком, без префикса QName и по частям - код находится и целиком, и по фрагменту"""
+    tokens = []
+    for match in COMPOUND_TOKEN.finditer(text.lower()):
+        token = match.group(0)
+        tokens.append(token)
+        parts = TOKEN_PARTS.split(token)
+        if len(parts) > 1:
+            if ":" in token:
+                tokens.append(token.split(":", 1)[1])
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class BM25Index:
+    """Инвертированный индекс Okapi BM25 по чанкам; списки документов и частот хранятся массивами numpy"""
+
+    def __init__(self, documents: Iterable[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for doc_id, document in enumerate(documents):
+            tokens = tokenize(document)
+            lengths.append(len(tokens))
+            for token, count in Counter(tokens).items():
+                postings.setdefault(token, []).append((doc_id, count))
+
+        self.count = len(lengths)
+        self.lengths = np.array(lengths, dtype=np.float32)
+        average = float(self.lengths.mean()) if self.count else 0.0
+        # Нормировка длины документа считается один раз
+        self._norm = k1 * (1 - b + b * self.lengths / average) if average else np.full(self.count, k1, np.float32)
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray, float]] = {}
+        for token, items in postings.items():
+            doc_ids = np.array([doc_id for doc_id, _ in items], dtype=np.int32)
+            freqs = np.array([count for _, count in items], dtype=np.float32)
+            idf = math.log(1 + (self.count - len(items) + 0.5) / (len(items) + 0.5))
+            self._postings[token] = (doc_ids, freqs, idf)
+
+    def memory_usage(self) -> int:
+        """Байты под списки документов и частот, длины документов и словарь токенов"""
+        arrays = self.lengths.nbytes + self._norm.nbytes
+        postings = sum(doc_ids.nbytes + freqs.nbytes + sys.getsizeof(token)
+                       for token, (doc_ids, freqs, _) in self._postings.items())
+        return int(arrays + postings + sys.getsizeof(self._postings))
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.count, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            doc_ids, freqs, idf = posting
+            scores[doc_ids] += idf * freqs * (self.k1 + 1) / (freqs + self._norm[doc_ids])
+        return scores
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """(номер чанка, BM25) по убыванию; чанки без общих с запросом токенов не возвращаются"""
+        scores = self.scores(query)
+        top_k = min(top_k, self.count)
+        if top_k <= 0:
+            return []
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in ranked if scores[doc_id] > 0]
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[Tuple[int, float]]], weights: Dict[str, float],
+                           k: int = 60) -> List[Tuple[int, float, Dict]]:
+    """
+    Взвешенный RRF: score = sum(weight / (k + rank)) по ранжированиям, где документ найден.
+    Возвращает (номер чанка, итоговый score, разбивка по ранжированиям) по убыванию score
+    """
+    fused: Dict[int, float] = {}
+    breakdown: Dict[int, Dict] = {}
+    for name, ranking in rankings.items():
+        weight = weights.get(name, 1.0)
+        if not weight:
+            continue
+        for rank, (doc_id, score) in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank)
+            breakdown.setdefault(doc_id, {})[name] = {"score": score, "rank": rank}
+    return [(doc_id, score, breakdown[doc_id])
+            for doc_id, score in sorted(fused.items(), key=lambda item: -item[1])]
@@ -0,0 +1,322 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Значение "не найдено" в кэше, отличное от закэшированного None
+MISSING = object()
+
+
+class MemoryTier:
+    """LRU-кэш в памяти процесса с временем жизни записей"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteTier:
+    """Персистентный кэш в SQLite: значения в JSON, вытеснение по TTL и по числу записей (давно не читанные первыми)"""
+
+    # Как часто (в записях) проверять размер таблицы
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, path: str, max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+
+    def get(self, key: str) -> Any:
+        return self.get_with_expiry(key)[0]
+
+    def get_with_expiry(self, key: str) -> tuple:
+        """Значение и момент истечения (None - бессрочно)"""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return MISSING, None
+            value, expires_at = row
+            with self._connection:
+                if expires_at is not None and expires_at <= now:
+                    self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    return MISSING, None
+                self._connection.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value), expires_at
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now)
+            )
+            self._writes += 1
+            if self._writes % self.EVICTION_INTERVAL == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self._connection.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self._connection.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class TieredCache:
+    """Память + (опционально) SQLite; попадание в SQLite поднимает запись в память"""
+
+    def __init__(self, memory_entries: int = 1024, sqlite_path: Optional[str] = None,
+                 sqlite_entries: int = 100_000):
+        self.memory = MemoryTier(memory_entries)
+        self.disk = SQLiteTier(sqlite_path, sqlite_entries) if sqlite_path else None
+
+    @property
+    def persistent(self) -> bool:
+        return self.disk is not None
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is MISSING and self.disk is not None:
+            value, expires_at = self.disk.get_with_expiry(key)
+            if value is not MISSING:
+                # В памяти запись живёт столько, сколько ей осталось на диске
+                ttl = max(expires_at - time.time(), 0.001) if expires_at is not None else None
+                self.memory.set(key, value, ttl)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+
+class CompletionCache:
+    """
+    Кэш ответов chat.completions для детерминированных вызовов.
+    Ключ - хэш модели, сообщений, temperature и max_tokens; запросы с temperature выше max_temperature
+    (или без неё, т.е. с дефолтной 1.0) не кэшируются. Попадания и промахи считаются по стадиям пайплайнов.
+    """
+
+    def __init__(self, memory_entries: int = 1024, sqlite_path: Optional[str] = None,
+                 sqlite_entries: int = 100_000, ttl: Optional[float] = 7 * 24 * 3600,
+                 max_temperature: float = 0.3):
+        self.storage = TieredCache(memory_entries, sqlite_path, sqlite_entries)
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self._stats: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def persistent(self) -> bool:
+        return self.storage.persistent
+
+    @staticmethod
+    def make_key(request: Dict) -> str:
+        payload = {
+            "model": request.get("model"),
+            "messages": request.get("messages"),
+            "temperature": request.get("temperature"),
+            "max_tokens": request.get("max_tokens")
+        }
+        # Структурированный ответ (JSON schema) - часть запроса; у обычных запросов ключ не меняется
+        if request.get("response_format"):
+            payload["response_format"] = request["response_format"]
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def cacheable(self, request: Dict) -> bool:
+        temperature = request.get("temperature")
+        return temperature is not None and temperature <= self.max_temperature and not request.get("stream")
+
+    def _count(self, pipeline: str, stage: str, outcome: str):
+        with self._stats_lock:
+            stage_stats = self._stats.setdefault(pipeline, {}).setdefault(
+                stage, {"hits": 0, "misses": 0, "bypassed": 0})
+            stage_stats[outcome] += 1
+
+    def get(self, request: Dict, stage: str, pipeline: str = "default") -> Optional[str]:
+        if not self.cacheable(request):
+            self._count(pipeline, stage, "bypassed")
+            return None
+        value = self.storage.get(self.make_key(request))
+        if value is MISSING:
+            self._count(pipeline, stage, "misses")
+            return None
+        self._count(pipeline, stage, "hits")
+        return value
+
+    def put(self, request: Dict, content: Optional[str]):
+        if content is not None and self.cacheable(request):
+            self.storage.set(self.make_key(request), content, self.ttl)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return json.loads(json.dumps(self._stats))
+
+
+_SPARQL_TOKEN = re.compile(
+    r'(?P<string>"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^\'\\]|\\.|\'(?!\'\'))*\'\'\''
+    r'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')'
+    r'|(?P<iri><[^<>"{}|^`\\\s]*>)'
+    r'|(?P<comment>#[^\n]*)'
+    r'|(?P<space>\s+)'
+)
+
+# Временные ответы endpoint среди 4xx: таймаут запроса и ограничение частоты
+TRANSIENT_STATUSES = {408, 429}
+# Коды ошибок компиляции SPARQL в Virtuoso (SP030 - синтаксис и т.п.); их Virtuoso может вернуть и с 500
+VIRTUOSO_QUERY_ERROR = re.compile(r'\bSP\d{3}\b')
+_PREFIX_DECLARATION = re.compile(r'^\s*PREFIX\s+([\w.-]*:)\s*(<[^>]*>)', re.IGNORECASE)
+
+
+def normalize_sparql(query: str) -> str:
+    """
+    Каноническая форма запроса для ключа кэша: комментарии убраны, пробелы схлопнуты (кроме строк и IRI),
+    объявления PREFIX отсортированы и без дублей
+    """
+    parts = []
+    # Текст между строками и IRI: пробелы схлопываются только в нём, содержимое литералов не меняется
+    plain = []
+    position = 0
+    for match in _SPARQL_TOKEN.finditer(query):
+        plain.append(query[position:match.start()])
+        if match.group('space') is not None or match.group('comment') is not None:
+            plain.append(' ')
+        else:
+            parts.append(re.sub(r' {2,}', ' ', ''.join(plain)))
+            parts.append(match.group(0))
+            plain = []
+        position = match.end()
+    plain.append(query[position:])
+    parts.append(re.sub(r' {2,}', ' ', ''.join(plain)))
+    text = ''.join(parts).strip()
+
+    prefixes = set()
+    while True:
+        match = _PREFIX_DECLARATION.match(text)
+        if not match:
+            break
+        prefixes.add(f"PREFIX {match.group(1)} {match.group(2)}")
+        text = text[match.end():].lstrip()
+
+    return ' '.join(sorted(prefixes) + [text])
+
+
+class SparqlResultCache:
+    """
+    Кэш ответов SPARQL endpoint. Ключ - endpoint и нормализованный текст запроса.
+    Ошибки самого запроса и пустые результаты кэшируются отдельно с коротким negative_ttl;
+    временные сбои endpoint (перегрузка, таймауты, 5xx) не кэшируются - повтор запроса может пройти
+    """
+
+    def __init__(self, memory_entries: int = 4096, sqlite_path: Optional[str] = None,
+                 sqlite_entries: int = 200_000, ttl: Optional[float] = 3600, negative_ttl: Optional[float] = 300):
+        self.storage = TieredCache(memory_entries, sqlite_path, sqlite_entries)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def persistent(self) -> bool:
+        return self.storage.persistent
+
+    @staticmethod
+    def make_key(endpoint: str, query: str) -> str:
+        return hashlib.sha256(f"{endpoint}\n{normalize_sparql(query)}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_query_error(status: int, text: Optional[str]) -> bool:
+        """Ошибка, которую повтор того же запроса не исправит: 4xx кроме 408/429 или ошибка компиляции Virtuoso"""
+        if 400 <= status < 500:
+            return status not in TRANSIENT_STATUSES
+        return status >= 500 and bool(text) and VIRTUOSO_QUERY_ERROR.search(text) is not None
+
+    @classmethod
+    def cacheable(cls, status: int, text: Optional[str]) -> bool:
+        return status < 400 or cls.is_query_error(status, text)
+
+    @staticmethod
+    def is_negative(record: Dict) -> bool:
+        if record["status"] >= 400:
+            return True
+        results = record.get("results") or {}
+        return "results" in results and not results["results"].get("bindings")
+
+    def _count(self, outcome: str):
+        with self._stats_lock:
+            self._stats[outcome] += 1
+
+    def get(self, endpoint: str, query: str) -> Optional[Dict]:
+        """Запись {"status", "text", "results"} или None"""
+        record = self.storage.get(self.make_key(endpoint, query))
+        # Временные сбои, записанные прежними версиями в SQLite, не отдаются
+        if record is MISSING or not self.cacheable(record["status"], record.get("text")):
+            self._count("misses")
+            return None
+        self._count("negative_hits" if self.is_negative(record) else "hits")
+        return record
+
+    def put(self, endpoint: str, query: str, status: int, text: Optional[str], results: Optional[Dict]):
+        if not self.cacheable(status, text):
+            return
+        record = {"status": status, "text": text if status >= 400 else None, "results": results}
+        ttl = self.negative_ttl if self.is_negative(record) else self.ttl
+        self.storage.set(self.make_key(endpoint, query), record, ttl)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return dict(self._stats)
@@ -0,0 +1,169 @@
+import re
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from rdflib import Graph, URIRef
+from rdflib.plugins.stores.memory import SimpleMemory
+
+from t2sparql_labels import LABEL_PREDICATES
+from t2sparql_namespaces import NamespaceTrie
+
+# Сколько готовых чанков передаётся на кодирование за раз
+CHUNK_BATCH_SIZE = 512
+# Субъект считается описанным полностью, если за столько триплетов у него не появилось новых
+SUBJECT_WINDOW = 10000
+
+PREFIX_DIRECTIVE = re.compile(r'^\s*(?:@prefix|(?i:prefix))\s+([A-Za-z][\w.-]*)?:\s*<([^>]*)>')
+HEADER_LINE = re.compile(r'^\s*(?:#.*|@?(?i:prefix|base)\b.*)?$')
+
+
+def header_prefixes(path: str) -> List[Tuple[str, str]]:
+    """
+    Префиксы из заголовка Turtle-файла (до первого утверждения). Парсер rdflib регистрирует префиксы в графе
+    только после разбора всего файла, а при потоковой сборке они нужны с первого триплета
+    """
+    prefixes = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not HEADER_LINE.match(line):
+                break
+            match = PREFIX_DIRECTIVE.match(line)
+            if match:
+                prefixes.append((match.group(1) or "", match.group(2)))
+    return prefixes
+
+
+class TripleSink(SimpleMemory):
+    """
+    Хранилище rdflib, которое не хранит триплеты: парсер передаёт каждый триплет в callback.
+    Префиксы хранятся как обычно - они нужны парсеру и для сокращения URI
+    """
+
+    def __init__(self, callback: Callable[[Tuple], None], on_bind: Optional[Callable[[], None]] = None):
+        super().__init__()
+        self.callback = callback
+        self.on_bind = on_bind
+
+    def add(self, triple, context, quoted: bool = False):
+        self.callback(triple)
+
+    def bind(self, prefix, namespace, override: bool = True):
+        super().bind(prefix, namespace, override)
+        if self.on_bind is not None:
+            self.on_bind()
+
+
+class StreamingChunker:
+    """
+    Чанки сущностей корпоративного графа за один проход по Turtle без rdflib Graph в памяти.
+    Триплеты группируются по субъекту; субъект, которому SUBJECT_WINDOW триплетов подряд не встречался,
+    превращается в чанк, и тексты готовых чанков передаются в on_batch пачками по batch_size
+    (по возрастанию номеров чанков).
+    Если субъект встречается снова после выдачи чанка, строки дописываются в его чанк,
+    а номер чанка попадает в reopened - такие чанки нужно закодировать заново
+    """
+
+    def __init__(self, on_batch: Callable[[List[str]], None], batch_size: int = CHUNK_BATCH_SIZE,
+                 window: int = SUBJECT_WINDOW):
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.window = window
+        self.chunks: List[str] = []
+        self.metadata: List[Dict] = []
+        self.reopened: Set[int] = set()
+        self.labels: Dict[str, List[int]] = {}
+        self.triples = 0
+        self._sink = TripleSink(self._add, self._rebuild_trie)
+        self._trie = NamespaceTrie(self._sink.namespaces())
+        self._graph = Graph(store=self._sink)
+        self._pending: "OrderedDict[object, Tuple[int, List[Tuple], Set[Tuple]]]" = OrderedDict()
+        self._chunk_ids: Dict[object, int] = {}
+        self._labelled: List[Tuple[object, str]] = []
+        self._ready: List[int] = []
+        self._label_predicates = {URIRef(predicate) for predicate in LABEL_PREDICATES}
+
+    @property
+    def namespaces(self) -> List[Tuple[str, str]]:
+        return self._trie.namespaces
+
+    @property
+    def namespace_trie(self) -> NamespaceTrie:
+        return self._trie
+
+    def _rebuild_trie(self):
+        self._trie = NamespaceTrie(self._sink.namespaces())
+
+    def render(self, term) -> str:
+        if isinstance(term, URIRef):
+            return self._trie.compact(term)
+        return f"<{term}>"
+
+    def _add(self, triple: Tuple):
+        subject, predicate, obj = triple
+        self.triples += 1
+        if predicate in self._label_predicates:
+            self._labelled.append((subject, str(obj)))
+
+        chunk_id = self._chunk_ids.get(subject)
+        if chunk_id is not None:
+            # Субъект уже выдан чанком: дописываем строку, чанк кодируется заново
+            line = f"{self.render(predicate)} {self.render(obj)}"
+            if line not in self.chunks[chunk_id].split("\n")[1:]:
+                self.chunks[chunk_id] += f"\n{line}"
+                self.reopened.add(chunk_id)
+            return
+
+        entry = self._pending.get(subject)
+        if entry is None:
+            entry = (self.triples, [], set())
+        else:
+            self._pending.move_to_end(subject)
+        _, terms, seen = entry
+        if (predicate, obj) not in seen:
+            seen.add((predicate, obj))
+            terms.append((predicate, obj))
+        self._pending[subject] = (self.triples, terms, seen)
+
+        while self._pending:
+            oldest, (last_seen, _, _) = next(iter(self._pending.items()))
+            if self.triples - last_seen < self.window:
+                break
+            self._flush(oldest)
+
+    def _flush(self, subject):
+        _, terms, _ = self._pending.pop(subject)
+        desc = "\n".join(f"{self.render(predicate)} {self.render(obj)}" for predicate, obj in terms)
+        chunk_id = len(self.chunks)
+        self._chunk_ids[subject] = chunk_id
+        self.chunks.append(f"Entity: {self.render(subject)}\n{desc}")
+        self.metadata.append({"source": str(subject)})
+        self._ready.append(chunk_id)
+        if len(self._ready) >= self.batch_size:
+            self._emit()
+
+    def _emit(self):
+        if self._ready:
+            batch, self._ready = self._ready, []
+            self.on_batch([self.chunks[chunk_id] for chunk_id in batch])
+
+    def feed(self, path: str, format: str = "turtle"):
+        for prefix, namespace in header_prefixes(path):
+            self._graph.bind(prefix, namespace)
+        self._graph.parse(path, format=format)
+
+    def close(self):
+        """Выдаёт оставшиеся чанки; после этого заполнены labels (название -> номера чанков)"""
+        while self._pending:
+            self._flush(next(iter(self._pending)))
+        self._emit()
+        for subject, label in self._labelled:
+            chunk_id = self._chunk_ids.get(subject)
+            if chunk_id is not None and chunk_id not in self.labels.setdefault(label, []):
+                self.labels[label].append(chunk_id)
+        self._labelled = []
+
+    def run(self, paths: Iterable[str]) -> "StreamingChunker":
+        for path in paths:
+            self.feed(path)
+        self.close()
+        return self
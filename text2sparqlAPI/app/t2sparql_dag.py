@@ -0,0 +1,165 @@
+import asyncio
+import inspect
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Union
+
+StageFn = Callable[..., Union[Awaitable[Any], Any]]
+
+
+class Stage:
+    """
+    Шаг графа. fn (корутина или обычная функция) получает именованными аргументами результаты шагов из after
+    и объекты Speculation для спекулятивных шагов из speculations
+    """
+
+    def __init__(self, name: str, fn: StageFn, after: Tuple[str, ...] = (), speculations: Tuple[str, ...] = (),
+                 speculative: bool = False):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.speculations = tuple(speculations)
+        self.speculative = speculative
+
+
+class StageGraph:
+    """
+    Описание пайплайна как графа зависимостей шагов. Шаг может ссылаться только на уже добавленные шаги
+    и на входы графа, поэтому циклов нет
+    """
+
+    def __init__(self, inputs: Iterable[str] = ()):
+        self.inputs = tuple(inputs)
+        self.stages: Dict[str, Stage] = {}
+
+    def add(self, name: str, fn: StageFn, after: Iterable[str] = (), speculations: Iterable[str] = (),
+            speculative: bool = False) -> "StageGraph":
+        if name in self.stages or name in self.inputs:
+            raise ValueError(f"Stage {name!r} is already defined")
+        after, speculations = tuple(after), tuple(speculations)
+        for dependency in after:
+            if dependency not in self.stages and dependency not in self.inputs:
+                raise ValueError(f"Stage {name!r} depends on unknown stage {dependency!r}")
+            if dependency in self.stages and self.stages[dependency].speculative:
+                raise ValueError(f"Stage {name!r} must consume speculative stage {dependency!r} via speculations")
+        for speculation in speculations:
+            if speculation not in self.stages or not self.stages[speculation].speculative:
+                raise ValueError(f"Stage {name!r} refers to unknown speculative stage {speculation!r}")
+        self.stages[name] = Stage(name, fn, after, speculations, speculative)
+        return self
+
+
+class Speculation:
+    """
+    Спекулятивная ветка, которую потребитель либо забирает (result), либо отменяет (cancel).
+    Если ветка не запускалась заранее, result запускает её по требованию
+    """
+
+    def __init__(self, name: str, start: Callable[[], "asyncio.Task"], executor: "StageExecutor"):
+        self.name = name
+        self._start = start
+        self._executor = executor
+        self.task: Optional[asyncio.Task] = None
+        self.claimed = False
+
+    def launch(self):
+        if self.task is None:
+            self.task = self._start()
+            self._executor._count(self.name, "started")
+
+    async def result(self):
+        self.launch()
+        if not self.claimed:
+            self._executor._count(self.name, "used")
+        self.claimed = True
+        return await self.task
+
+    def cancel(self):
+        """Результат не нужен: незавершённая ветка прерывается"""
+        if self.task is not None and not self.claimed:
+            self.task.cancel()
+            self._executor._count(self.name, "cancelled")
+        self.claimed = True
+
+
+class StageExecutor:
+    """
+    Выполняет StageGraph с максимальным параллелизмом: каждый шаг стартует, как только готовы его зависимости.
+    Спекулятивные шаги из speculative запускаются заранее, остальные - только по требованию потребителя;
+    незабранные ветки отменяются по завершении графа. Ошибка шага отменяет все остальные и пробрасывается
+    """
+
+    def __init__(self, speculative: Iterable[str] = ()):
+        self.speculative = set(speculative)
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, event: str):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"started": 0, "used": 0, "cancelled": 0})
+            stats[event] += 1
+
+    async def run(self, graph: StageGraph, inputs: Dict[str, Any],
+                  on_complete: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """
+        inputs - входы графа и, при необходимости, готовые результаты шагов (такие шаги не выполняются).
+        on_complete(name, result) вызывается по завершении каждого выполненного неспекулятивного шага.
+        Возвращает результаты всех выполненных шагов
+        """
+        missing = [name for name in graph.inputs if name not in inputs]
+        if missing:
+            raise ValueError(f"Missing stage graph inputs: {', '.join(missing)}")
+
+        loop = asyncio.get_running_loop()
+        futures: Dict[str, asyncio.Future] = {}
+        speculations: Dict[str, Speculation] = {}
+
+        for name, value in inputs.items():
+            future = loop.create_future()
+            future.set_result(value)
+            futures[name] = future
+
+        async def execute(stage: Stage):
+            values = await asyncio.gather(*(futures[dependency] for dependency in stage.after))
+            kwargs = dict(zip(stage.after, values))
+            kwargs.update({name: speculations[name] for name in stage.speculations})
+            result = stage.fn(**kwargs)
+            # Шаг может быть и обычной функцией (например, выбор поля из результата другого шага)
+            return await result if inspect.isawaitable(result) else result
+
+        def report(name: str, future: asyncio.Future):
+            if not future.cancelled() and future.exception() is None:
+                on_complete(name, future.result())
+
+        for stage in graph.stages.values():
+            if stage.name in futures:
+                continue
+            if stage.speculative:
+                speculations[stage.name] = Speculation(
+                    stage.name, lambda stage=stage: asyncio.ensure_future(execute(stage)), self)
+                if stage.name in self.speculative:
+                    speculations[stage.name].launch()
+            else:
+                futures[stage.name] = asyncio.ensure_future(execute(stage))
+                if on_complete is not None:
+                    futures[stage.name].add_done_callback(lambda future, name=stage.name: report(name, future))
+
+        pending = [future for name, future in futures.items() if name not in inputs]
+        try:
+            await asyncio.gather(*pending)
+        finally:
+            for future in pending:
+                future.cancel()
+            for speculation in speculations.values():
+                speculation.cancel()
+            tasks = [speculation.task for speculation in speculations.values() if speculation.task is not None]
+            for task in tasks:
+                task.cancel()
+            # Дожидаемся отменённых веток, чтобы они не продолжали работу после ответа
+            await asyncio.gather(*pending, *tasks, return_exceptions=True)
+
+        return {name: future.result() for name, future in futures.items()}
+
+    def stats(self) -> Dict:
+        """Спекулятивные ветки: сколько запущено, сколько результатов использовано и сколько отменено"""
+        with self._lock:
+            return {name: dict(values) for name, values in self._stats.items()}
@@ -1,23 +1,72 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+import asyncio
 import os
-from SPARQLWrapper import SPARQLWrapper, JSON
 import re
+import sys
 import json
+import time
 import faiss
 from sentence_transformers import SentenceTransformer
 from typing import Dict, Tuple, Optional, List
-import requests
 from urllib.parse import quote
 import warnings
-from urllib3.exceptions import InsecureRequestWarning
 import t2sparql_dbpedia_prompts
+from t2sparql_index_cache import IndexCache, dataset_fingerprint
+from t2sparql_ann import IndexSpec, index_memory
+from t2sparql_cache import CompletionCache, SparqlResultCache
+from t2sparql_langid import LanguageRouter
+from t2sparql_http import HttpTransport
+from t2sparql_repair import QueryRepairEngine
+from t2sparql_probe import ValidationProber
+from t2sparql_deadline import Deadline, stage_allowed, timeout_kwargs
+from t2sparql_metrics import StageMetrics, metrics as default_metrics
+from t2sparql_dag import StageExecutor, StageGraph
+from t2sparql_progress import astream_completion, emit, token_sink
+
+# Соседи сущностей в промпте генерации: не больше 10 на сущность и 30 всего
+NEIGHBOURS_PER_ENTITY = 10
+NEIGHBOURS_TOTAL = 30
+
+# Символы, недопустимые внутри <IRI> в SPARQL
+INVALID_IRI_CHARS = re.compile(r'[\s<>"{}|^`\\]')
+
+# Структурированный ответ объединённой предобработки (перевод + уточнение + разметка сущностей)
+FUSED_PREPROCESS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "english_question": {"type": "string"},
+        "clarified_question": {"type": "string"},
+        "analysis": {"type": "string"},
+        "intermediary_question": {"type": "string"}
+    },
+    "required": ["english_question", "clarified_question", "analysis", "intermediary_question"],
+    "additionalProperties": False
+}
+
+PREPROCESSING_MODES = ("staged", "fused")
+
+# Датасеты RAG (пути относительно рабочего каталога приложения)
+RAG_DATASETS = ['qald_9_plus_test_dbpedia.json', 'qald_9_plus_train_dbpedia.json', 'train-data.json']
+
+EMPTY_RESULTS_ERROR = ("Query executed successfully but returned empty results. "
+                       "Please regenerate the query with different parameters or conditions.")
 
 
 class RAGSystem:
-    def __init__(self, dataset_paths: List[str]):
+    def __init__(self, dataset_paths: List[str], model_name: str = 'all-MiniLM-L6-v2',
+                 normalize_embeddings: bool = False, cache_dir: Optional[str] = None,
+                 metrics: Optional[StageMetrics] = None, index_spec: Optional[IndexSpec] = None):
+        self.dataset_paths = dataset_paths
+        self.model_name = model_name
+        self.normalize_embeddings = normalize_embeddings
+        # Тип FAISS-индекса (по умолчанию точный поиск Flat)
+        self.index_spec = index_spec or IndexSpec()
+        self.cache = IndexCache(cache_dir) if cache_dir else None
+        self.metrics = metrics or default_metrics
+
         self.datasets = self._load_datasets(dataset_paths)
         self.all_data = self._preprocess_data()
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.model = SentenceTransformer(model_name)
         self._build_index()
 
     def _load_datasets(self, paths: List[str]) -> List[Dict]:
@@ -67,25 +116,65 @@ class RAGSystem:
 
         return processed_data
 
+    def _cache_key(self) -> str:
+        return dataset_fingerprint(
+            self.dataset_paths,
+            model=self.model_name,
+            normalize_embeddings=self.normalize_embeddings,
+            index=self.index_spec.build_key()
+        )
+
     def _build_index(self):
-        """Построение FAISS индекса для векторного поиска"""
+        """Построение FAISS индекса для векторного поиска (или загрузка готового из кэша)"""
+        cache_key = self._cache_key() if self.cache else None
+        if cache_key:
+            cached = self.cache.load(cache_key)
+            if cached is not None and cached.ntotal == len(self.all_data):
+                # Индекс отображается в память, повторного кодирования нет
+                self.index = self.index_spec.configure(cached)
+                return
+
         questions = [item['question'] for item in self.all_data]
-        self.question_embeddings = self.model.encode(questions)
+        # Матрица эмбеддингов нужна только для построения: дальше векторы хранит сам индекс
+        embeddings = self.model.encode(questions, normalize_embeddings=self.normalize_embeddings)
+        self.index = self.index_spec.build(embeddings, faiss.METRIC_L2)
 
-        dimension = self.question_embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(self.question_embeddings)
+        if cache_key:
+            self.cache.save(cache_key, self.index)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Оценка памяти компонентов в байтах: FAISS-индекс и примеры (вопрос и SPARQL)"""
+        return {
+            "index": index_memory(self.index),
+            "examples": sum(sys.getsizeof(item['question']) + sys.getsizeof(item['query']) for item in self.all_data)
+        }
 
     def query(self, question: str, top_k: int = 3, threshold: Optional[float] = None,
               dataset_filter: Optional[str] = None, language: str = 'en') -> List[Dict]:
         """
         Поиск наиболее релевантных вопросов
         """
-        query_embedding = self.model.encode([question])
-        distances, indices = self.index.search(query_embedding, top_k)
+        return self.query_batch([question], top_k, threshold, dataset_filter, language)[0]
+
+    def query_batch(self, questions: List[str], top_k: int = 3, threshold: Optional[float] = None,
+                    dataset_filter: Optional[str] = None, language: str = 'en') -> List[List[Dict]]:
+        """
+        Поиск для нескольких вопросов сразу: одно кодирование батчем и один index.search
+        """
+        with self.metrics.stage(DBpediaPipeline.PIPELINE_NAME, "encode"):
+            query_embeddings = self.model.encode(questions, normalize_embeddings=self.normalize_embeddings)
+        with self.metrics.stage(DBpediaPipeline.PIPELINE_NAME, "rag_retrieval"):
+            distances, indices = self.index.search(query_embeddings, top_k)
 
+        return [self._collect_results(indices[i], distances[i], threshold, dataset_filter, language)
+                for i in range(len(questions))]
+
+    def _collect_results(self, indices, distances, threshold: Optional[float],
+                         dataset_filter: Optional[str], language: str) -> List[Dict]:
         results = []
-        for idx, dist in zip(indices[0], distances[0]):
+        for idx, dist in zip(indices, distances):
+            if idx < 0:
+                continue
             similarity = 1 - dist
             if threshold is None or similarity >= threshold:
                 result = self.all_data[idx].copy()
@@ -110,7 +199,17 @@ class RAGSystem:
             dataset_filter=dataset_filter,
             language=language
         )
+        return self._format_context(similar_items)
+
+    def get_context_batch(self, questions: List[str], top_k: int = 3, threshold: Optional[float] = None,
+                          dataset_filter: Optional[str] = None, language: str = 'en') -> List[str]:
+        """
+        Контексты для нескольких вопросов за один проход модели и индекса
+        """
+        return [self._format_context(items)
+                for items in self.query_batch(questions, top_k, threshold, dataset_filter, language)]
 
+    def _format_context(self, similar_items: List[Dict]) -> str:
         context = ""
         for item in similar_items:
             context += f"Question: {item['question']}\n"
@@ -137,26 +236,128 @@ class RAGSystem:
 
 
 class DBpediaPipeline:
+    PIPELINE_NAME = 'dbpedia'
+
     def __init__(self, api_key: str, dbpedia_endpoint: str = "http://dbpedia.org/sparql",
                  NER_PROMPT: str = t2sparql_dbpedia_prompts.NER_PROMPT,
                  URI_GENERATION_PROMPT: str = t2sparql_dbpedia_prompts.URI_GENERATION_PROMPT,
                  SPARQL_GENERATION_PROMPT: str = t2sparql_dbpedia_prompts.SPARQL_GENERATION_PROMPT,
                  QUERY_REPAIR_PROMPT: str = t2sparql_dbpedia_prompts.QUERY_REPAIR_PROMPT,
-                 QUESTION_CLARIFY: str = t2sparql_dbpedia_prompts.QUESTION_CLARIFY):
+                 QUESTION_CLARIFY: str = t2sparql_dbpedia_prompts.QUESTION_CLARIFY,
+                 FUSED_PREPROCESS_PROMPT: str = t2sparql_dbpedia_prompts.FUSED_PREPROCESS_PROMPT,
+                 cache_dir: Optional[str] = None, llm_cache: Optional[CompletionCache] = None,
+                 language_router: Optional[LanguageRouter] = None, transport: Optional[HttpTransport] = None,
+                 sparql_cache: Optional[SparqlResultCache] = None, repair_engine: Optional[QueryRepairEngine] = None,
+                 validation_prober: Optional[ValidationProber] = None, metrics: Optional[StageMetrics] = None,
+                 spotlight_endpoint: str = "https://api.dbpedia-spotlight.org/{language}/annotate",
+                 neighbors_endpoint: str = "https://dbpedia.org/sparql",
+                 stage_executor: Optional[StageExecutor] = None, preprocessing: str = "staged",
+                 fused_model: str = "gpt-4o", rag_index: Optional[IndexSpec] = None,
+                 rag_datasets: Optional[List[str]] = None):
 
         self.client = OpenAI(api_key=api_key)
-        self.sparql_endpoint = SPARQLWrapper(dbpedia_endpoint)
-        self.sparql_endpoint.setReturnFormat(JSON)
+        self.async_client = AsyncOpenAI(api_key=api_key)
+        self.llm_cache = llm_cache
+        self.language_router = language_router or LanguageRouter()
+        self.metrics = metrics or default_metrics
+        self.dbpedia_endpoint = dbpedia_endpoint
+        # Spotlight ({language} подставляется) и endpoint для поиска соседей сущностей
+        self.spotlight_endpoint = spotlight_endpoint
+        self.neighbors_endpoint = neighbors_endpoint
+        # Кэш ответов SPARQL endpoint для проверки запросов и поиска соседей
+        self.sparql_cache = sparql_cache
+        # Локальная проверка синтаксиса и цикл исправления запроса
+        self.repair_engine = repair_engine or QueryRepairEngine()
+        # Проверка запроса на endpoint через ASK / LIMIT 1 вместо полной выборки
+        self.validation_prober = validation_prober or ValidationProber()
+        # Асинхронный пайплайн выполняется как граф шагов; по умолчанию заранее запускается только Spotlight
+        self.stage_executor = stage_executor or StageExecutor(speculative=("spotlight_en",))
+        # "staged" - перевод, уточнение и NER отдельными вызовами GPT-4, "fused" - один вызов fused_model
+        # со структурированным ответом (модель должна поддерживать JSON schema)
+        if preprocessing not in PREPROCESSING_MODES:
+            raise ValueError(f"Unknown preprocessing mode {preprocessing!r}, expected one of {PREPROCESSING_MODES}")
+        self.preprocessing = preprocessing
+        self.fused_model = fused_model
+
+        # Общий HTTP-транспорт для Spotlight, SPARQL endpoint и соседей; свой создаётся, только если не передан
+        self._owns_transport = transport is None
+        self.transport = transport or HttpTransport()
 
         self.NER_PROMPT = NER_PROMPT
         self.URI_GENERATION_PROMPT = URI_GENERATION_PROMPT
         self.SPARQL_GENERATION_PROMPT = SPARQL_GENERATION_PROMPT
         self.QUERY_REPAIR_PROMPT = QUERY_REPAIR_PROMPT
         self.QUESTION_CLARIFY = QUESTION_CLARIFY
-        self.rag = RAGSystem(['qald_9_plus_test_dbpedia.json', 'qald_9_plus_train_dbpedia.json', 'train-data.json'])
+        self.FUSED_PREPROCESS_PROMPT = FUSED_PREPROCESS_PROMPT
+        self.stage_graph = self._build_stage_graph()
+        self.rag = RAGSystem(rag_datasets or RAG_DATASETS,
+                             cache_dir=cache_dir, metrics=self.metrics, index_spec=rag_index)
+
+    def _record_llm_cache(self, stage: str, request: Dict, cached: Optional[str]):
+        if cached is not None:
+            outcome = "hit"
+        else:
+            outcome = "miss" if self.llm_cache.cacheable(request) else "bypassed"
+        self.metrics.record_cache("llm", self.PIPELINE_NAME, stage, outcome)
+
+    def _complete(self, stage: str, request: Dict) -> str:
+        if self.llm_cache is not None:
+            cached = self.llm_cache.get(request, stage, self.PIPELINE_NAME)
+            self._record_llm_cache(stage, request, cached)
+            if cached is not None:
+                return cached
+
+        with self.metrics.stage(self.PIPELINE_NAME, stage):
+            response = self.client.chat.completions.create(**request, **timeout_kwargs())
+        self.metrics.record_tokens(self.PIPELINE_NAME, stage, getattr(response, "usage", None))
+        content = response.choices[0].message.content
+
+        if self.llm_cache is not None:
+            self.llm_cache.put(request, content)
+        return content
+
+    async def _acomplete(self, stage: str, request: Dict) -> str:
+        # При потоковой выдаче клиенту ответ генерации запрашивается у OpenAI потоком и пересылается по токенам
+        sink = token_sink(stage)
+
+        # SQLite-уровень кэша блокирующий, поэтому с ним работаем из пула потоков
+        if self.llm_cache is not None:
+            if self.llm_cache.persistent:
+                cached = await asyncio.to_thread(self.llm_cache.get, request, stage, self.PIPELINE_NAME)
+            else:
+                cached = self.llm_cache.get(request, stage, self.PIPELINE_NAME)
+            self._record_llm_cache(stage, request, cached)
+            if cached is not None:
+                if sink is not None:
+                    sink(cached)
+                return cached
+
+        with self.metrics.stage(self.PIPELINE_NAME, stage):
+            if sink is None:
+                response = await self.async_client.chat.completions.create(**request, **timeout_kwargs())
+                usage, content = getattr(response, "usage", None), response.choices[0].message.content
+            else:
+                content, usage = await astream_completion(self.async_client, request, sink, **timeout_kwargs())
+        self.metrics.record_tokens(self.PIPELINE_NAME, stage, usage)
 
-    def translate_to_english(self, text):
-        response = self.client.chat.completions.create(
+        if self.llm_cache is not None:
+            if self.llm_cache.persistent:
+                await asyncio.to_thread(self.llm_cache.put, request, content)
+            else:
+                self.llm_cache.put(request, content)
+        return content
+
+    async def aclose(self):
+        if self._owns_transport:
+            await self.transport.aclose()
+        await self.async_client.close()
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Память компонентов пайплайна в байтах (RAG: индекс и примеры)"""
+        return {f"rag_{name}": size for name, size in self.rag.memory_usage().items()}
+
+    def _translate_request(self, text) -> Dict:
+        return dict(
             model="gpt-4",
             messages=[
                 {
@@ -175,38 +376,66 @@ class DBpediaPipeline:
             temperature=0.1,
             max_tokens=500
         )
-        return response.choices[0].message.content.strip()
 
-    def get_dbpedia(self, text: str, language: str = "en") -> Optional[Dict]:
-        """Get entities from DBpedia Spotlight API"""
+    def translate_to_english(self, text):
+        return self._complete('translate_to_english', self._translate_request(text)).strip()
+
+    async def atranslate_to_english(self, text):
+        return (await self._acomplete('translate_to_english', self._translate_request(text))).strip()
+
+    def to_english(self, text):
+        """Перевод только если локальный детектор не уверен, что вопрос уже на английском"""
+        if self.language_router.needs_translation(text):
+            return self.translate_to_english(text)
+        return text.strip()
 
-        # Отключаем предупреждения о небезопасных запросах
-        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+    async def ato_english(self, text):
+        if self.language_router.needs_translation(text):
+            return await self.atranslate_to_english(text)
+        return text.strip()
 
-        endpoint = f"https://api.dbpedia-spotlight.org/{language}/annotate"
+    def _spotlight_request(self, text: str, language: str = "en") -> Tuple[str, Dict, Dict]:
+        endpoint = self.spotlight_endpoint.format(language=language)
         headers = {"Accept": "application/json"}
         params = {"text": text, "confidence": 0.5}
+        return endpoint, headers, params
+
+    def get_dbpedia(self, text: str, language: str = "en") -> Optional[Dict]:
+        """Get entities from DBpedia Spotlight API"""
+
+        endpoint, headers, params = self._spotlight_request(text, language)
 
         try:
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                data=params,
-                verify=False  # Disable SSL verification
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            with self.metrics.stage(self.PIPELINE_NAME, "spotlight"):
+                response = self.transport.request(
+                    "POST",
+                    endpoint,
+                    headers=headers,
+                    data=params,
+                    verify=False  # Disable SSL verification
+                )
+                response.raise_for_status()
+                return response.json()
+        except Exception as e:
             #print(f"DBpedia Spotlight API error: {e}")
             return None
 
-    def uris(self, new_question: str) -> Tuple[Optional[str], Dict[str, str]]:
-        """New entity extraction using DBpedia Spotlight"""
-
-
-        spotlight_result = self.get_dbpedia(new_question)
-        #print('Got spotlight result')
+    async def aget_dbpedia(self, text: str, language: str = "en") -> Optional[Dict]:
+        """Async variant of get_dbpedia"""
+        endpoint, headers, params = self._spotlight_request(text, language)
+        try:
+            with self.metrics.stage(self.PIPELINE_NAME, "spotlight"):
+                response = await self.transport.arequest("POST", endpoint, headers=headers, data=params,
+                                                         verify=False)
+                response.raise_for_status()
+                return response.json()
+        except Exception as e:
+            return None
 
+    def _tag_spotlight_entities(self, new_question: str, spotlight_result: Optional[Dict]) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        Tagged question and URIs from a Spotlight answer, None when the GPT-4 fallback is needed
+        """
         if spotlight_result and "Resources" in spotlight_result:
             entities = {}
             tagged_parts = []
@@ -242,25 +471,63 @@ class DBpediaPipeline:
                 tagged_question += remaining_text[last_pos:]
 
                 return tagged_question, entities
-            else:
 
-              #print('Tagged entities <= 1')
-              tagged_question, entities = self._original_extract_entities(new_question)
-              if not tagged_question:
-                return {"error": "Failed to extract entities"}
-              return tagged_question, self._original_generate_uris(tagged_question, entities)
-        else:
-          #print('Spotlight result is empty')
-          tagged_question, entities = self._original_extract_entities(new_question)
-          if not tagged_question:
-            return {"error": "Failed to extract entities"}
-          return tagged_question, self._original_generate_uris(tagged_question, entities)
+        #print('Spotlight result is empty or tagged entities <= 1')
+        return None
 
-    def _original_extract_entities(self, question: str) -> Tuple[Optional[str], Dict[str, str]]:
-        """Original GPT-4 based entity extraction (kept as fallback)"""
+    def uris(self, new_question: str) -> Tuple[Optional[str], Dict[str, str]]:
+        """New entity extraction using DBpedia Spotlight"""
+
+        spotlight_result = self.get_dbpedia(new_question)
+        #print('Got spotlight result')
+
+        tagged_question, entities_URI = self._resolve_entities(
+            new_question, spotlight_result, lambda: self._original_extract_entities(new_question))
+        if not tagged_question:
+          return {"error": "Failed to extract entities"}
+        return tagged_question, entities_URI
+
+    def _resolve_entities(self, new_question: str, spotlight_result: Optional[Dict],
+                          extract_entities) -> Tuple[Optional[str], Dict[str, str]]:
+        """Spotlight answer or, when it does not tag enough entities, the GPT-4 fallback (extract_entities())"""
+        tagged = self._tag_spotlight_entities(new_question, spotlight_result)
+        if tagged:
+            return tagged
+
+        tagged_question, entities = extract_entities()
+        if not tagged_question:
+            return None, {}
+        return tagged_question, self._original_generate_uris(tagged_question, entities)
+
+    async def auris(self, new_question: str) -> Tuple[Optional[str], Dict[str, str]]:
+        """Async variant of uris"""
+
+        tagged_question, entities_URI = await self._aresolve_entities(
+            new_question, self.aget_dbpedia(new_question), lambda: self._aoriginal_extract_entities(new_question))
+        if not tagged_question:
+          return {"error": "Failed to extract entities"}
+        return tagged_question, entities_URI
+
+    async def _aresolve_entities(self, new_question: str, spotlight_result, extract_entities,
+                                 cancel_extraction=None) -> Tuple[Optional[str], Dict[str, str]]:
+        """
+        Spotlight answer (awaitable) or, when it does not tag enough entities, the GPT-4 fallback
+        (extract_entities() -> awaitable). cancel_extraction drops a speculatively started fallback
+        """
+        tagged = self._tag_spotlight_entities(new_question, await spotlight_result)
+        if tagged:
+            if cancel_extraction is not None:
+                cancel_extraction()
+            return tagged
+
+        tagged_question, entities = await extract_entities()
+        if not tagged_question:
+            return None, {}
+        return tagged_question, await self._aoriginal_generate_uris(tagged_question, entities)
+
+    def _entities_request(self, question: str) -> Dict:
         prompt = f"""{self.NER_PROMPT}\n\nQuestion: {question}\nProvide output in the exact required format:"""
-        try:
-            response = self.client.chat.completions.create(
+        return dict(
                 model="gpt-4",
                 messages=[
                     {
@@ -300,42 +567,56 @@ class DBpediaPipeline:
                 max_tokens=400
             )
 
-            full_response = response.choices[0].message.content.strip()
-            #print(full_response)
+    def _parse_entities(self, full_response: str) -> Tuple[Optional[str], Dict[str, str]]:
+        full_response = full_response.strip()
+        #print(full_response)
 
-            intermediary_match = re.search(
-                r'So the intermediary_question is:\s*(.*?)$',
-                full_response,
-                re.MULTILINE
-            )
+        intermediary_match = re.search(
+            r'So the intermediary_question is:\s*(.*?)$',
+            full_response,
+            re.MULTILINE
+        )
 
-            if not intermediary_match:
-                #print("Error: Couldn't extract intermediary question from response")
-                return None, {}
+        if not intermediary_match:
+            #print("Error: Couldn't extract intermediary question from response")
+            return None, {}
 
-            tagged_question = intermediary_match.group(1).strip()
+        tagged_question = intermediary_match.group(1).strip()
 
-            entities = {}
-            for match in re.finditer(r'<([^>]+)>([^<]+)</\1>', tagged_question):
-                entity_type, entity_value = match.groups()
-                entities[entity_value] = entity_type
+        if not re.match(r'^Let\'s think step by step\.', full_response):
+            #print("Error: Response doesn't follow DINSQL format")
+            return None, {}
 
-            if not re.match(r'^Let\'s think step by step\.', full_response):
-                #print("Error: Response doesn't follow DINSQL format")
-                return None, {}
+        return tagged_question, self._tagged_entities(tagged_question)
 
-            return tagged_question, entities
+    def _tagged_entities(self, tagged_question: str) -> Dict[str, str]:
+        entities = {}
+        for match in re.finditer(r'<([^>]+)>([^<]+)</\1>', tagged_question):
+            entity_type, entity_value = match.groups()
+            entities[entity_value] = entity_type
+        return entities
 
+    def _original_extract_entities(self, question: str) -> Tuple[Optional[str], Dict[str, str]]:
+        """Original GPT-4 based entity extraction (kept as fallback)"""
+        try:
+            response = self._complete('_original_extract_entities', self._entities_request(question))
+            return self._parse_entities(response)
         except Exception as e:
             #print(f"Error in entity extraction: {str(e)}")
             return None, {}
 
-    def _original_generate_uris(self, tagged_question: str, entities: Dict[str, str]) -> Dict[str, str]:
+    async def _aoriginal_extract_entities(self, question: str) -> Tuple[Optional[str], Dict[str, str]]:
+        try:
+            response = await self._acomplete('_original_extract_entities', self._entities_request(question))
+            return self._parse_entities(response)
+        except Exception as e:
+            return None, {}
+
+    def _uris_request(self, tagged_question: str, entities: Dict[str, str]) -> Dict:
         entity_list = "\n".join([f"- {value} ({type})" for value, type in entities.items()])
         prompt = f"{self.URI_GENERATION_PROMPT}\n\nTagged question: {tagged_question}\nEntities:\n{entity_list}\n\nDBpedia URIs:"
 
-        try:
-            response = self.client.chat.completions.create(
+        return dict(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": """
@@ -389,39 +670,49 @@ class DBpediaPipeline:
                 temperature=0.0,
                 max_tokens=500
             )
-            uri_text = response.choices[0].message.content
 
-            uris = {}
-            for line in uri_text.split('\n'):
-                if line.strip() and ':' in line:
-                    parts = line.split(':', 1)
-                    entity = parts[0].strip().strip('-').strip()
-                    uri = parts[1].strip()
-                    uris[entity] = uri
+    def _parse_uris(self, uri_text: str) -> Dict[str, str]:
+        uris = {}
+        for line in uri_text.split('\n'):
+            if line.strip() and ':' in line:
+                parts = line.split(':', 1)
+                entity = parts[0].strip().strip('-').strip()
+                uri = parts[1].strip()
+                uris[entity] = uri
+
+        return uris
 
-            return uris
+    def _original_generate_uris(self, tagged_question: str, entities: Dict[str, str]) -> Dict[str, str]:
+        try:
+            response = self._complete('_original_generate_uris', self._uris_request(tagged_question, entities))
+            return self._parse_uris(response)
         except Exception as e:
             #print(f"Error in URI generation: {str(e)}")
             return {}
 
-    def generate_sparql(self, original_question: str, tagged_question: str, uris: Dict[str, str]) -> Optional[str]:
-
-        uri_mapping = "\n".join([f"- <{entity}> : {uri}" for entity, uri in uris.items()])
-        URI = [uri for entity, uri in uris.items()]
-
-        dbpedia_neighbors = [self.get_dbpedia_neighbors(f'{entity_url}') for entity_url in URI]
+    async def _aoriginal_generate_uris(self, tagged_question: str, entities: Dict[str, str]) -> Dict[str, str]:
+        try:
+            response = await self._acomplete('_original_generate_uris', self._uris_request(tagged_question, entities))
+            return self._parse_uris(response)
+        except Exception as e:
+            return {}
 
+    def _neighbours_per_entity(self, URI: List[str]) -> int:
         # for each URI got maximum 10 neighbours, but total amount of neighbours must be <= 30
+        return min(NEIGHBOURS_PER_ENTITY, NEIGHBOURS_TOTAL // max(len(URI), 1))
 
-        max_neighbours_per_entity = 30 // len(URI)
+    def _select_neighbors(self, dbpedia_neighbors: List[Dict[str, str]], URI: List[str]) -> List[str]:
+        max_neighbours_per_entity = self._neighbours_per_entity(URI)
 
         dbpedia_neighbors_uris = []
 
         for neighbour_dict in dbpedia_neighbors:
             dbpedia_neighbors_uris += list(neighbour_dict.values())[:max_neighbours_per_entity]
 
-        context_from_rag = self.rag.get_context(original_question, top_k=7)
+        return dbpedia_neighbors_uris
 
+    def _generation_request(self, original_question: str, tagged_question: str, uri_mapping: str,
+                            dbpedia_neighbors_uris: List[str], context_from_rag: str) -> Dict:
         prompt = f"""{self.SPARQL_GENERATION_PROMPT}\n\n
                 Input:
                 Original Question: "{original_question}"
@@ -433,8 +724,7 @@ class DBpediaPipeline:
                 Similar questions from datasets and correct SPARQL for them for the better context: {context_from_rag}
                 """
 
-        try:
-            response = self.client.chat.completions.create(
+        return dict(
                 model="gpt-4",
                 messages=[
                     {
@@ -515,10 +805,9 @@ class DBpediaPipeline:
                 max_tokens=800
             )
 
-            full_response = response.choices[0].message.content.strip()
-            sparql_match = re.search(r'SPARQL:\s*(.*?)$', full_response, re.DOTALL)
-            if not sparql_match:
-              correction_response = self.client.chat.completions.create(
+    def _correction_request(self, original_question: str, tagged_question: str, uri_mapping: str,
+                            full_response: str) -> Dict:
+        return dict(
               model="gpt-4",
               messages=[
                 {
@@ -565,15 +854,40 @@ class DBpediaPipeline:
               max_tokens=1000
               )
 
-              correction_text = correction_response.choices[0].message.content
+    def _parse_correction(self, correction_text: str) -> Optional[str]:
+        # Извлекаем исправленный SPARQL
+        corrected_sparql = re.search(r'CORRECTED SPARQL:\s*(.*?)$', correction_text, re.DOTALL) or \
+                          re.search(r'```sparql\n(.*?)```', correction_text, re.DOTALL)
+        if corrected_sparql:
+            return corrected_sparql.group(1).strip()
+        else:
+            return None
+
+    def generate_sparql(self, original_question: str, tagged_question: str, uris: Dict[str, str]) -> Optional[str]:
+
+        uri_mapping = "\n".join([f"- <{entity}> : {uri}" for entity, uri in uris.items()])
+        URI = [uri for entity, uri in uris.items()]
+
+        # Соседи сущностей - необязательное расширение контекста, при нехватке времени пропускается
+        if stage_allowed("neighbours"):
+            dbpedia_neighbors = self.get_dbpedia_neighbors_batch(URI, self._neighbours_per_entity(URI))
+        else:
+            dbpedia_neighbors = [{} for _ in URI]
+        dbpedia_neighbors_uris = self._select_neighbors(dbpedia_neighbors, URI)
+
+        context_from_rag = self.rag.get_context(original_question, top_k=7)
 
-              # Извлекаем исправленный SPARQL
-              corrected_sparql = re.search(r'CORRECTED SPARQL:\s*(.*?)$', correction_text, re.DOTALL) or \
-                                re.search(r'```sparql\n(.*?)```', correction_text, re.DOTALL)
-              if corrected_sparql:
-                  return corrected_sparql.group(1).strip()
-              else:
-                  return None
+        try:
+            full_response = self._complete('generate_sparql', self._generation_request(
+                original_question, tagged_question, uri_mapping, dbpedia_neighbors_uris, context_from_rag)).strip()
+            sparql_match = re.search(r'SPARQL:\s*(.*?)$', full_response, re.DOTALL)
+            if not sparql_match and not stage_allowed("sparql_correction"):
+                # Без исправления: запрос извлекается из ответа как есть на шаге проверки
+                return full_response
+            if not sparql_match:
+                correction_text = self._complete('sparql_correction', self._correction_request(
+                    original_question, tagged_question, uri_mapping, full_response))
+                return self._parse_correction(correction_text)
             else:
                 sparql_query = sparql_match.group(1).strip()
                 return sparql_query
@@ -581,29 +895,162 @@ class DBpediaPipeline:
         except Exception as e:
            return None
 
+    async def _aneighbours(self, URI: List[str]) -> List[Dict[str, str]]:
+        # Необязательное расширение контекста, при нехватке времени пропускается
+        if not stage_allowed("neighbours"):
+            return [{} for _ in URI]
+        return await self.aget_dbpedia_neighbors_batch(URI, self._neighbours_per_entity(URI))
+
+    async def agenerate_sparql(self, original_question: str, tagged_question: str, uris: Dict[str, str],
+                               context_from_rag: Optional[str] = None,
+                               dbpedia_neighbors: Optional[List[Dict[str, str]]] = None) -> Optional[str]:
+        """
+        Async variant of generate_sparql: neighbours and RAG context are fetched concurrently.
+        context_from_rag and dbpedia_neighbors can be passed in when they were already retrieved
+        (e.g. batched for many questions or by the stage graph)
+        """
+
+        uri_mapping = "\n".join([f"- <{entity}> : {uri}" for entity, uri in uris.items()])
+        URI = [uri for entity, uri in uris.items()]
+
+        if context_from_rag is None and dbpedia_neighbors is None:
+            dbpedia_neighbors, context_from_rag = await asyncio.gather(
+                self._aneighbours(URI),
+                asyncio.to_thread(self.rag.get_context, original_question, top_k=7)
+            )
+        elif context_from_rag is None:
+            context_from_rag = await asyncio.to_thread(self.rag.get_context, original_question, top_k=7)
+        elif dbpedia_neighbors is None:
+            dbpedia_neighbors = await self._aneighbours(URI)
+        dbpedia_neighbors_uris = self._select_neighbors(list(dbpedia_neighbors), URI)
+
+        try:
+            full_response = (await self._acomplete('generate_sparql', self._generation_request(
+                original_question, tagged_question, uri_mapping, dbpedia_neighbors_uris, context_from_rag))).strip()
+            sparql_match = re.search(r'SPARQL:\s*(.*?)$', full_response, re.DOTALL)
+            if not sparql_match and not stage_allowed("sparql_correction"):
+                # Без исправления: запрос извлекается из ответа как есть на шаге проверки
+                return full_response
+            if not sparql_match:
+                correction_text = await self._acomplete('sparql_correction', self._correction_request(
+                    original_question, tagged_question, uri_mapping, full_response))
+                return self._parse_correction(correction_text)
+            else:
+                return sparql_match.group(1).strip()
+
+        except Exception as e:
+           return None
+
     def postprocess_query(self, query) -> str:
         query = re.sub(r'^\s*#.*$', '', query, flags=re.MULTILINE)
         return query.strip()
 
+    def _validation_request(self, query) -> Tuple[str, Dict, Dict]:
+        params = {'query': query, 'format': 'json'}
+        headers = {'Accept': 'application/sparql-results+json'}
+        return self.dbpedia_endpoint, params, headers
+
+    def _validation_result(self, status_code: int, text: str, json_loader,
+                           probe_kind: str = "full") -> Tuple[bool, Optional[str]]:
+        if status_code == 400:
+            # Virtuoso возвращает текст ошибки компиляции запроса в теле ответа
+            return False, f"QueryBadFormed: {text[:1000]}".strip()
+        if status_code >= 400:
+            return False, f"HTTP {status_code}: {text[:1000]}".strip()
+        results = json_loader()
+        # Пробный ASK вместо SELECT: false означает пустой результат исходного запроса
+        if probe_kind == "ask" and results.get('boolean') is False:
+            return False, EMPTY_RESULTS_ERROR
+        return self._check_results(results)
+
+    def _run_sparql(self, endpoint: str, params: Dict, headers: Dict,
+                    stage: str = "validation") -> Tuple[int, str, Optional[Dict]]:
+        """
+        Выполняет SELECT/ASK на endpoint через кэш результатов.
+        Возвращает (HTTP-статус, текст ошибки, JSON-результат); сетевые ошибки не кэшируются и пробрасываются
+        """
+        if self.sparql_cache is not None:
+            cached = self.sparql_cache.get(endpoint, params['query'])
+            self.metrics.record_cache("sparql", self.PIPELINE_NAME, stage, "miss" if cached is None else "hit")
+            if cached is not None:
+                return cached["status"], cached["text"] or "", cached["results"]
+
+        with self.metrics.stage(self.PIPELINE_NAME, stage):
+            response = self.transport.request("GET", endpoint, params=params, headers=headers)
+        results = response.json() if response.status_code < 400 else None
+        if self.sparql_cache is not None:
+            self.sparql_cache.put(endpoint, params['query'], response.status_code, response.text, results)
+        return response.status_code, response.text, results
+
+    async def _arun_sparql(self, endpoint: str, params: Dict, headers: Dict,
+                           stage: str = "validation") -> Tuple[int, str, Optional[Dict]]:
+        """Async variant of _run_sparql"""
+        cache = self.sparql_cache
+        if cache is not None:
+            if cache.persistent:
+                cached = await asyncio.to_thread(cache.get, endpoint, params['query'])
+            else:
+                cached = cache.get(endpoint, params['query'])
+            self.metrics.record_cache("sparql", self.PIPELINE_NAME, stage, "miss" if cached is None else "hit")
+            if cached is not None:
+                return cached["status"], cached["text"] or "", cached["results"]
+
+        with self.metrics.stage(self.PIPELINE_NAME, stage):
+            response = await self.transport.arequest("GET", endpoint, params=params, headers=headers)
+        results = response.json() if response.status_code < 400 else None
+        if cache is not None:
+            if cache.persistent:
+                await asyncio.to_thread(cache.put, endpoint, params['query'], response.status_code, response.text,
+                                        results)
+            else:
+                cache.put(endpoint, params['query'], response.status_code, response.text, results)
+        return response.status_code, response.text, results
+
     def validate_query(self, query):
+      probe_kind, probe_query = self.validation_prober.probe(query)
+      endpoint, params, headers = self._validation_request(probe_query)
+      started = time.perf_counter()
       try:
-          self.sparql_endpoint.setQuery(query)
-          results = self.sparql_endpoint.query().convert()
-
-          # Проверка на пустые результаты
-          if 'boolean' in results.keys():
-              if isinstance(results['boolean'], bool):
-                  return True, None
-          elif 'results' in results:
-              if len(results['results']['bindings']) == 0:
-                  return False, "Query executed successfully but returned empty results. Please regenerate the query with different parameters or conditions."
-          return True, None
+          status_code, text, results = self._run_sparql(endpoint, params, headers)
+          return self._validation_result(status_code, text, lambda: results, probe_kind)
 
       except Exception as e:
-          error_msg = re.sub(r"Endpoint returned:.*", "", str(e)).strip()
-          return False, error_msg
+          return False, self._endpoint_error(e)
+
+      finally:
+          self.validation_prober.record(probe_kind, time.perf_counter() - started)
+
+    @staticmethod
+    def _endpoint_error(error: Exception) -> str:
+        # Текст ошибки для промпта исправления: без ответа endpoint, который повторяет запрос целиком
+        return re.sub(r"Endpoint returned:.*", "", str(error)).strip()
+
+    def _check_results(self, results: Dict) -> Tuple[bool, Optional[str]]:
+        # Проверка на пустые результаты
+        if 'boolean' in results.keys():
+            if isinstance(results['boolean'], bool):
+                return True, None
+        elif 'results' in results:
+            if len(results['results']['bindings']) == 0:
+                return False, EMPTY_RESULTS_ERROR
+        return True, None
+
+    async def avalidate_query(self, query):
+        """Async variant of validate_query"""
+        probe_kind, probe_query = self.validation_prober.probe(query)
+        endpoint, params, headers = self._validation_request(probe_query)
+        started = time.perf_counter()
+        try:
+            status_code, text, results = await self._arun_sparql(endpoint, params, headers)
+            return self._validation_result(status_code, text, lambda: results, probe_kind)
 
-    def repair_query(self, original_query, error, context):
+        except Exception as e:
+            return False, self._endpoint_error(e)
+
+        finally:
+            self.validation_prober.record(probe_kind, time.perf_counter() - started)
+
+    def _repair_request(self, original_query, error, context) -> Dict:
         prompt = self.QUERY_REPAIR_PROMPT.format(
           error=error,
           original_query=original_query,
@@ -611,8 +1058,7 @@ class DBpediaPipeline:
           tagged_question=context['tagged_question'],
           uris="\n".join([f"- {k}: {v}" for k,v in context['uris'].items()])
         )
-        try:
-          response = self.client.chat.completions.create(
+        return dict(
             model="gpt-4",
             messages=[
                 {
@@ -635,38 +1081,48 @@ class DBpediaPipeline:
             temperature=0.3,  # Немного креативности для альтернативных URI
             max_tokens=600
             )
-          return response.choices[0].message.content.strip()
+
+    def repair_query(self, original_query, error, context):
+        try:
+          return self._complete('repair_query', self._repair_request(original_query, error, context)).strip()
 
         except Exception as e:
             return None
 
-    def get_dbpedia_neighbors(self, entity_url: str):
-        """
-        Extracts all neighbours of an entity in DBpedia knowledge graph.
+    async def arepair_query(self, original_query, error, context):
+        try:
+          return (await self._acomplete('repair_query', self._repair_request(original_query, error, context))).strip()
 
-        Args:
-            entity_url (str): URL сущности в DBpedia (например, "http://dbpedia.org/resource/Danielle_Steel")
-        Returns:
-            dict: Словарь, где ключи - имена связанных сущностей, значения - их URL в DBpedia
-        """
-        # Проверяем и корректируем URL
+        except Exception as e:
+            return None
 
+    def _normalize_entity_url(self, entity_url: str) -> str:
+        # Проверяем и корректируем URL
         if not entity_url.startswith("http://dbpedia.org/resource/"):
             entity_url = f"http://dbpedia.org/resource/{entity_url.split('/')[-1]}"
+        return entity_url
+
+    def _neighbors_request(self, entity_urls: List[str], per_entity_limit: int) -> Tuple[str, Dict, Dict]:
+        # Один запрос на все сущности: по подзапросу с собственным LIMIT на каждую, объединённых через UNION
+        subqueries = [f"""
+              {{
+                SELECT DISTINCT ?entity ?neighbor ?neighborLabel WHERE {{
+                  VALUES ?entity {{ <{entity_url}> }}
+                  ?entity ?property ?neighbor .
+                  FILTER (isURI(?neighbor) && STRSTARTS(STR(?neighbor), "http://dbpedia.org/resource/"))
+                  OPTIONAL {{
+                    ?neighbor rdfs:label ?neighborLabel .
+                    FILTER (LANG(?neighborLabel) = "en")
+                  }}
+                }}
+                LIMIT {per_entity_limit}
+              }}""" for entity_url in entity_urls]
 
-
-        # SPARQL запрос для получения всех соседей
         sparql_query = f"""
             PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-            SELECT DISTINCT ?property ?neighbor ?neighborLabel WHERE {{
-              <{entity_url}> ?property ?neighbor .
-              FILTER (isURI(?neighbor) && STRSTARTS(STR(?neighbor), "http://dbpedia.org/resource/"))
-              OPTIONAL {{
-                ?neighbor rdfs:label ?neighborLabel .
-                FILTER (LANG(?neighborLabel) = "en")
-              }}
+            SELECT ?entity ?neighbor ?neighborLabel WHERE {{
+              {" UNION ".join(subqueries)}
             }}
-            LIMIT 30
             """
 
         # Параметры запроса
@@ -679,36 +1135,93 @@ class DBpediaPipeline:
             'Accept': 'application/sparql-results+json'
         }
 
-        endpoint_url = "https://dbpedia.org/sparql"
+        endpoint_url = self.neighbors_endpoint
 
-        try:
-            response = requests.get(endpoint_url, params=params, headers=headers, timeout=30)
-            response.raise_for_status()
-            results = response.json()
+        return endpoint_url, params, headers
 
-            neighbors = {}
+    def _parse_neighbors(self, results: Dict, entity_urls: List[str]) -> Dict[str, Dict[str, str]]:
+        neighbors = {entity_url: {} for entity_url in entity_urls}
 
-            for binding in results["results"]["bindings"]:
+        for binding in results["results"]["bindings"]:
+            entity_neighbors = neighbors.get(binding["entity"]["value"])
+            if entity_neighbors is None:
+                continue
+            neighbor_url = binding["neighbor"]["value"]
 
-              if len(list(neighbors.keys())) <= 10:
-                neighbor_url = binding["neighbor"]["value"]
+            # Используем URL как имя, если нет метки
+            neighbor_name = binding.get("neighborLabel", {}).get("value", neighbor_url.split("/")[-1].replace("_", " "))
+            entity_neighbors[neighbor_name] = neighbor_url
 
-                # Используем URL как имя, если нет метки
-                neighbor_name = binding.get("neighborLabel", {}).get("value", neighbor_url.split("/")[-1].replace("_", " "))
-                neighbors[neighbor_name] = neighbor_url
-              else:
-                break
+        return neighbors
 
-            return neighbors
+    def _prepare_neighbor_urls(self, entity_urls: List[str]) -> List[str]:
+        """Нормализованные URL без дублей; URI, которые нельзя подставить в запрос, отбрасываются"""
+        prepared = []
+        for entity_url in entity_urls:
+            entity_url = self._normalize_entity_url(entity_url)
+            if INVALID_IRI_CHARS.search(entity_url) is None and entity_url not in prepared:
+                prepared.append(entity_url)
+        return prepared
 
-        except Exception as e:
-            return {}
+    def get_dbpedia_neighbors_batch(self, entity_urls: List[str],
+                                    per_entity_limit: int = NEIGHBOURS_PER_ENTITY) -> List[Dict[str, str]]:
+        """
+        Extracts neighbours of several entities in DBpedia knowledge graph with a single SPARQL request.
 
-    def query_rewriting(self, question: str) -> str:
+        Args:
+            entity_urls (List[str]): URL сущностей в DBpedia
+            per_entity_limit (int): максимум соседей на одну сущность, ограничение выполняется на стороне endpoint
+        Returns:
+            list: для каждого URL словарь, где ключи - имена связанных сущностей, значения - их URL в DBpedia
+        """
+        prepared = self._prepare_neighbor_urls(entity_urls)
+        neighbors = {}
+        if prepared:
+            endpoint_url, params, headers = self._neighbors_request(prepared, per_entity_limit)
+            try:
+                status_code, text, results = self._run_sparql(endpoint_url, params, headers, "neighbours")
+                if status_code < 400:
+                    neighbors = self._parse_neighbors(results, prepared)
+            except Exception as e:
+                neighbors = {}
+
+        return [neighbors.get(self._normalize_entity_url(entity_url), {}) for entity_url in entity_urls]
+
+    async def aget_dbpedia_neighbors_batch(self, entity_urls: List[str],
+                                           per_entity_limit: int = NEIGHBOURS_PER_ENTITY) -> List[Dict[str, str]]:
+        """Async variant of get_dbpedia_neighbors_batch"""
+        prepared = self._prepare_neighbor_urls(entity_urls)
+        neighbors = {}
+        if prepared:
+            endpoint_url, params, headers = self._neighbors_request(prepared, per_entity_limit)
+            try:
+                status_code, text, results = await self._arun_sparql(endpoint_url, params, headers, "neighbours")
+                if status_code < 400:
+                    neighbors = self._parse_neighbors(results, prepared)
+            except Exception as e:
+                neighbors = {}
+
+        return [neighbors.get(self._normalize_entity_url(entity_url), {}) for entity_url in entity_urls]
+
+    def get_dbpedia_neighbors(self, entity_url: str):
+        """
+        Extracts all neighbours of an entity in DBpedia knowledge graph.
+
+        Args:
+            entity_url (str): URL сущности в DBpedia (например, "http://dbpedia.org/resource/Danielle_Steel")
+        Returns:
+            dict: Словарь, где ключи - имена связанных сущностей, значения - их URL в DBpedia
+        """
+        return self.get_dbpedia_neighbors_batch([entity_url])[0]
+
+    async def aget_dbpedia_neighbors(self, entity_url: str):
+        """Async variant of get_dbpedia_neighbors"""
+        return (await self.aget_dbpedia_neighbors_batch([entity_url]))[0]
+
+    def _rewriting_request(self, question: str) -> Dict:
         prompt = self.QUESTION_CLARIFY.format(question=question)
 
-        try:
-          response = self.client.chat.completions.create(
+        return dict(
             model="gpt-4",
             messages=[
                 {
@@ -725,23 +1238,139 @@ class DBpediaPipeline:
             ],
             max_tokens=600
             )
-          return response.choices[0].message.content.strip()
+
+    def query_rewriting(self, question: str) -> str:
+        try:
+          return self._complete('query_rewriting', self._rewriting_request(question)).strip()
 
         except Exception as e:
             return None
 
-    def execute_pipeline(self, question: str, max_retries: int = 2) -> Dict:
+    async def aquery_rewriting(self, question: str) -> str:
+        try:
+          return (await self._acomplete('query_rewriting', self._rewriting_request(question))).strip()
 
-        # Step 1) Translating
-        en_question = self.translate_to_english(question)
-        print('English question: ', en_question)
+        except Exception as e:
+            return None
 
-        # Step 2) Query rewriting
-        rewritten_question = self.query_rewriting(en_question)
-        print('Rewritten question: ', rewritten_question)
+    def _fused_request(self, question: str) -> Dict:
+        return dict(
+            model=self.fused_model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a DBpedia question pre-processor: you translate, clarify and tag entities "
+                               "of a question for SPARQL generation. Answer only with the requested JSON object."
+                },
+                {
+                    "role": "user",
+                    "content": self.FUSED_PREPROCESS_PROMPT.format(question=question)
+                }
+            ],
+            temperature=0.0,
+            max_tokens=600,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "dbpedia_preprocessing", "strict": True, "schema": FUSED_PREPROCESS_SCHEMA}
+            }
+        )
+
+    def _parse_fused(self, content: str) -> Optional[Dict]:
+        try:
+            data = json.loads(content)
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(data, dict):
+            return None
+        fields = [str(data.get(key) or "").strip()
+                  for key in ("english_question", "clarified_question", "intermediary_question")]
+        if not all(fields):
+            return None
+        en_question, rewritten_question, tagged_question = fields
+        return {
+            "en_question": en_question,
+            "rewritten_question": rewritten_question,
+            # Без размеченных сущностей используется отдельный вызов NER
+            "tagged_question": tagged_question if "<" in tagged_question else None,
+            "entities": self._tagged_entities(tagged_question)
+        }
+
+    def fused_preprocess(self, question: str) -> Dict:
+        """
+        English, clarified and tagged question in one structured completion.
+        If the completion fails or does not match the schema, the staged translation and rewriting are used
+        (tagged_question is None then and NER runs separately)
+        """
+        try:
+            preprocessed = self._parse_fused(self._complete('fused_preprocessing', self._fused_request(question)))
+        except Exception as e:
+            preprocessed = None
+        if preprocessed is not None:
+            return preprocessed
 
-        # Step 3) Entity recognition
-        tagged_question, entities_URI = self.uris(rewritten_question)
+        en_question = self.to_english(question)
+        rewritten_question = self.query_rewriting(en_question) if stage_allowed("query_rewriting") else None
+        return {"en_question": en_question, "rewritten_question": rewritten_question or en_question,
+                "tagged_question": None, "entities": {}}
+
+    async def afused_preprocess(self, question: str) -> Dict:
+        """Async variant of fused_preprocess"""
+        try:
+            preprocessed = self._parse_fused(
+                await self._acomplete('fused_preprocessing', self._fused_request(question)))
+        except Exception as e:
+            preprocessed = None
+        if preprocessed is not None:
+            return preprocessed
+
+        en_question = await self.ato_english(question)
+        return {"en_question": en_question, "rewritten_question": await self._stage_rewrite(en_question),
+                "tagged_question": None, "entities": {}}
+
+    def _mark_degraded(self, result: Dict, deadline: Deadline) -> Dict:
+        """Помечает результат, если из-за крайнего срока часть шагов была пропущена или прервана"""
+        if deadline.degraded or deadline.expired():
+            result["degraded"] = True
+            result["skipped_stages"] = list(deadline.skipped)
+        return result
+
+    def execute_pipeline(self, question: str, max_retries: Optional[int] = None,
+                         deadline: Optional[Deadline] = None) -> Dict:
+        """
+        Full DBpedia pipeline. With a deadline, optional stages (query rewriting, neighbours, correction, repairs)
+        are skipped when the remaining budget is low and the best query found so far is returned with degraded=True
+        """
+        deadline = deadline or Deadline()
+        with deadline.activate(), self.metrics.stage(self.PIPELINE_NAME, "pipeline"):
+            result = self._execute_pipeline(question, max_retries)
+        return self._mark_degraded(result, deadline)
+
+    def _execute_pipeline(self, question: str, max_retries: Optional[int] = None) -> Dict:
+
+        if self.preprocessing == "fused":
+            # Steps 1-3) Translating, query rewriting and entity tagging in one completion, Spotlight goes first
+            preprocessed = self.fused_preprocess(question)
+            en_question = preprocessed["en_question"]
+            rewritten_question = preprocessed["rewritten_question"]
+            if preprocessed["tagged_question"]:
+                extract_entities = lambda: (preprocessed["tagged_question"], preprocessed["entities"])
+            else:
+                extract_entities = lambda: self._original_extract_entities(rewritten_question)
+            tagged_question, entities_URI = self._resolve_entities(
+                rewritten_question, self.get_dbpedia(rewritten_question), extract_entities)
+            if not tagged_question:
+                return {"error": "Failed to extract entities"}
+        else:
+            # Step 1) Translating
+            en_question = self.to_english(question)
+            print('English question: ', en_question)
+
+            # Step 2) Query rewriting
+            rewritten_question = self.query_rewriting(en_question) if stage_allowed("query_rewriting") else en_question
+            print('Rewritten question: ', rewritten_question)
+
+            # Step 3) Entity recognition
+            tagged_question, entities_URI = self.uris(rewritten_question)
 
         # Step 4) SPARQL generation
         sparql = self.generate_sparql(en_question, tagged_question, entities_URI)
@@ -749,31 +1378,170 @@ class DBpediaPipeline:
         if not sparql:
             return {"error": "Failed to generate SPARQL", "tagged_question": tagged_question, "uris": entities_URI}
 
-        # Step 5) SPARQL repairing
-        for attempt in range(max_retries + 1):
-            is_valid, error = self.validate_query(sparql)
-            if is_valid:
-                return {
-                    "status": "success",
-                    "tagged_question": tagged_question,
-                    "uris": entities_URI,
-                    "sparql": sparql
-                }
+        # Step 5) SPARQL repairing: local syntax check, remote validation, repaired query becomes the next candidate
+        context = {
+            "original_question": en_question,
+            "tagged_question": tagged_question,
+            "uris": entities_URI
+        }
+        outcome = self.repair_engine.run(
+            sparql, self.validate_query,
+            lambda query, error: self.repair_query(query, error, context),
+            max_attempts=None if max_retries is None else max_retries + 1
+        )
 
-            if attempt < max_retries:
-                context = {
-                    "original_question": en_question,
-                    "tagged_question": tagged_question,
-                    "uris": entities_URI
-                }
-                repaired_query = self.repair_query(sparql, error, context)
-                if repaired_query and repaired_query != sparql:
-                    continue
+        if outcome["valid"]:
+            return {
+                "status": "success",
+                "tagged_question": tagged_question,
+                "uris": entities_URI,
+                "sparql": outcome["sparql"]
+            }
+
+        return {
+            "status": "error",
+            "error": outcome["error"],
+            "tagged_question": tagged_question,
+            "uris": entities_URI,
+            "sparql": outcome["sparql"]
+        }
+
+    async def aexecute_pipeline(self, question: str, max_retries: Optional[int] = None, en_question: Optional[str] = None,
+                                rag_context: Optional[str] = None, deadline: Optional[Deadline] = None) -> Dict:
+        """
+        Async variant of execute_pipeline: LLM and HTTP calls are awaited, CPU-bound embedding runs in an executor,
+        so one worker can serve many questions concurrently.
+        en_question and rag_context skip the corresponding steps when they were computed beforehand
+        """
+        deadline = deadline or Deadline()
+        with deadline.activate(), self.metrics.stage(self.PIPELINE_NAME, "pipeline"):
+            result = await self._aexecute_pipeline(question, max_retries, en_question, rag_context)
+        return self._mark_degraded(result, deadline)
+
+    def _build_stage_graph(self) -> StageGraph:
+        """
+        Async pipeline as a dependency graph: RAG retrieval overlaps with rewriting and entity recognition,
+        neighbours start as soon as URIs are known. Speculative branches: Spotlight on the English question
+        (used when rewriting keeps the question unchanged) and the GPT-4 NER fallback started before Spotlight answers
+        """
+        graph = StageGraph(inputs=("question", "max_retries"))
+        if self.preprocessing == "fused":
+            # Перевод, уточнение и разметка сущностей - один вызов; NER нужен, только если разметки нет
+            graph.add("preprocessed", lambda question: self.afused_preprocess(question), after=("question",))
+            graph.add("en_question", lambda preprocessed: preprocessed["en_question"], after=("preprocessed",))
+            graph.add("rewritten_question", lambda preprocessed: preprocessed["rewritten_question"],
+                      after=("preprocessed",))
+        else:
+            graph.add("en_question", lambda question: self.ato_english(question), after=("question",))
+            graph.add("rewritten_question", self._stage_rewrite, after=("en_question",))
+        graph.add("rag_context", lambda en_question: asyncio.to_thread(self.rag.get_context, en_question, top_k=7),
+                  after=("en_question",))
+        graph.add("spotlight_en", lambda en_question: self.aget_dbpedia(en_question),
+                  after=("en_question",), speculative=True)
+        if self.preprocessing == "fused":
+            graph.add("ner", self._stage_fused_entities, after=("preprocessed", "rewritten_question"),
+                      speculative=True)
+        else:
+            graph.add("ner", lambda rewritten_question: self._aoriginal_extract_entities(rewritten_question),
+                      after=("rewritten_question",), speculative=True)
+        graph.add("entities", self._stage_entities, after=("en_question", "rewritten_question"),
+                  speculations=("spotlight_en", "ner"))
+        graph.add("neighbours", lambda entities: self._aneighbours(list(entities[1].values())), after=("entities",))
+        graph.add("sparql", self._stage_generate, after=("en_question", "entities", "neighbours", "rag_context"))
+        graph.add("outcome", self._stage_repair, after=("en_question", "entities", "sparql", "max_retries"))
+        return graph
+
+    async def _stage_rewrite(self, en_question: str) -> str:
+        if not stage_allowed("query_rewriting"):
+            return en_question
+        # Ошибка переписывания не останавливает пайплайн: используется исходный вопрос
+        return await self.aquery_rewriting(en_question) or en_question
+
+    async def _stage_fused_entities(self, preprocessed: Dict, rewritten_question: str):
+        if preprocessed["tagged_question"]:
+            return preprocessed["tagged_question"], preprocessed["entities"]
+        return await self._aoriginal_extract_entities(rewritten_question)
+
+    async def _stage_entities(self, en_question: str, rewritten_question: str, spotlight_en, ner):
+        if rewritten_question == en_question:
+            spotlight_result = spotlight_en.result()
+        else:
+            spotlight_en.cancel()
+            spotlight_result = self.aget_dbpedia(rewritten_question)
+        return await self._aresolve_entities(rewritten_question, spotlight_result, ner.result, ner.cancel)
+
+    async def _stage_generate(self, en_question: str, entities, neighbours, rag_context) -> Optional[str]:
+        tagged_question, entities_URI = entities
+        if not tagged_question:
+            return None
+        return await self.agenerate_sparql(en_question, tagged_question, entities_URI, rag_context, neighbours)
 
+    async def _stage_repair(self, en_question: str, entities, sparql: Optional[str], max_retries: Optional[int]):
+        if not sparql:
+            return None
+        # Step 5) SPARQL repairing: local syntax check, remote validation, repaired query becomes the next candidate
+        tagged_question, entities_URI = entities
+        context = {
+            "original_question": en_question,
+            "tagged_question": tagged_question,
+            "uris": entities_URI
+        }
+
+        async def validate(query):
+            valid, error = await self.avalidate_query(query)
+            emit("validation", {"sparql": query, "valid": valid, "error": error})
+            return valid, error
+
+        return await self.repair_engine.arun(
+            sparql, validate,
+            lambda query, error: self.arepair_query(query, error, context),
+            max_attempts=None if max_retries is None else max_retries + 1
+        )
+
+    def _report_stage(self, name: str, result):
+        """События потоковой выдачи (SSE) по завершённым шагам графа"""
+        if name == "en_question":
+            emit("translated", {"question": result})
+        elif name == "rewritten_question":
+            emit("clarified", {"question": result})
+        elif name == "entities" and result[0]:
+            emit("tagged", {"tagged_question": result[0]})
+            emit("uris", {"uris": result[1]})
+        elif name == "sparql" and result:
+            emit("candidate", {"sparql": result})
+
+    async def _aexecute_pipeline(self, question: str, max_retries: Optional[int] = None,
+                                 en_question: Optional[str] = None, rag_context: Optional[str] = None) -> Dict:
+
+        # Steps 1-5 (translating, query rewriting, entity recognition, SPARQL generation and repairing)
+        # run as a stage graph, so the latency follows the critical path instead of the sum of the steps
+        inputs = {"question": question, "max_retries": max_retries}
+        if en_question is not None:
+            inputs["en_question"] = en_question
+        if rag_context is not None:
+            inputs["rag_context"] = rag_context
+        results = await self.stage_executor.run(self.stage_graph, inputs, self._report_stage)
+
+        tagged_question, entities_URI = results["entities"]
+        if not tagged_question:
+            return {"error": "Failed to extract entities"}
+
+        if not results["sparql"]:
+            return {"error": "Failed to generate SPARQL", "tagged_question": tagged_question, "uris": entities_URI}
+
+        outcome = results["outcome"]
+        if outcome["valid"]:
             return {
-                "status": "error",
-                "error": error,
+                "status": "success",
                 "tagged_question": tagged_question,
                 "uris": entities_URI,
-                "sparql": sparql
-            }
\ No newline at end of file
+                "sparql": outcome["sparql"]
+            }
+
+        return {
+            "status": "error",
+            "error": outcome["error"],
+            "tagged_question": tagged_question,
+            "uris": entities_URI,
+            "sparql": outcome["sparql"]
+        }
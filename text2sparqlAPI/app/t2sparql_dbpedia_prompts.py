@@ -426,3 +426,22 @@ Output: "What was Apple Inc.'s revenue in 2020?" (Clarify: Apple the company vs.
 3) Input: "USA President during WWII."
 Output: "Who was the president of the United States during World War II?" (Clarify: country name + World War)
 """
+
+
+FUSED_PREPROCESS_PROMPT = """
+Prepare the question below for SPARQL generation over DBpedia in three steps and return them as one JSON object.
+
+1) english_question: translate the question to English exactly, preserving all named entities (names, places, titles), technical terms and the question structure. If the question is already in English, copy it unchanged.
+
+2) clarified_question: clarify the English question if it is ambiguous / incomplete - disambiguate place names, add missing context, correct assumptions. Change the question as little as possible; if it is correct (not ambiguous), copy it without changes.
+   - "Washington is the capital of what country?" -> "Washington DC is the capital of what country?"
+   - "USA President during WWII." -> "Who was the president of the United States during World War II?"
+
+3) intermediary_question: the clarified question with classes, properties and concrete entities wrapped in angle brackets. Keep original capitalization in entity names. Write the short step-by-step reasoning (what we are asked, which entity types and entities must be identified) into "analysis" first.
+   - "Who are relatives of Ozzy Osbourne and Kelly Osbourne?" -> "Whose <relativess> are <Ozzy Osbourne> and <Kelly Osbourne>?"
+   - "What is the television show whose previous work is The Spirit of Christmas (short film)?" -> "What is the <television show> whose <previous work> is <The Spirit of Christmas (short film)>?"
+   - "Which office holder's governor is Charles Willing Byrd and has final resting place in North Bend, Ohio?" -> "What is the <office holder> whose <governor> is <Charles Willing Byrd> and <restingplace> is <North Bend, Ohio>?"
+   - "Where is the headquarters of the public transit system which owns the American Boulevard (Metro Transit station)?" -> "What is the <headquarters> of the <public transit system> which is the <owning organisation> of <American Boulevard (Metro Transit station)>?"
+
+Input question: {question}
+"""
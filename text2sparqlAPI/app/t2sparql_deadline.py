@@ -0,0 +1,98 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# Сколько секунд должно оставаться, чтобы начать необязательный шаг: время самого шага
+# плюс обязательные шаги после него (NER, URI, генерация и проверка - несколько вызовов GPT-4)
+STAGE_RESERVES = {
+    "query_rewriting": 20.0,
+    "neighbours": 12.0,
+    "sparql_correction": 10.0,
+    "repair_query": 8.0,
+}
+
+_current: ContextVar[Optional["Deadline"]] = ContextVar("t2sparql_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Время на запрос истекло, внешний вызов не выполнялся"""
+
+
+class Deadline:
+    """
+    Крайний срок обработки одного запроса. Активный срок хранится в contextvar, поэтому его видят все шаги
+    пайплайна (в том числе задачи asyncio и HTTP/LLM-вызовы) без передачи через каждую функцию.
+    Пропущенные из-за нехватки времени шаги запоминаются - результат помечается как degraded
+    """
+
+    def __init__(self, timeout: Optional[float] = None, reserves: Optional[Dict[str, float]] = None):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self.reserves = dict(STAGE_RESERVES, **(reserves or {}))
+        self.skipped: List[str] = []
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def allows(self, stage: str) -> bool:
+        """Хватает ли времени на необязательный шаг; если нет - шаг отмечается как пропущенный"""
+        remaining = self.remaining()
+        if remaining is None or remaining >= self.reserves.get(stage, 0.0):
+            return True
+        self.skip(stage)
+        return False
+
+    def skip(self, stage: str):
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.skipped)
+
+    def bound(self, timeout: Optional[float]) -> Optional[float]:
+        """Таймаут внешнего вызова, не выходящий за крайний срок"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.timeout}s exceeded")
+        return remaining if timeout is None else min(timeout, remaining)
+
+    @contextmanager
+    def activate(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def bounded_timeout(timeout: Optional[float]) -> Optional[float]:
+    """Таймаут с учётом крайнего срока текущего запроса (если он задан)"""
+    deadline = _current.get()
+    return timeout if deadline is None else deadline.bound(timeout)
+
+
+def stage_allowed(stage: str) -> bool:
+    deadline = _current.get()
+    return deadline is None or deadline.allows(stage)
+
+
+def timeout_kwargs() -> Dict:
+    """Аргумент timeout для вызова OpenAI, если у запроса есть крайний срок (иначе таймаут клиента)"""
+    deadline = _current.get()
+    if deadline is None or deadline.expires_at is None:
+        return {}
+    return {"timeout": deadline.bound(None)}
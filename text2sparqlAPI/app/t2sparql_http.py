@@ -0,0 +1,235 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InsecureRequestWarning
+
+from t2sparql_deadline import bounded_timeout, current_deadline
+
+# Ответы, после которых имеет смысл повторить запрос; только они (и сетевые ошибки) считаются сбоем хоста.
+# Остальные 5xx (например, 500 Virtuoso на неверный запрос) относятся к самому запросу и возвращаются как есть
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Хост признан недоступным, запрос не отправлялся"""
+
+
+class CircuitBreaker:
+    """
+    Автомат closed -> open -> half-open для одного хоста.
+    После failure_threshold ошибок подряд запросы отклоняются reset_timeout секунд,
+    затем пропускается одна пробная попытка: успех закрывает автомат, ошибка снова открывает
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            # Пробная попытка уже идёт; зависшая (отменённая) попытка перестаёт блокировать через reset_timeout
+            if self._trial_started_at is not None and now - self._trial_started_at < self.reset_timeout:
+                return False
+            self._trial_started_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_started_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_started_at = None
+
+
+class HttpTransport:
+    """
+    Общий транспорт для исходящих HTTP-запросов (Spotlight, SPARQL endpoint, соседи сущностей):
+    пулы соединений с keep-alive, ограничение соединений на хост, таймауты,
+    повторы с экспоненциальной задержкой и джиттером, circuit breaker на каждый хост
+    """
+
+    def __init__(self, timeout: float = 15.0, connect_timeout: float = 3.0, max_connections_per_host: int = 20,
+                 retries: int = 2, backoff_base: float = 0.2, backoff_max: float = 2.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections_per_host = max_connections_per_host
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        # Синхронный путь: requests.Session с пулом на каждый хост
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max_connections_per_host, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Асинхронный путь: по клиенту на режим проверки SSL, лимит на хост - семафорами
+        self._async_clients: Dict[bool, httpx.AsyncClient] = {}
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).netloc
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter: случайная задержка в [0, base * 2^attempt]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _timeout(self, timeout: Optional[float]) -> float:
+        # Не дольше, чем осталось до крайнего срока запроса; после него вызов не выполняется
+        return bounded_timeout(self.timeout if timeout is None else timeout)
+
+    def _retry_delay(self, attempt: int) -> Optional[float]:
+        """Задержка перед повтором или None, если повторов не осталось или повтор не успеет до крайнего срока"""
+        if attempt >= self.retries:
+            return None
+        delay = self._backoff(attempt)
+        deadline = current_deadline()
+        remaining = deadline.remaining() if deadline is not None else None
+        if remaining is not None and remaining <= delay + self.connect_timeout:
+            return None
+        return delay
+
+    def request(self, method: str, url: str, params: Optional[Dict] = None, data: Optional[Dict] = None,
+                headers: Optional[Dict] = None, timeout: Optional[float] = None,
+                verify: bool = True) -> requests.Response:
+        """
+        Синхронный запрос. Ответы с ошибкой вне RETRY_STATUSES возвращаются как есть (это ответ сервера, а не сбой),
+        сетевые ошибки и RETRY_STATUSES после исчерпания повторов пробрасываются
+        """
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+
+        if not verify:
+            requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+        for attempt in range(self.retries + 1):
+            try:
+                request_timeout = self._timeout(timeout)
+                response = self.session.request(
+                    method, url, params=params, data=data, headers=headers, verify=verify,
+                    timeout=(min(self.connect_timeout, request_timeout), request_timeout)
+                )
+                if response.status_code in RETRY_STATUSES:
+                    delay = self._retry_delay(attempt)
+                    if delay is not None:
+                        time.sleep(delay)
+                        continue
+                    breaker.record_failure()
+                    response.raise_for_status()
+                breaker.record_success()
+                return response
+            except (requests.ConnectionError, requests.Timeout):
+                delay = self._retry_delay(attempt)
+                if delay is not None:
+                    time.sleep(delay)
+                    continue
+                breaker.record_failure()
+                raise
+
+    def _async_client(self, verify: bool) -> httpx.AsyncClient:
+        client = self._async_clients.get(verify)
+        if client is None:
+            client = self._async_clients[verify] = httpx.AsyncClient(
+                verify=verify,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_keepalive_connections=self.max_connections_per_host)
+            )
+        return client
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return semaphore
+
+    async def arequest(self, method: str, url: str, params: Optional[Dict] = None, data: Optional[Dict] = None,
+                       headers: Optional[Dict] = None, timeout: Optional[float] = None,
+                       verify: bool = True) -> httpx.Response:
+        """Асинхронный вариант request с теми же правилами повторов и circuit breaker"""
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+
+        client = self._async_client(verify)
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._host_semaphore(url):
+                    seconds = self._timeout(timeout)
+                    request_timeout = httpx.Timeout(seconds, connect=min(self.connect_timeout, seconds))
+                    response = await client.request(method, url, params=params, data=data, headers=headers,
+                                                    timeout=request_timeout)
+                if response.status_code in RETRY_STATUSES:
+                    delay = self._retry_delay(attempt)
+                    if delay is not None:
+                        await asyncio.sleep(delay)
+                        continue
+                    breaker.record_failure()
+                    response.raise_for_status()
+                breaker.record_success()
+                return response
+            except httpx.TransportError:
+                delay = self._retry_delay(attempt)
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    continue
+                breaker.record_failure()
+                raise
+
+    def stats(self) -> Dict:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {host: breaker.state for host, breaker in breakers.items()}
+
+    def close(self):
+        self.session.close()
+
+    async def aclose(self):
+        clients = list(self._async_clients.values())
+        self._async_clients.clear()
+        for client in clients:
+            await client.aclose()
+        self.close()
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Iterable, Optional
+
+import faiss
+
+# Меняется при изменении формата файлов в кэше: старые записи просто перестают находиться
+CACHE_FORMAT_VERSION = 2
+
+INDEX_FILE = "index.faiss"
+
+# Flat-индексы в новых версиях faiss мапятся через IO_FLAG_MMAP_IFC, в старых флага нет
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+
+
+def dataset_fingerprint(paths: Iterable[str], **settings) -> str:
+    """
+    Ключ кэша: хэш содержимого файлов датасетов и настроек построения (модель, нормализация и т.д.)
+    """
+    digest = hashlib.sha256()
+    digest.update(f"format={CACHE_FORMAT_VERSION}".encode("utf-8"))
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(b"\0")
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class IndexCache:
+    """
+    Кэш сериализованного FAISS-индекса на диске, одна поддиректория на ключ.
+    Отдельная матрица эмбеддингов не хранится: векторы (или их коды) есть в самом индексе
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key: str) -> Optional[faiss.Index]:
+        index_path = os.path.join(self.entry_dir(key), INDEX_FILE)
+        if not os.path.exists(index_path):
+            return None
+
+        try:
+            try:
+                index = faiss.read_index(index_path, MMAP_FLAGS)
+            except RuntimeError:
+                # Тип индекса не поддерживает mmap - читаем целиком
+                index = faiss.read_index(index_path)
+        except (OSError, ValueError, RuntimeError):
+            # Повреждённая запись - пересоберём
+            return None
+        return index
+
+    def save(self, key: str, index: faiss.Index):
+        """Атомарная запись: файлы пишутся во временную директорию и переименовываются целиком"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{key}-", dir=self.cache_dir)
+        try:
+            faiss.write_index(index, os.path.join(tmp_dir, INDEX_FILE))
+            try:
+                os.rename(tmp_dir, self.entry_dir(key))
+            except OSError:
+                # Запись уже создана параллельным процессом
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
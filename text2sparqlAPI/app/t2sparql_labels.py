@@ -0,0 +1,134 @@
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from rdflib import URIRef
+from rdflib.namespace import RDFS
+
+# Предикаты с точными названиями сущностей корпоративного графа
+LABEL_PREDICATES = (str(RDFS.label), "http://ld.company.org/prod-vocab/name")
+
+
+def normalize_label(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class LabelIndex:
+    """
+    Словарь названий сущностей (rdfs:label, pv:name) -> номера чанков, скомпилированный в автомат Ахо-Корасик:
+    все упоминания названий в вопросе находятся за один проход по тексту, независимо от размера словаря.
+    Названия, общие для многих сущностей (цены, типовые имена деталей), не закрепляются - они не уточняют контекст
+    """
+
+    def __init__(self, labels: Dict[str, List[int]], max_targets: int = 3):
+        self.labels = labels
+        self.max_targets = max_targets
+        self._targets: Dict[str, Tuple[str, List[int]]] = {}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+
+        for label, chunks in labels.items():
+            key = normalize_label(label)
+            if not key:
+                continue
+            if key in self._targets:
+                self._targets[key][1].extend(chunk for chunk in chunks if chunk not in self._targets[key][1])
+                continue
+            self._targets[key] = (label, list(chunks))
+            self._insert(key)
+        self._link()
+
+    def _insert(self, key: str):
+        node = 0
+        for char in key:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = next_node
+        self._out[node].append(key)
+
+    def _link(self):
+        """Суффиксные ссылки обходом в ширину; выходы узла дополняются выходами его суффиксной ссылки"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    @classmethod
+    def from_graph(cls, graph, chunk_ids: Dict[str, int], max_targets: int = 3) -> "LabelIndex":
+        """chunk_ids - URI (или id пустого узла) сущности -> номер её чанка"""
+        labels: Dict[str, List[int]] = {}
+        for predicate in LABEL_PREDICATES:
+            for entity, label in graph.subject_objects(URIRef(predicate)):
+                chunk = chunk_ids.get(str(entity))
+                if chunk is not None and chunk not in labels.setdefault(str(label), []):
+                    labels[str(label)].append(chunk)
+        return cls(labels, max_targets)
+
+    @classmethod
+    def from_chunks(cls, chunks: List[str], namespaces: Iterable[Tuple[str, str]],
+                    max_targets: int = 3) -> "LabelIndex":
+        """Словарь по тексту чанков - для снапшотов, сохранённых без словаря названий"""
+        names = set()
+        for predicate in LABEL_PREDICATES:
+            names.add(f"<{predicate}>")
+            for prefix, ns in namespaces:
+                if predicate.startswith(ns):
+                    names.add(f"{prefix}:{predicate[len(ns):]}")
+        pattern = re.compile(r'^(' + "|".join(re.escape(name) for name in names) + r') <(.*)>$', re.MULTILINE)
+
+        labels: Dict[str, List[int]] = {}
+        for chunk_id, chunk in enumerate(chunks):
+            for match in pattern.finditer(chunk):
+                if chunk_id not in labels.setdefault(match.group(2), []):
+                    labels[match.group(2)].append(chunk_id)
+        return cls(labels, max_targets)
+
+    def find(self, text: str) -> List[Dict]:
+        """
+        Упоминания названий в тексте (без учёта регистра, по границам слов): самые левые и самые длинные,
+        без пересечений
+        """
+        text = normalize_label(text)
+        candidates = []
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for key in self._out[node]:
+                start = end - len(key)
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    candidates.append((start, end, key))
+
+        matches, covered = [], 0
+        for start, end, key in sorted(candidates, key=lambda match: (match[0], match[0] - match[1])):
+            if start < covered:
+                continue
+            label, chunks = self._targets[key]
+            matches.append({"label": label, "start": start, "end": end, "chunks": chunks})
+            covered = end
+        return matches
+
+    def pinned(self, text: str, limit: Optional[int] = None) -> List[Tuple[int, str]]:
+        """Чанки упомянутых сущностей в порядке упоминания: (номер чанка, название)"""
+        result, seen = [], set()
+        for match in self.find(text):
+            if len(match["chunks"]) > self.max_targets:
+                continue
+            for chunk in match["chunks"]:
+                if chunk not in seen:
+                    seen.add(chunk)
+                    result.append((chunk, match["label"]))
+        return result[:limit] if limit is not None else result
@@ -0,0 +1,147 @@
+import re
+import threading
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# Служебные слова латинских языков, встречающиеся в вопросах QALD / LC-QuAD
+STOPWORDS = {
+    'en': "what which who whom whose where when how why is are was were do does did the a an of in on at to for from "
+          "by with and or list give me show tell name many much has have had there that this these those it its "
+          "born not more than as all also called",
+    'de': "was welche welcher welches wer wem wessen wo wann wie warum ist sind war waren der die das ein eine einen "
+          "von im in auf an zu für aus mit und oder gib mir zeige nenne viele hat haben gibt es dem den des nicht "
+          "geboren",
+    'fr': "quel quelle quels quelles qui que quoi où quand comment pourquoi est sont était le la les un une des de du "
+          "dans sur à au aux pour avec et ou donne moi montre combien il y a ce cette ces ne pas né née",
+    'es': "qué cuál cuáles quién quiénes dónde cuándo cómo por es son era fue el la los las un una de del en con y o "
+          "dame muestra cuántos cuántas hay este esta estos no nació",
+    'it': "che quale quali chi dove quando come perché è sono era il lo la i gli le un una di del della in su con e o "
+          "dammi mostra quanti quante ci questo questa non nato nata",
+    'pt': "que qual quais quem onde quando como porque é são era foi o a os as um uma de do da dos das em no na com e "
+          "ou me mostre quantos quantas há este esta não nasceu",
+    'nl': "wat welke wie waar wanneer hoe waarom is zijn was waren de het een van in op aan voor uit met en of geef "
+          "mij toon hoeveel er dit deze niet geboren",
+    'lt': "kas koks kokia kurie kuris kur kada kaip kodėl yra buvo ir ar iš su į apie kiek šis ši ne gimė",
+    'pl': "co jaki jaka który która kto gdzie kiedy jak dlaczego jest są był była w na z do od i lub ile ten ta nie "
+          "urodził",
+}
+
+# Буквы с диакритикой как слабый признак языка
+DIACRITICS = {
+    'de': "äöüß",
+    'fr': "àâçèéêëîïôœùûÿ",
+    'es': "áéíñóúü¿¡",
+    'it': "àèéìòù",
+    'pt': "ãõâêôáéíóúàç",
+    'lt': "ąčęėįšųūž",
+    'pl': "ąćęłńóśźż",
+}
+
+# Нелатинские письменности определяются по диапазонам Unicode
+SCRIPTS = [
+    ('hy', re.compile(r'[԰-֏]')),
+    ('ka', re.compile(r'[Ⴀ-ჿ]')),
+    ('el', re.compile(r'[Ͱ-Ͽ]')),
+    ('he', re.compile(r'[֐-׿]')),
+    ('ar', re.compile(r'[؀-ۿ]')),
+    ('hi', re.compile(r'[ऀ-ॿ]')),
+    ('th', re.compile(r'[฀-๿]')),
+    ('ko', re.compile(r'[가-힯]')),
+    ('ja', re.compile(r'[぀-ヿ]')),
+    ('zh', re.compile(r'[一-鿿]')),
+    ('cyrillic', re.compile(r'[Ѐ-ӿ]')),
+]
+
+# Отличительные буквы кириллических языков; "і" есть и в украинском, и в белорусском
+CYRILLIC_MARKERS = [
+    ('ba', "ҡғҙҫһәөүң"),
+    ('be', "ў"),
+    ('uk', "їєґ"),
+]
+
+TOKEN = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+_WORDS = {lang: set(words.split()) for lang, words in STOPWORDS.items()}
+# Вес слова обратно пропорционален числу языков, где оно служебное ("in", "de", "a" ...)
+_WORD_LANGS: Dict[str, list] = {}
+for _lang, _words in _WORDS.items():
+    for _word in _words:
+        _WORD_LANGS.setdefault(_word, []).append(_lang)
+
+
+def detect_language(text: str) -> Tuple[Optional[str], float]:
+    """
+    Быстрое определение языка без сети: письменность по Unicode, для латиницы - служебные слова и диакритика.
+    Возвращает (код языка или None, уверенность 0..1)
+    """
+    if not text or not text.strip():
+        return None, 0.0
+
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return None, 0.0
+
+    # Нелатинская письменность, занимающая заметную часть текста
+    for lang, pattern in SCRIPTS:
+        share = len(pattern.findall(text)) / len(letters)
+        if share >= 0.3:
+            if lang == 'cyrillic':
+                lowered = text.lower()
+                for cyrillic_lang, markers in CYRILLIC_MARKERS:
+                    if any(ch in lowered for ch in markers):
+                        return cyrillic_lang, min(1.0, share)
+                if 'і' in lowered:
+                    # В белорусском нет "и", в украинском она обычна
+                    return ('uk' if 'и' in lowered else 'be'), min(1.0, share) * 0.9
+                return 'ru', min(1.0, share) * 0.9
+            return lang, min(1.0, share)
+
+    scores: Counter = Counter()
+    for token in TOKEN.findall(text.lower()):
+        langs = _WORD_LANGS.get(token)
+        if langs:
+            for lang in langs:
+                scores[lang] += 1.0 / len(langs)
+
+    lowered = text.lower()
+    for lang, chars in DIACRITICS.items():
+        hits = sum(1 for ch in lowered if ch in chars)
+        if hits:
+            scores[lang] += 0.5 * hits
+
+    if not scores:
+        return None, 0.0
+
+    ranked = scores.most_common(2)
+    lang, best = ranked[0]
+    # Слишком мало признаков - не уверены
+    if best < 1.0:
+        return lang, 0.0
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    return lang, best / (best + runner_up)
+
+
+class LanguageRouter:
+    """
+    Решает, нужен ли перевод вопроса, и ведёт статистику маршрутизации по языкам
+    """
+
+    def __init__(self, threshold: float = 0.65):
+        self.threshold = threshold
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def needs_translation(self, text: str) -> bool:
+        lang, confidence = detect_language(text)
+        bypass = lang == 'en' and confidence >= self.threshold
+
+        with self._lock:
+            stats = self._stats.setdefault(lang or 'unknown', {"requests": 0, "translated": 0, "bypassed": 0})
+            stats["requests"] += 1
+            stats["bypassed" if bypass else "translated"] += 1
+
+        return not bypass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {lang: dict(values) for lang, values in self._stats.items()}
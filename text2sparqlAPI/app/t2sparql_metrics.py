@@ -0,0 +1,154 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Границы корзин гистограммы задержек (секунды): от локальных операций до цепочек вызовов GPT-4
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+# Наблюдатель получает (pipeline, stage, секунды, была ли ошибка)
+Observer = Callable[[str, str, float, bool], None]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Кумулятивная гистограмма в формате Prometheus"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        running = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+class StageMetrics:
+    """
+    Метрики шагов пайплайнов: гистограммы задержек, ошибки, токены OpenAI, обращения к кэшам.
+    Отдаются в текстовом формате Prometheus; наблюдатели (например, бенчмарк) получают каждое измерение
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._latency: Dict[Tuple[str, str], Histogram] = {}
+        self._errors: Dict[Tuple[str, str], int] = {}
+        self._tokens: Dict[Tuple[str, str, str], int] = {}
+        self._cache: Dict[Tuple[str, str, str, str], int] = {}
+        self._observers: List[Observer] = []
+        self._lock = threading.Lock()
+
+    def add_observer(self, observer: Observer):
+        self._observers.append(observer)
+
+    def remove_observer(self, observer: Observer):
+        if observer in self._observers:
+            self._observers.remove(observer)
+
+    def observe(self, pipeline: str, stage: str, seconds: float, error: bool = False):
+        key = (pipeline, stage)
+        with self._lock:
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            if error:
+                self._errors[key] = self._errors.get(key, 0) + 1
+        for observer in list(self._observers):
+            observer(pipeline, stage, seconds, error)
+
+    @contextmanager
+    def stage(self, pipeline: str, stage: str):
+        """Замер шага; исключение считается ошибкой шага и пробрасывается дальше (отмена ошибкой не считается)"""
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(pipeline, stage, time.perf_counter() - started, error)
+
+    def record_tokens(self, pipeline: str, stage: str, usage):
+        """usage - объект response.usage ответа OpenAI (может отсутствовать)"""
+        if usage is None:
+            return
+        with self._lock:
+            for kind in ("prompt", "completion"):
+                tokens = getattr(usage, f"{kind}_tokens", None) or 0
+                key = (pipeline, stage, kind)
+                self._tokens[key] = self._tokens.get(key, 0) + tokens
+
+    def record_cache(self, cache: str, pipeline: str, stage: str, outcome: str):
+        key = (cache, pipeline, stage, outcome)
+        with self._lock:
+            self._cache[key] = self._cache.get(key, 0) + 1
+
+    def render(self) -> str:
+        with self._lock:
+            latency = {key: (histogram.cumulative(), histogram.total, histogram.count)
+                       for key, histogram in self._latency.items()}
+            errors = dict(self._errors)
+            tokens = dict(self._tokens)
+            cache = dict(self._cache)
+
+        lines = [
+            "# HELP t2sparql_stage_duration_seconds Pipeline stage latency",
+            "# TYPE t2sparql_stage_duration_seconds histogram",
+        ]
+        for (pipeline, stage), (buckets, total, count) in sorted(latency.items()):
+            for bound, running in buckets:
+                lines.append(f"t2sparql_stage_duration_seconds_bucket"
+                             f"{_labels(pipeline=pipeline, stage=stage, le=_number(bound))} {running}")
+            lines.append(f"t2sparql_stage_duration_seconds_sum{_labels(pipeline=pipeline, stage=stage)} {total!r}")
+            lines.append(f"t2sparql_stage_duration_seconds_count{_labels(pipeline=pipeline, stage=stage)} {count}")
+
+        lines += ["# HELP t2sparql_stage_errors_total Pipeline stage failures",
+                  "# TYPE t2sparql_stage_errors_total counter"]
+        for (pipeline, stage), count in sorted(errors.items()):
+            lines.append(f"t2sparql_stage_errors_total{_labels(pipeline=pipeline, stage=stage)} {count}")
+
+        lines += ["# HELP t2sparql_llm_tokens_total OpenAI token usage",
+                  "# TYPE t2sparql_llm_tokens_total counter"]
+        for (pipeline, stage, kind), count in sorted(tokens.items()):
+            lines.append(f"t2sparql_llm_tokens_total{_labels(pipeline=pipeline, stage=stage, type=kind)} {count}")
+
+        lines += ["# HELP t2sparql_cache_requests_total Cache lookups by outcome",
+                  "# TYPE t2sparql_cache_requests_total counter"]
+        for (cache_name, pipeline, stage, outcome), count in sorted(cache.items()):
+            lines.append(f"t2sparql_cache_requests_total"
+                         f"{_labels(cache=cache_name, pipeline=pipeline, stage=stage, outcome=outcome)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр метрик процесса; пайплайны пишут сюда, если им не передан свой
+metrics = StageMetrics()
@@ -0,0 +1,46 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_PREFIX = object()
+
+
+class NamespaceTrie:
+    """
+    Префиксное дерево URI пространств имён для сокращения URI до QName: самое длинное пространство имён,
+    с которого начинается URI, находится за один проход по символам URI. Строится один раз при загрузке графа;
+    результаты для уже встречавшихся URI кэшируются (в графе одни и те же предикаты и сущности повторяются)
+    """
+
+    def __init__(self, namespaces: Iterable[Tuple[str, str]]):
+        self.namespaces: List[Tuple[str, str]] = [(prefix, str(ns)) for prefix, ns in namespaces]
+        self._root: Dict = {}
+        self._cache: Dict[str, Optional[Tuple[str, str]]] = {}
+        for prefix, ns in self.namespaces:
+            if not ns:
+                continue
+            node = self._root
+            for char in ns:
+                node = node.setdefault(char, {})
+            # Для одного пространства имён с несколькими префиксами используется первый зарегистрированный
+            node.setdefault(_PREFIX, prefix)
+        # Заголовок запроса со всеми префиксами графа
+        self.header = "\n".join(f"PREFIX {prefix}: <{ns}>" for prefix, ns in self.namespaces)
+
+    def split(self, uri: str) -> Optional[Tuple[str, str]]:
+        """(префикс, локальное имя) по самому длинному подходящему пространству имён; None - не найдено"""
+        try:
+            return self._cache[uri]
+        except KeyError:
+            pass
+        node, match = self._root, None
+        for position, char in enumerate(uri):
+            node = node.get(char)
+            if node is None:
+                break
+            if _PREFIX in node:
+                match = (node[_PREFIX], uri[position + 1:])
+        self._cache[uri] = match
+        return match
+
+    def compact(self, uri: str) -> str:
+        match = self.split(uri)
+        return f"{match[0]}:{match[1]}" if match is not None else f"<{uri}>"
@@ -0,0 +1,129 @@
+import re
+import threading
+from typing import Dict, Optional, Tuple
+
+from t2sparql_repair import VIRTUOSO_DIALECT, syntax_error
+
+# Лексемы, значимые для разбора структуры запроса; строки, IRI и комментарии пропускаются целиком
+_TOKEN = re.compile(
+    r'(?P<skip>"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^\'\\]|\\.|\'(?!\'\'))*\'\'\''
+    r'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|<[^<>"{}|^`\\\s]*>|#[^\n]*)'
+    r'|(?P<open>[{(])|(?P<close>[})])'
+    r'|(?P<word>[?$:]?[A-Za-z_][\w:.-]*)'
+)
+_AGGREGATE = re.compile(r'\b(?:COUNT|SUM|AVG|MIN|MAX|SAMPLE|GROUP_CONCAT)\s*\(', re.IGNORECASE)
+_LIMIT = re.compile(r'\bLIMIT\s+(\d+)', re.IGNORECASE)
+
+QUERY_FORMS = {"SELECT", "ASK", "CONSTRUCT", "DESCRIBE"}
+
+
+def _split_select(query: str) -> Optional[Tuple[int, int, int, Dict[str, int]]]:
+    """
+    Границы частей SELECT-запроса: конец пролога, конец проекции, конец WHERE-группы
+    и позиции ключевых слов модификаторов после неё. None - не SELECT или структура не распознана
+    """
+    depth = 0
+    form_start = projection_end = where_end = None
+    tail_words: Dict[str, int] = {}
+
+    for token in _TOKEN.finditer(query):
+        kind = token.lastgroup
+        if kind == 'skip':
+            continue
+        if form_start is None:
+            if kind == 'word' and token.group().upper() in QUERY_FORMS:
+                if token.group().upper() != "SELECT":
+                    return None
+                form_start = token.start()
+            continue
+
+        if where_end is not None:
+            if kind == 'word' and depth == 0:
+                tail_words.setdefault(token.group().upper(), token.start())
+        elif projection_end is None and depth == 0 and (
+                kind == 'open' and token.group() == '{' or
+                kind == 'word' and token.group().upper() in ("FROM", "WHERE")):
+            projection_end = token.start()
+
+        if kind == 'open':
+            depth += 1
+        elif kind == 'close':
+            depth -= 1
+            if depth == 0 and token.group() == '}' and where_end is None and projection_end is not None:
+                where_end = token.end()
+
+    if form_start is None or projection_end is None or where_end is None:
+        return None
+    return form_start, projection_end, where_end, tail_words
+
+
+def make_probe(query: str) -> Tuple[str, str]:
+    """
+    Дешёвый запрос для проверки того, что SELECT возвращает хотя бы одну строку.
+    ASK - если количество строк не зависит от агрегатов, GROUP BY/HAVING, OFFSET и VALUES,
+    иначе исходный запрос с LIMIT 1. Возвращает (вид: "ask" / "limit" / "full", текст запроса)
+    """
+    parts = _split_select(query)
+    if parts is None:
+        return "full", query
+    form_start, projection_end, where_end, tail_words = parts
+
+    prologue = query[:form_start]
+    projection = query[form_start:projection_end]
+    body = query[projection_end:where_end]
+    tail = query[where_end:]
+
+    limit = _LIMIT.search(tail)
+    if limit is not None and int(limit.group(1)) == 0:
+        return "full", query
+
+    if (not _AGGREGATE.search(projection) and
+            not {"GROUP", "HAVING", "OFFSET", "VALUES"} & set(tail_words)):
+        return "ask", f"{prologue}ASK {body.lstrip()}"
+
+    if limit is not None:
+        if limit.group(1) == "1":
+            return "full", query
+        tail = f"{tail[:limit.start()]}LIMIT 1{tail[limit.end():]}"
+    else:
+        # LIMIT ставится перед завершающим блоком VALUES, если он есть
+        insert_at = tail_words["VALUES"] - where_end if "VALUES" in tail_words else len(tail.rstrip())
+        tail = f"{tail[:insert_at].rstrip()} LIMIT 1 {tail[insert_at:]}".rstrip()
+
+    return "limit", f"{prologue}{projection}{body}{tail}"
+
+
+class ValidationProber:
+    """
+    Выбирает форму запроса для проверки на endpoint и ведёт статистику времени проверок
+    отдельно для пробных ("ask", "limit") и полных ("full") запросов
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def probe(self, query: str) -> Tuple[str, str]:
+        if not self.enabled:
+            return "full", query
+        kind, probe_query = make_probe(query)
+        # Переписанный запрос должен разбираться, если разбирается исходный; иначе проверяется исходный
+        if kind != "full" and not VIRTUOSO_DIALECT.search(query) and syntax_error(probe_query) is not None:
+            if syntax_error(query) is None:
+                return "full", query
+        return kind, probe_query
+
+    def record(self, kind: str, seconds: float):
+        with self._lock:
+            stats = self._stats.setdefault(kind, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                kind: dict(values, mean_seconds=values["seconds"] / values["count"] if values["count"] else 0.0)
+                for kind, values in self._stats.items()
+            }
@@ -0,0 +1,83 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Iterable, Optional, Tuple
+
+# Шаги, ответ LLM которых пересылается клиенту по мере генерации
+TOKEN_STAGES = ("generate_sparql",)
+
+_current: ContextVar[Optional["ProgressStream"]] = ContextVar("t2sparql_progress", default=None)
+_CLOSED = object()
+
+
+class ProgressStream:
+    """
+    События обработки одного запроса (результаты завершённых шагов, токены LLM) для потоковой выдачи клиенту.
+    Как и крайний срок, активный поток хранится в contextvar и виден всем шагам пайплайна.
+    События публикуются из потока event loop (асинхронный пайплайн)
+    """
+
+    def __init__(self, token_stages: Iterable[str] = TOKEN_STAGES):
+        self.token_stages = set(token_stages)
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(self, event: str, data: Any):
+        self._queue.put_nowait((event, data))
+
+    def close(self):
+        self._queue.put_nowait(_CLOSED)
+
+    async def events(self, keepalive: Optional[float] = None) -> AsyncIterator[Optional[Tuple[str, Any]]]:
+        """События до close(); None - за keepalive секунд событий не было"""
+        while True:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if item is _CLOSED:
+                return
+            yield item
+
+    @contextmanager
+    def activate(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+def emit(event: str, data: Any):
+    """Событие для клиента, если запрос обрабатывается в потоковом режиме (иначе ничего не делает)"""
+    stream = _current.get()
+    if stream is not None:
+        stream.emit(event, data)
+
+
+def token_sink(stage: str) -> Optional[Callable[[str], None]]:
+    """Куда пересылать фрагменты ответа LLM этого шага; None - ответ нужен только целиком"""
+    stream = _current.get()
+    if stream is None or stage not in stream.token_stages:
+        return None
+    return lambda text: stream.emit("token", {"stage": stage, "text": text})
+
+
+async def astream_completion(client, request: dict, sink: Callable[[str], None], **kwargs) -> Tuple[str, Any]:
+    """
+    Потоковый вызов OpenAI: фрагменты ответа передаются в sink по мере поступления.
+    Возвращает полный текст и usage (последний фрагмент потока). При отмене соединение закрывается
+    """
+    stream = await client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True},
+                                                  **kwargs)
+    parts, usage = [], None
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                sink(chunk.choices[0].delta.content)
+    finally:
+        await stream.close()
+    return "".join(parts), usage
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+class PipelineRegistry:
+    """Реестр пайплайнов: каждый датасет собирается один раз и переиспользуется всеми запросами"""
+
+    def __init__(self, factories: Dict[str, Callable[[], Any]]):
+        self._factories = dict(factories)
+        self._pipelines: Dict[str, Any] = {}
+        self._errors: Dict[str, str] = {}
+        self._locks = {dataset: threading.Lock() for dataset in self._factories}
+
+    def __contains__(self, dataset: str) -> bool:
+        return dataset in self._factories
+
+    def datasets(self):
+        return list(self._factories)
+
+    def get(self, dataset: str) -> Any:
+        """
+        Возвращает готовый пайплайн датасета, при первом обращении строит его.
+        Сборка защищена блокировкой, поэтому параллельные запросы не строят пайплайн повторно.
+        """
+        pipeline = self._pipelines.get(dataset)
+        if pipeline is not None:
+            return pipeline
+
+        with self._locks[dataset]:
+            if dataset not in self._pipelines:
+                try:
+                    self._pipelines[dataset] = self._factories[dataset]()
+                    self._errors.pop(dataset, None)
+                except Exception as e:
+                    self._errors[dataset] = str(e)
+                    raise
+        return self._pipelines[dataset]
+
+    async def warm_up(self):
+        """Параллельно прогревает все пайплайны в пуле потоков, не блокируя event loop"""
+        await asyncio.gather(
+            *(asyncio.to_thread(self.get, dataset) for dataset in self._factories),
+            return_exceptions=True
+        )
+
+    async def aclose(self):
+        """Закрывает асинхронные клиенты (OpenAI, HTTP) собранных пайплайнов"""
+        for pipeline in self._pipelines.values():
+            aclose = getattr(pipeline, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def memory_usage(self) -> Dict:
+        """Память компонентов собранных пайплайнов (индексы, тексты), байты"""
+        return {dataset: pipeline.memory_usage() for dataset, pipeline in self._pipelines.items()
+                if hasattr(pipeline, "memory_usage")}
+
+    def is_ready(self, dataset: Optional[str] = None) -> bool:
+        if dataset is not None:
+            return dataset in self._pipelines
+        return all(d in self._pipelines for d in self._factories)
+
+    def status(self) -> Dict:
+        return {
+            "ready": self.is_ready(),
+            "datasets": {
+                dataset: {
+                    "ready": dataset in self._pipelines,
+                    "error": self._errors.get(dataset)
+                }
+                for dataset in self._factories
+            }
+        }
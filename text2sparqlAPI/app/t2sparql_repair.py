@@ -0,0 +1,216 @@
+import asyncio
+import re
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from rdflib.plugins.sparql.parser import parseQuery
+
+from t2sparql_deadline import stage_allowed
+
+# Блоки ```sparql ... ``` в ответе модели
+FENCE = re.compile(r'```[ \t]*(?:sparql)?[ \t]*\n?(.*?)```', re.DOTALL | re.IGNORECASE)
+# Метка перед запросом в ответах генерации и исправления ("SPARQL:", "CORRECTED SPARQL:")
+SPARQL_MARKER = re.compile(r'SPARQL:\s*', re.IGNORECASE)
+# Начало запроса: пролог или форма запроса
+QUERY_START = re.compile(r'^[ \t]*(?:PREFIX|BASE|SELECT|ASK|CONSTRUCT|DESCRIBE)\b', re.IGNORECASE | re.MULTILINE)
+# Запрос сразу после метки, на той же строке ("SPARQL: SELECT ...")
+QUERY_KEYWORD = re.compile(r'(?:PREFIX|BASE|SELECT|ASK|CONSTRUCT|DESCRIBE)\b', re.IGNORECASE)
+
+# Синтаксис Virtuoso, который rdflib не принимает, а DBpedia выполняет (агрегат в проекции без AS);
+# такие запросы после локальной ошибки всё равно отправляются на endpoint
+VIRTUOSO_DIALECT = re.compile(
+    r'SELECT\s+(?:DISTINCT\s+)?(?:COUNT|SUM|AVG|MIN|MAX|SAMPLE|GROUP_CONCAT)\s*\(', re.IGNORECASE)
+
+# Разбор pyparsing не рассчитан на параллельные вызовы из нескольких потоков
+_PARSE_LOCK = threading.Lock()
+
+
+def syntax_error(query: str) -> Optional[str]:
+    """Ошибка разбора запроса парсером rdflib или None"""
+    try:
+        with _PARSE_LOCK:
+            parseQuery(query)
+    except Exception as e:
+        return f"QueryBadFormed: {e}".strip()
+    return None
+
+
+def extract_sparql(text: Optional[str]) -> Optional[str]:
+    """
+    Достаёт текст запроса из ответа модели: последний блок ```sparql```, иначе текст после "SPARQL:";
+    рассуждения ("Thought Process: ...") до начала запроса, остатки разметки и строки-комментарии отбрасываются
+    """
+    if not text:
+        return None
+
+    fenced = [block for block in FENCE.findall(text) if QUERY_START.search(block)]
+    if fenced:
+        text = fenced[-1]
+    else:
+        markers = list(SPARQL_MARKER.finditer(text))
+        if markers:
+            rest = text[markers[-1].end():]
+            if QUERY_KEYWORD.match(rest) or QUERY_START.search(rest):
+                text = rest
+
+    start = QUERY_START.search(text)
+    if start is None:
+        return text.strip() or None
+    text = text[start.start():]
+    text = re.sub(r'```.*$', '', text, flags=re.DOTALL)
+    text = re.sub(r'^\s*#.*$', '', text, flags=re.MULTILINE)
+    return text.strip() or None
+
+
+class QueryRepairEngine:
+    """
+    Цикл проверки и исправления SPARQL: локальный разбор rdflib отсекает синтаксические ошибки без обращения
+    к endpoint, удалённая проверка выполняется только для разобранных запросов, исправленный запрос
+    становится следующим кандидатом. Ограничения - число проверок и время на весь цикл.
+    """
+
+    def __init__(self, max_attempts: int = 3, time_budget: Optional[float] = None, local_check: bool = True):
+        self.max_attempts = max_attempts
+        self.time_budget = time_budget
+        self.local_check = local_check
+        self._stats = {
+            "runs": 0, "succeeded": 0, "repairs": 0,
+            "local_checks": 0, "local_rejections": 0, "local_inconclusive": 0,
+            "remote_validations": 0, "repeated_candidates": 0,
+            "attempt_budget_exhausted": 0, "time_budget_exhausted": 0, "request_deadline_cuts": 0,
+            "local_check_seconds": 0.0, "remote_validation_seconds": 0.0
+        }
+        self._stats_lock = threading.Lock()
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+    def local_error(self, query: str) -> Optional[str]:
+        """Ошибка локального разбора или None, если запрос разобран (или это допустимый диалект Virtuoso)"""
+        if not self.local_check:
+            return None
+        started = time.perf_counter()
+        error = syntax_error(query)
+        self._count(local_checks=1, local_check_seconds=time.perf_counter() - started)
+
+        if error is not None and VIRTUOSO_DIALECT.search(query):
+            self._count(local_inconclusive=1)
+            return None
+        if error is not None:
+            self._count(local_rejections=1)
+        return error
+
+    def _start(self, max_attempts: Optional[int]) -> Tuple[int, Optional[float]]:
+        self._count(runs=1)
+        attempts = self.max_attempts if max_attempts is None else max_attempts
+        deadline = time.monotonic() + self.time_budget if self.time_budget is not None else None
+        return max(attempts, 1), deadline
+
+    def _out_of_time(self, deadline: Optional[float]) -> bool:
+        if deadline is not None and time.monotonic() >= deadline:
+            self._count(time_budget_exhausted=1)
+            return True
+        # Крайний срок всего запроса: на исправление и повторную проверку времени не осталось
+        if not stage_allowed("repair_query"):
+            self._count(request_deadline_cuts=1)
+            return True
+        return False
+
+    def _next_candidate(self, repaired: Optional[str], seen: set) -> Optional[str]:
+        candidate = extract_sparql(repaired)
+        if candidate is None:
+            return None
+        key = " ".join(candidate.split())
+        if key in seen:
+            # Модель вернула уже проверенный запрос - результат проверки известен
+            self._count(repeated_candidates=1)
+            return None
+        seen.add(key)
+        return candidate
+
+    def _result(self, sparql: str, is_valid: bool, error: Optional[str], attempts: int,
+                parsed: Optional[Tuple[str, Optional[str]]] = None) -> Dict:
+        if is_valid:
+            self._count(succeeded=1)
+        elif parsed is not None:
+            # Лучший из непрошедших кандидатов - последний, который хотя бы разобрался локально
+            sparql, error = parsed
+        return {"valid": is_valid, "sparql": sparql, "error": error, "attempts": attempts}
+
+    def run(self, sparql: str, validate: Callable[[str], Tuple[bool, Optional[str]]],
+            repair: Callable[[str, str], Optional[str]], max_attempts: Optional[int] = None) -> Dict:
+        """
+        Проверяет запрос и при ошибке просит repair(query, error) исправить его.
+        Возвращает {"valid", "sparql" (последний кандидат), "error", "attempts"}
+        """
+        attempts, deadline = self._start(max_attempts)
+        candidate = extract_sparql(sparql) or sparql
+        seen = {" ".join(candidate.split())}
+
+        parsed = None
+        for attempt in range(1, attempts + 1):
+            error = self.local_error(candidate)
+            if error is None:
+                started = time.perf_counter()
+                is_valid, error = validate(candidate)
+                self._count(remote_validations=1, remote_validation_seconds=time.perf_counter() - started)
+                if is_valid:
+                    return self._result(candidate, True, None, attempt)
+                parsed = (candidate, error)
+
+            if attempt == attempts:
+                self._count(attempt_budget_exhausted=1)
+                break
+            if self._out_of_time(deadline):
+                break
+
+            self._count(repairs=1)
+            repaired = self._next_candidate(repair(candidate, error), seen)
+            if repaired is None:
+                break
+            candidate = repaired
+
+        return self._result(candidate, False, error, attempt, parsed)
+
+    async def arun(self, sparql: str, validate: Callable[[str], Awaitable[Tuple[bool, Optional[str]]]],
+                   repair: Callable[[str, str], Awaitable[Optional[str]]], max_attempts: Optional[int] = None) -> Dict:
+        """Async variant of run"""
+        attempts, deadline = self._start(max_attempts)
+        candidate = extract_sparql(sparql) or sparql
+        seen = {" ".join(candidate.split())}
+
+        parsed = None
+        for attempt in range(1, attempts + 1):
+            # Разбор rdflib занимает до десятков миллисекунд под общей блокировкой - вне event loop
+            error = await asyncio.to_thread(self.local_error, candidate)
+            if error is None:
+                started = time.perf_counter()
+                is_valid, error = await validate(candidate)
+                self._count(remote_validations=1, remote_validation_seconds=time.perf_counter() - started)
+                if is_valid:
+                    return self._result(candidate, True, None, attempt)
+                parsed = (candidate, error)
+
+            if attempt == attempts:
+                self._count(attempt_budget_exhausted=1)
+                break
+            if self._out_of_time(deadline):
+                break
+
+            self._count(repairs=1)
+            repaired = self._next_candidate(await repair(candidate, error), seen)
+            if repaired is None:
+                break
+            candidate = repaired
+
+        return self._result(candidate, False, error, attempt, parsed)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        # Каждый отклонённый локально запрос - несостоявшееся обращение к endpoint
+        stats["remote_validations_saved"] = stats["local_rejections"]
+        return stats
@@ -1,23 +1,123 @@
-from typing import Dict, Optional
-from openai import OpenAI
+from typing import Dict, List, Optional
+from openai import AsyncOpenAI, OpenAI
 from sentence_transformers import SentenceTransformer
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
 import numpy as np
 import faiss
-from faiss import IndexFlatIP
 from rdflib import Graph, URIRef, BNode
+from t2sparql_index_cache import MMAP_FLAGS, dataset_fingerprint
+from t2sparql_cache import CompletionCache
+from t2sparql_langid import LanguageRouter
+from t2sparql_deadline import timeout_kwargs
+from t2sparql_metrics import StageMetrics, metrics as default_metrics
+from t2sparql_progress import astream_completion, emit, token_sink
+from t2sparql_labels import LabelIndex
+from t2sparql_bm25 import BM25Index, reciprocal_rank_fusion
+from t2sparql_namespaces import NamespaceTrie
+from t2sparql_chunker import CHUNK_BATCH_SIZE, StreamingChunker
+from t2sparql_ann import IndexSpec, index_memory
+
+# Версия формата снапшота корпоративного графа; снапшоты другой версии не загружаются
+SNAPSHOT_VERSION = 2
+EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
 
 
 class GPTEnhancedSemanticSearcher:
-    def __init__(self, openai_api_key: str):
+    PIPELINE_NAME = 'corporate'
+
+    def __init__(self, openai_api_key: str, llm_cache: Optional[CompletionCache] = None,
+                 language_router: Optional[LanguageRouter] = None, metrics: Optional[StageMetrics] = None,
+                 max_pinned: int = 10, dense_weight: float = 1.0, sparse_weight: float = 1.0, rrf_k: int = 60,
+                 fusion_depth: int = 50, index_spec: Optional[IndexSpec] = None):
         self.client = OpenAI(api_key=openai_api_key)
-        self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        self.async_client = AsyncOpenAI(api_key=openai_api_key)
+        self.llm_cache = llm_cache
+        self.language_router = language_router or LanguageRouter()
+        self.metrics = metrics or default_metrics
+        self.model = SentenceTransformer(EMBEDDING_MODEL)
         self.graph = None
+        self.namespaces = []
+        self.namespace_trie = NamespaceTrie([])
         self.chunks = []
         self.metadata = []
         self.index = None
+        # Тип FAISS-индекса чанков (по умолчанию точный поиск Flat)
+        self.index_spec = index_spec or IndexSpec()
+        # Словарь названий сущностей: их чанки закрепляются в контексте до плотного поиска (не больше max_pinned)
+        self.label_index: Optional[LabelIndex] = None
+        self.max_pinned = max_pinned
+        # Гибридный поиск: BM25 по тексту чанков (коды деталей, названия) объединяется с плотным поиском через RRF.
+        # Веса ранжирований, константа RRF и сколько кандидатов берётся из каждого ранжирования
+        self.bm25_index: Optional[BM25Index] = None
+        self.dense_weight = dense_weight
+        self.sparse_weight = sparse_weight
+        self.rrf_k = rrf_k
+        self.fusion_depth = fusion_depth
 
-    def translate_to_english(self, text):
-        response = self.client.chat.completions.create(
+    def _record_llm_cache(self, stage: str, request: Dict, cached: Optional[str]):
+        if cached is not None:
+            outcome = "hit"
+        else:
+            outcome = "miss" if self.llm_cache.cacheable(request) else "bypassed"
+        self.metrics.record_cache("llm", self.PIPELINE_NAME, stage, outcome)
+
+    def _complete(self, stage: str, request: Dict) -> str:
+        if self.llm_cache is not None:
+            cached = self.llm_cache.get(request, stage, self.PIPELINE_NAME)
+            self._record_llm_cache(stage, request, cached)
+            if cached is not None:
+                return cached
+
+        with self.metrics.stage(self.PIPELINE_NAME, stage):
+            response = self.client.chat.completions.create(**request, **timeout_kwargs())
+        self.metrics.record_tokens(self.PIPELINE_NAME, stage, getattr(response, "usage", None))
+        content = response.choices[0].message.content
+
+        if self.llm_cache is not None:
+            self.llm_cache.put(request, content)
+        return content
+
+    async def _acomplete(self, stage: str, request: Dict) -> str:
+        # При потоковой выдаче клиенту ответ генерации запрашивается у OpenAI потоком и пересылается по токенам
+        sink = token_sink(stage)
+
+        # SQLite-уровень кэша блокирующий, поэтому с ним работаем из пула потоков
+        if self.llm_cache is not None:
+            if self.llm_cache.persistent:
+                cached = await asyncio.to_thread(self.llm_cache.get, request, stage, self.PIPELINE_NAME)
+            else:
+                cached = self.llm_cache.get(request, stage, self.PIPELINE_NAME)
+            self._record_llm_cache(stage, request, cached)
+            if cached is not None:
+                if sink is not None:
+                    sink(cached)
+                return cached
+
+        with self.metrics.stage(self.PIPELINE_NAME, stage):
+            if sink is None:
+                response = await self.async_client.chat.completions.create(**request, **timeout_kwargs())
+                usage, content = getattr(response, "usage", None), response.choices[0].message.content
+            else:
+                content, usage = await astream_completion(self.async_client, request, sink, **timeout_kwargs())
+        self.metrics.record_tokens(self.PIPELINE_NAME, stage, usage)
+
+        if self.llm_cache is not None:
+            if self.llm_cache.persistent:
+                await asyncio.to_thread(self.llm_cache.put, request, content)
+            else:
+                self.llm_cache.put(request, content)
+        return content
+
+    async def aclose(self):
+        await self.async_client.close()
+
+    def _translate_request(self, text) -> Dict:
+        return dict(
             model="gpt-4",
             messages=[
                 {
@@ -36,68 +136,295 @@ class GPTEnhancedSemanticSearcher:
             temperature=0.1,
             max_tokens=500
         )
-        return response.choices[0].message.content.strip()
+
+    def translate_to_english(self, text):
+        return self._complete('translate_to_english', self._translate_request(text)).strip()
+
+    async def atranslate_to_english(self, text):
+        return (await self._acomplete('translate_to_english', self._translate_request(text))).strip()
+
+    def to_english(self, text):
+        """Перевод только если локальный детектор не уверен, что вопрос уже на английском"""
+        if self.language_router.needs_translation(text):
+            return self.translate_to_english(text)
+        return text.strip()
+
+    async def ato_english(self, text):
+        if self.language_router.needs_translation(text):
+            return await self.atranslate_to_english(text)
+        return text.strip()
 
     def load_ttl(self, file_paths):
         self.graph = Graph()
         for path in file_paths:
             self.graph.parse(path, format="turtle")
+        self.namespaces = [(prefix, str(ns)) for prefix, ns in self.graph.namespaces()]
+        self.namespace_trie = NamespaceTrie(self.namespaces)
 
     def create_chunks(self):
-        self.chunks = []
-        self.metadata = []
+        """Один проход по триплетам графа: строки описания группируются по субъекту"""
+        descriptions: Dict = {}
+        with self.metrics.stage(self.PIPELINE_NAME, "chunking"):
+            for entity, p, o in self.graph:
+                if isinstance(entity, (URIRef, BNode)):
+                    descriptions.setdefault(entity, []).append(f"{self._uri_to_sparql(p)} {self._uri_to_sparql(o)}")
+
+            self.chunks = [f"Entity: {self._uri_to_sparql(entity)}\n" + "\n".join(lines)
+                           for entity, lines in descriptions.items()]
+            self.metadata = [{"source": str(entity)} for entity in descriptions]
 
-        for entity in set(self.graph.subjects()):
-            if isinstance(entity, (URIRef, BNode)):
-                desc = "\n".join([f"{self._uri_to_sparql(p)} {self._uri_to_sparql(o)}"
-                                for _, p, o in self.graph.triples((entity, None, None))])
-                self.chunks.append(f"Entity: {self._uri_to_sparql(entity)}\n{desc}")
-                self.metadata.append({"source": str(entity)})
+        self.label_index = LabelIndex.from_graph(
+            self.graph, {item["source"]: chunk_id for chunk_id, item in enumerate(self.metadata)})
 
     def _uri_to_sparql(self, uri):
         if isinstance(uri, URIRef):
-            for prefix, ns in self.graph.namespaces():
-                if uri.startswith(ns):
-                    return f"{prefix}:{uri.replace(ns, '')}"
+            return self.namespace_trie.compact(uri)
         return f"<{uri}>"
 
     def build_index(self):
-        self.embeddings = self.model.encode(self.chunks, show_progress_bar=True)
-        self.index = IndexFlatIP(self.embeddings.shape[1])
-        self.index.add(self.embeddings)
+        self._index_embeddings(self.model.encode(self.chunks, show_progress_bar=True, normalize_embeddings=True))
 
-    def search(self, query: str, top_k: int = 3):
-        query_embedding = self.model.encode(query)
-        query_embedding = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+    def _index_embeddings(self, embeddings: np.ndarray):
+        """
+        Эмбеддинги нормализованы при кодировании: скалярное произведение в индексе - косинусная близость.
+        Матрица после построения не хранится - векторы (или их коды для sq-fp16 / sq-int8) есть в индексе
+        """
+        self.index = self.index_spec.build(embeddings, faiss.METRIC_INNER_PRODUCT)
+        self.bm25_index = BM25Index(self.chunks)
+
+    def build_from_ttl(self, file_paths, batch_size: int = CHUNK_BATCH_SIZE):
+        """
+        Потоковая сборка вместо load_ttl + create_chunks + build_index: TTL разбирается по триплетам без rdflib Graph,
+        готовые чанки кодируются пачками по batch_size по ходу разбора
+        """
+        parts = []
+
+        def encode(texts: List[str]):
+            with self.metrics.stage(self.PIPELINE_NAME, "embed"):
+                parts.append(np.asarray(self.model.encode(texts, normalize_embeddings=True), dtype=np.float32))
+
+        chunker = StreamingChunker(encode, batch_size).run(file_paths)
+
+        self.graph = None
+        self.namespaces = chunker.namespaces
+        self.namespace_trie = chunker.namespace_trie
+        self.chunks = chunker.chunks
+        self.metadata = chunker.metadata
+        self.label_index = LabelIndex(chunker.labels)
+        # Пачки выдаются по возрастанию номеров чанков, поэтому строки матрицы совпадают с self.chunks.
+        # Файлы без сущностей (пустые, только префиксы) дают пустой индекс, как и сборка через rdflib Graph
+        if parts:
+            embeddings = np.concatenate(parts)
+        else:
+            embeddings = np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        parts.clear()
+        reopened = sorted(chunker.reopened)
+        if reopened:
+            embeddings[reopened] = self.model.encode([self.chunks[idx] for idx in reopened], normalize_embeddings=True)
+        self._index_embeddings(embeddings)
+
+    def save_snapshot(self, snapshot_dir: str, source_paths: Optional[List[str]] = None):
+        """
+        Сохраняет состояние поиска (чанки, метаданные, пространства имён, FAISS-индекс с векторами чанков)
+        в одну директорию-снапшот, которую потом можно загрузить без разбора TTL
+        """
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "model": EMBEDDING_MODEL,
+            "count": len(self.chunks),
+            "dimension": int(self.index.d),
+            "metric": "cosine",
+            "index": self.index_spec.build_key(),
+            "sources": dataset_fingerprint(source_paths) if source_paths else None
+        }
+
+        # Каждая сборка пишется в свою версию рядом со снапшотом, а snapshot_dir - симлинк на текущую версию.
+        # Симлинк переключается атомарно (os.replace), поэтому параллельные воркеры не мешают друг другу,
+        # а читатели не застают снапшот удалённым или записанным наполовину
+        snapshot_dir = os.path.abspath(snapshot_dir)
+        parent, name = os.path.split(snapshot_dir)
+        os.makedirs(parent, exist_ok=True)
+        version_dir = tempfile.mkdtemp(prefix=f".{name}-", dir=parent)
+        link = f"{version_dir}.link"
+        try:
+            with open(os.path.join(version_dir, "chunks.json"), "w", encoding="utf-8") as f:
+                json.dump({"chunks": self.chunks, "metadata": self.metadata}, f, ensure_ascii=False)
+            with open(os.path.join(version_dir, "namespaces.json"), "w", encoding="utf-8") as f:
+                json.dump(self.namespaces, f, ensure_ascii=False)
+            if self.label_index is not None:
+                with open(os.path.join(version_dir, "labels.json"), "w", encoding="utf-8") as f:
+                    json.dump(self.label_index.labels, f, ensure_ascii=False)
+            faiss.write_index(self.index, os.path.join(version_dir, "index.faiss"))
+            # manifest пишется последним: по нему определяется, что снапшот полный
+            with open(os.path.join(version_dir, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+
+            os.symlink(os.path.basename(version_dir), link)
+            previous = os.path.realpath(snapshot_dir) if os.path.islink(snapshot_dir) else None
+            if os.path.isdir(snapshot_dir) and not os.path.islink(snapshot_dir):
+                # Снапшот прежнего формата - обычная директория; дальше её заменяет симлинк
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+            os.replace(link, snapshot_dir)
+        except Exception:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            if os.path.lexists(link):
+                os.remove(link)
+            raise
+
+        # Предыдущая версия больше не нужна: читатели открывают файлы версии, на которую указывал симлинк
+        if previous and previous != version_dir and os.path.dirname(previous) == parent:
+            shutil.rmtree(previous, ignore_errors=True)
+
+    @staticmethod
+    def read_snapshot_manifest(snapshot_dir: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(snapshot_dir, "manifest.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
 
-        faiss.normalize_L2(query_embedding)
-        faiss.normalize_L2(self.embeddings)
+    @classmethod
+    def snapshot_is_current(cls, snapshot_dir: str, source_paths: Optional[List[str]] = None,
+                            index_spec: Optional[IndexSpec] = None) -> bool:
+        """
+        Снапшот существует, совместим по версии, (если заданы исходники) собран из тех же TTL
+        и (если задан тип индекса) с тем же FAISS-индексом
+        """
+        manifest = cls.read_snapshot_manifest(snapshot_dir)
+        if not manifest or manifest.get("version") != SNAPSHOT_VERSION or manifest.get("model") != EMBEDDING_MODEL:
+            return False
+        if index_spec is not None and manifest.get("index", "flat") != index_spec.build_key():
+            return False
+        if source_paths and manifest.get("sources") != dataset_fingerprint(source_paths):
+            return False
+        return True
+
+    def load_snapshot(self, snapshot_dir: str):
+        """Загрузка снапшота: эмбеддинги и индекс отображаются в память, rdflib не используется"""
+        # Версия снапшота фиксируется один раз, чтобы все файлы читались из неё, даже если симлинк переключат
+        snapshot_dir = os.path.realpath(snapshot_dir)
+        manifest = self.read_snapshot_manifest(snapshot_dir)
+        if not manifest or manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Incompatible or missing corporate snapshot in {snapshot_dir}")
+
+        with open(os.path.join(snapshot_dir, "chunks.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        with open(os.path.join(snapshot_dir, "namespaces.json"), encoding="utf-8") as f:
+            self.namespaces = [tuple(item) for item in json.load(f)]
+        self.namespace_trie = NamespaceTrie(self.namespaces)
+
+        self.graph = None
+        self.chunks = data["chunks"]
+        self.metadata = data["metadata"]
+        # Снапшоты без словаря названий: словарь восстанавливается по тексту чанков
+        try:
+            with open(os.path.join(snapshot_dir, "labels.json"), encoding="utf-8") as f:
+                self.label_index = LabelIndex(json.load(f))
+        except FileNotFoundError:
+            self.label_index = LabelIndex.from_chunks(self.chunks, self.namespaces)
+        # BM25 строится по чанкам заново: это быстрее чтения сериализованного индекса
+        self.bm25_index = BM25Index(self.chunks)
+        index_path = os.path.join(snapshot_dir, "index.faiss")
+        try:
+            self.index = faiss.read_index(index_path, MMAP_FLAGS)
+        except RuntimeError:
+            self.index = faiss.read_index(index_path)
+        # Параметры поиска не сохраняются в снапшоте; для индекса другого типа - значения по умолчанию
+        index_key = manifest.get("index", "flat")
+        spec = self.index_spec if index_key == self.index_spec.build_key() else IndexSpec.parse(index_key)
+        spec.configure(self.index)
 
-        distances, indices = self.index.search(query_embedding, top_k)
+        if self.index.ntotal != len(self.chunks):
+            raise ValueError(f"Corrupted corporate snapshot in {snapshot_dir}")
 
+    def memory_usage(self) -> Dict[str, int]:
+        """Оценка памяти компонентов в байтах: FAISS-индекс, тексты чанков, BM25"""
+        return {
+            "index": index_memory(self.index) if self.index is not None else 0,
+            "chunks": sum(sys.getsizeof(chunk) for chunk in self.chunks),
+            "bm25": self.bm25_index.memory_usage() if self.bm25_index is not None else 0
+        }
+
+    def pinned(self, query: str) -> List[Dict]:
+        """Чанки сущностей, точные названия которых упомянуты в вопросе (rdfs:label, pv:name)"""
+        if self.label_index is None or not self.max_pinned:
+            return []
+        with self.metrics.stage(self.PIPELINE_NAME, "label_match"):
+            matches = self.label_index.pinned(query, self.max_pinned)
         return [{
             "text": self.chunks[idx],
             "metadata": self.metadata[idx],
-            "score": float(distances[0][i])
-        } for i, idx in enumerate(indices[0])]
+            "score": 1.0,
+            "pinned": label
+        } for idx, label in matches]
 
-    def generate_sparql(self, original_question: str, top_k: int = 3) -> Optional[dict]:
-        # Шаг 1: Перевод вопроса
-        translated_question = self.translate_to_english(original_question)
+    def _sparse_search(self, query: str, depth: int) -> List:
+        if self.bm25_index is None or not self.sparse_weight:
+            return []
+        with self.metrics.stage(self.PIPELINE_NAME, "bm25"):
+            return self.bm25_index.search(query, depth)
 
-        # Шаг 2: Семантический поиск
-        rag_results = self.search(translated_question, top_k)
-        context = "\n".join([res['text'] for res in rag_results])
+    def _fuse(self, pinned: List[Dict], distances, indices, sparse: List, top_k: int) -> List[Dict]:
+        """
+        Закреплённые чанки, затем top_k результатов слияния плотного поиска и BM25 (RRF) без повторов.
+        score - итоговый RRF, scores - вклад каждого ранжирования (исходный score и место)
+        """
+        dense = [(int(idx), float(distance)) for distance, idx in zip(distances, indices) if idx >= 0]
+        fused = reciprocal_rank_fusion({"dense": dense, "bm25": sparse},
+                                       {"dense": self.dense_weight, "bm25": self.sparse_weight}, self.rrf_k)
+        sources = {item["metadata"]["source"] for item in pinned}
+        results = []
+        for idx, score, breakdown in fused:
+            if len(results) == top_k:
+                break
+            if self.metadata[idx]["source"] in sources:
+                continue
+            results.append({
+                "text": self.chunks[idx],
+                "metadata": self.metadata[idx],
+                "score": score,
+                "scores": breakdown
+            })
+        return pinned + results
 
-        # Шаг 3: Генерация SPARQL
-        namespaces = [f"PREFIX {prefix}: <{ns}>" for prefix, ns in self.graph.namespaces()]
+    def search(self, query: str, top_k: int = 3):
+        pinned = self.pinned(query)
+        depth = max(top_k, self.fusion_depth)
+
+        with self.metrics.stage(self.PIPELINE_NAME, "encode"):
+            query_embedding = self.model.encode(query, normalize_embeddings=True)
+        query_embedding = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+
+        # Только чтение индекса: корпус нормализован при сборке, запросы - при кодировании
+        with self.metrics.stage(self.PIPELINE_NAME, "search"):
+            distances, indices = self.index.search(query_embedding, depth)
 
+        return self._fuse(pinned, distances[0], indices[0], self._sparse_search(query, depth), top_k)
+
+    def search_batch(self, queries: List[str], top_k: int = 3):
+        """Поиск для нескольких запросов: одно кодирование батчем и один index.search"""
+        depth = max(top_k, self.fusion_depth)
+        with self.metrics.stage(self.PIPELINE_NAME, "encode"):
+            query_embeddings = np.array(self.model.encode(queries, normalize_embeddings=True),
+                                        dtype=np.float32).reshape(len(queries), -1)
+
+        with self.metrics.stage(self.PIPELINE_NAME, "search"):
+            distances, indices = self.index.search(query_embeddings, depth)
+
+        return [self._fuse(self.pinned(query), distances[row], indices[row], self._sparse_search(query, depth), top_k)
+                for row, query in enumerate(queries)]
+
+    async def asearch(self, query: str, top_k: int = 3):
+        """Кодирование запроса и поиск по индексу - CPU-bound, поэтому выполняются в пуле потоков"""
+        return await asyncio.to_thread(self.search, query, top_k)
+
+    def _generation_request(self, translated_question: str, context: str) -> Dict:
         prompt = f"""
         It is required to generate a SPARQL query for a specific knowledge graph.
         The graph is loaded from TTL files and has the following characteristics:
 
-        {len(namespaces)} registered namespace:
-        {chr(10).join(namespaces)}
+        {len(self.namespaces)} registered namespace:
+        {self.namespace_trie.header}
 
         A question for generating a query:
         "{translated_question}"
@@ -121,7 +448,7 @@ class GPTEnhancedSemanticSearcher:
         - Optimize the query for fast execution
         """
 
-        response = self.client.chat.completions.create(
+        return dict(
             model="gpt-4",
             messages=[
                 {
@@ -152,7 +479,8 @@ class GPTEnhancedSemanticSearcher:
             max_tokens=1000
         )
 
-        raw_output = response.choices[0].message.content.strip()
+    def _parse_generation(self, raw_output: str) -> dict:
+        raw_output = raw_output.strip()
 
         if "```sparql" in raw_output:
             generated_sparql = raw_output.split("```sparql")[1].split("```")[0].strip()
@@ -162,3 +490,34 @@ class GPTEnhancedSemanticSearcher:
         return {
             "generated_sparql": generated_sparql
         }
+
+    def generate_sparql(self, original_question: str, top_k: int = 3) -> Optional[dict]:
+        # Шаг 1: Перевод вопроса
+        translated_question = self.to_english(original_question)
+
+        # Шаг 2: Семантический поиск
+        rag_results = self.search(translated_question, top_k)
+        context = "\n".join([res['text'] for res in rag_results])
+
+        # Шаг 3: Генерация SPARQL
+        response = self._complete('generate_sparql', self._generation_request(translated_question, context))
+        return self._parse_generation(response)
+
+    async def agenerate_sparql(self, original_question: str, top_k: int = 3, translated_question: Optional[str] = None,
+                               rag_results: Optional[List[Dict]] = None) -> Optional[dict]:
+        """
+        Async variant of generate_sparql.
+        translated_question and rag_results skip the corresponding steps when they were computed beforehand
+        """
+        if translated_question is None:
+            translated_question = await self.ato_english(original_question)
+        emit("translated", {"question": translated_question})
+
+        if rag_results is None:
+            rag_results = await self.asearch(translated_question, top_k)
+        context = "\n".join([res['text'] for res in rag_results])
+
+        response = await self._acomplete('generate_sparql', self._generation_request(translated_question, context))
+        result = self._parse_generation(response)
+        emit("candidate", {"sparql": result["generated_sparql"]})
+        return result
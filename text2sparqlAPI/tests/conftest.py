@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули приложения импортируются по плоским именам, как при запуске из text2sparqlAPI/app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app"))
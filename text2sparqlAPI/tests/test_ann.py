@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from t2sparql_ann import INDEX_KINDS, IndexSpec, index_memory
+
+
+def test_parse_defaults_and_case_insensitive_params():
+    spec = IndexSpec.parse("HNSW:m=48, efsearch=128")
+    assert spec.kind == "hnsw"
+    assert spec.params == {"M": 48, "efConstruction": 80, "efSearch": 128}
+    assert str(IndexSpec.parse(None)) == "flat"
+    assert str(IndexSpec.parse("sq-int8")) == "sq-int8"
+
+
+@pytest.mark.parametrize("text", ["annoy", "hnsw:nlist=4", "ivf-pq:m=abc"])
+def test_parse_rejects_unknown_kinds_and_params(text):
+    with pytest.raises(ValueError):
+        IndexSpec.parse(text)
+
+
+def test_build_key_ignores_search_params():
+    assert IndexSpec.parse("ivf-pq:nprobe=4,m=8").build_key() == IndexSpec.parse("ivf-pq:m=8").build_key()
+    assert IndexSpec.parse("hnsw:M=16").build_key() != IndexSpec.parse("hnsw:M=32").build_key()
+
+
+def test_factory_string_fits_the_corpus():
+    assert IndexSpec("ivf-flat").factory_string(100, 16) == "IVF2,Flat"
+    assert IndexSpec("ivf-pq").factory_string(100000, 384) == "IVF1265,PQ96x8"
+    assert IndexSpec("ivf-pq").factory_string(50, 16) == "IVF1,PQ4x5"
+    with pytest.raises(ValueError):
+        IndexSpec("ivf-pq", m=5).factory_string(1000, 16)
+
+
+@pytest.mark.parametrize("kind", list(INDEX_KINDS))
+def test_build_and_search(kind):
+    vectors = np.random.default_rng(0).standard_normal((2000, 16)).astype(np.float32)
+    index = IndexSpec(kind).build(vectors)
+    assert index.ntotal == len(vectors)
+    assert index_memory(index) > 0
+    _, found = index.search(vectors[:5], 1)
+    assert found.shape == (5, 1) and (found >= 0).all()
+
+
+def test_scalar_quantizers_shrink_the_index():
+    vectors = np.random.default_rng(0).standard_normal((1000, 64)).astype(np.float32)
+    flat = index_memory(IndexSpec("flat").build(vectors))
+    assert index_memory(IndexSpec("sq-fp16").build(vectors)) < flat * 0.6
+    assert index_memory(IndexSpec("sq-int8").build(vectors)) < flat * 0.3
+
+
+def test_empty_corpus():
+    empty = np.empty((0, 16), np.float32)
+    assert IndexSpec("flat").build(empty).ntotal == 0
+    with pytest.raises(ValueError):
+        IndexSpec("ivf-flat").build(empty)
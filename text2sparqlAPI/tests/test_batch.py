@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+
+# Кэши LLM и SPARQL - только в памяти, чтобы импорт main не создавал SQLite-файлы
+os.environ.setdefault("T2SPARQL_LLM_CACHE_DB", "")
+os.environ.setdefault("T2SPARQL_SPARQL_CACHE_DB", "")
+
+from fastapi.testclient import TestClient
+
+import main
+from t2sparql_batch import generate_batch
+from t2sparql_registry import PipelineRegistry
+
+DBPEDIA, CORPORATE = main.KNOWN_DATASETS
+
+
+class StubPipeline:
+    """Пайплайн без LLM и индексов: "переводит" вопрос в верхний регистр и отвечает запросом с вопросом"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.batches = []
+
+    async def ato_english(self, question):
+        await asyncio.sleep(0)
+        return question.upper()
+
+    def search_batch(self, questions, top_k):
+        self.batches.append(list(questions))
+        return [f"context of {question}" for question in questions]
+
+    async def aexecute_pipeline(self, question, en_question=None, rag_context=None):
+        if question == self.fail_on:
+            raise RuntimeError("generation failed")
+        return {"sparql": f"SELECT * WHERE {{ ?s ?p \"{en_question}\" }}", "context": rag_context}
+
+
+async def collect(items, concurrency=4):
+    return dict([pair async for pair in generate_batch(items, concurrency)])
+
+
+def test_generate_batch_retrieves_once_per_pipeline():
+    pipeline = StubPipeline()
+    results = asyncio.run(collect([("a", pipeline), ("b", pipeline), ("c", pipeline)]))
+
+    assert pipeline.batches == [["A", "B", "C"]]
+    assert results[1]["context"] == "context of B"
+    assert results[2]["sparql"] == 'SELECT * WHERE { ?s ?p "C" }'
+
+
+def test_generate_batch_returns_item_errors():
+    pipeline = StubPipeline(fail_on="b")
+    results = asyncio.run(collect([("a", pipeline), ("b", pipeline)]))
+
+    assert isinstance(results[1], RuntimeError)
+    assert "sparql" in results[0]
+
+
+def test_batch_endpoint_serves_other_datasets_when_one_fails_to_build(monkeypatch):
+    def broken():
+        raise OSError("snapshot unreadable")
+
+    monkeypatch.setattr(main, "registry", PipelineRegistry({DBPEDIA: StubPipeline, CORPORATE: broken}))
+    items = [{"question": "q0", "dataset": DBPEDIA}, {"question": "q1", "dataset": CORPORATE},
+             {"question": "q2", "dataset": "unknown"}]
+    response = TestClient(main.app).post("/generate-sparql-batch", json=items)
+
+    assert response.status_code == 200
+    lines = {line["index"]: line for line in map(json.loads, response.text.splitlines())}
+    assert lines[0]["query"] == 'SELECT * WHERE { ?s ?p "Q0" }'
+    assert "snapshot unreadable" in lines[1]["error"]
+    assert lines[2]["error"].startswith("Unknown dataset")
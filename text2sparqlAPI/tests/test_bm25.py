@@ -0,0 +1,46 @@
+import pytest
+
+from t2sparql_bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+CHUNKS = [
+    "Entity: prodi:hw-A145-1240844\npv:name <Flux Capacitor>\npv:price <120.5>",
+    "Entity: prodi:bom-part-1-C247-3833661\npv:name <Rotor>\npv:hasSupplier prodi:supplier-17",
+    "Entity: prodi:supplier-17\npv:name <Acme Rotor Works>\npv:country <Germany>",
+]
+
+
+def test_tokenize_keeps_compound_codes_and_their_parts():
+    tokens = tokenize("prodi:hw-A145-1240844 costs 1.5")
+    assert tokens[:6] == ["prodi:hw-a145-1240844", "hw-a145-1240844", "prodi", "hw", "a145", "1240844"]
+    assert tokens[6:] == ["costs", "1.5", "1", "5"]
+
+
+def test_search_finds_codes_whole_and_by_fragment():
+    index = BM25Index(CHUNKS)
+    assert index.search("Which part is hw-A145-1240844?", 3)[0][0] == 0
+    assert index.search("supplier of C247", 3)[0][0] == 1
+
+
+def test_search_ranks_by_bm25_and_drops_unrelated_chunks():
+    results = BM25Index(CHUNKS).search("Acme rotor", 3)
+    assert [doc_id for doc_id, _ in results] == [2, 1]
+    assert results[0][1] > results[1][1] > 0
+    assert BM25Index(CHUNKS).search("nothing matches", 3) == []
+    assert BM25Index([]).search("rotor", 3) == []
+
+
+def test_reciprocal_rank_fusion():
+    dense = [(2, 0.9), (0, 0.8)]
+    sparse = [(1, 7.0), (2, 3.0)]
+    fused = reciprocal_rank_fusion({"dense": dense, "sparse": sparse}, {"dense": 1.0, "sparse": 1.0}, k=60)
+
+    assert [doc_id for doc_id, _, _ in fused] == [2, 1, 0]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused[0][2] == {"dense": {"score": 0.9, "rank": 1}, "sparse": {"score": 3.0, "rank": 2}}
+
+
+def test_reciprocal_rank_fusion_weights():
+    rankings = {"dense": [(0, 0.9)], "sparse": [(1, 7.0)]}
+    assert [doc_id for doc_id, _, _ in reciprocal_rank_fusion(rankings, {"dense": 1.0, "sparse": 2.0})] == [1, 0]
+    # Нулевой вес исключает ранжирование целиком
+    assert [doc_id for doc_id, _, _ in reciprocal_rank_fusion(rankings, {"dense": 0.0})] == [1]
@@ -0,0 +1,66 @@
+import pytest
+
+from t2sparql_cache import SparqlResultCache, normalize_sparql
+
+
+def test_whitespace_and_comments_collapsed():
+    query = "SELECT  ?x\n\tWHERE {   ?x a ?t . # comment\n }"
+    assert normalize_sparql(query) == "SELECT ?x WHERE { ?x a ?t . }"
+
+
+def test_whitespace_inside_literals_preserved():
+    assert normalize_sparql('SELECT ?x WHERE { ?x rdfs:label "New  York"@en }') == \
+        'SELECT ?x WHERE { ?x rdfs:label "New  York"@en }'
+    assert normalize_sparql("ASK { ?x ?p '''a\n\n  b''' }") == "ASK { ?x ?p '''a\n\n  b''' }"
+
+
+def test_literals_with_different_whitespace_have_different_keys():
+    endpoint = "http://dbpedia.org/sparql"
+    assert SparqlResultCache.make_key(endpoint, '?x rdfs:label "New  York"@en') != \
+        SparqlResultCache.make_key(endpoint, '?x rdfs:label "New York"@en')
+
+
+def test_hash_inside_iri_and_literal_is_not_a_comment():
+    query = 'SELECT ?x WHERE { ?x <http://ex.org/a#b> "c # d" }'
+    assert normalize_sparql(query) == query
+
+
+def test_prefixes_sorted_and_deduplicated():
+    query = ("PREFIX foaf: <http://xmlns.com/foaf/0.1/>\nPREFIX dbo: <http://dbpedia.org/ontology/>\n"
+             "PREFIX foaf: <http://xmlns.com/foaf/0.1/>\nSELECT ?x WHERE { ?x a dbo:Person }")
+    assert normalize_sparql(query) == ("PREFIX dbo: <http://dbpedia.org/ontology/> "
+                                       "PREFIX foaf: <http://xmlns.com/foaf/0.1/> "
+                                       "SELECT ?x WHERE { ?x a dbo:Person }")
+
+
+@pytest.mark.parametrize("status,text", [
+    (429, "Too Many Requests"), (408, "Request Timeout"), (500, "Internal Server Error"),
+    (502, "Bad Gateway"), (503, "Service Unavailable"), (504, "Gateway Timeout"),
+])
+def test_transient_errors_are_not_cached(status, text):
+    cache = SparqlResultCache()
+    cache.put("http://e/sparql", "ASK { ?s ?p ?o }", status, text, None)
+    assert cache.get("http://e/sparql", "ASK { ?s ?p ?o }") is None
+
+
+@pytest.mark.parametrize("status,text", [
+    (400, "Virtuoso 37000 Error SP030: SPARQL compiler, line 1: syntax error"),
+    (404, "Not Found"),
+    (500, "Virtuoso 37000 Error SP031: SPARQL: Internal error"),
+])
+def test_query_errors_are_negative_cached(status, text):
+    cache = SparqlResultCache()
+    cache.put("http://e/sparql", "SELECT ?x WHERE { ?x", status, text, None)
+    assert cache.get("http://e/sparql", "SELECT ?x WHERE { ?x") == {"status": status, "text": text, "results": None}
+    assert cache.stats()["negative_hits"] == 1
+
+
+def test_empty_and_non_empty_results_are_cached():
+    cache = SparqlResultCache()
+    empty = {"head": {"vars": ["x"]}, "results": {"bindings": []}}
+    found = {"head": {"vars": ["x"]}, "results": {"bindings": [{"x": {"type": "uri", "value": "http://a"}}]}}
+    cache.put("http://e/sparql", "SELECT ?x WHERE { ?x a <http://b> }", 200, "", empty)
+    cache.put("http://e/sparql", "SELECT ?x WHERE { ?x a <http://c> }", 200, "", found)
+    assert cache.get("http://e/sparql", "SELECT ?x WHERE { ?x a <http://b> }")["results"] == empty
+    assert cache.get("http://e/sparql", "SELECT ?x WHERE { ?x a <http://c> }")["results"] == found
+    assert cache.stats() == {"hits": 1, "negative_hits": 1, "misses": 0}
@@ -0,0 +1,122 @@
+import os
+from typing import Dict, Set, Tuple
+
+import pytest
+from rdflib import BNode, Graph, URIRef
+
+from t2sparql_chunker import StreamingChunker
+from t2sparql_labels import LABEL_PREDICATES
+from t2sparql_namespaces import NamespaceTrie
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app")
+
+INSTANCES = """@prefix ex: <http://ex.org/> .
+@prefix pv: <http://ld.company.org/prod-vocab/> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+
+ex:part1 a pv:Hardware ;
+    rdfs:label "Part  One" ;
+    pv:price "12.5" .
+
+ex:part2 a pv:Hardware ;
+    pv:name "Part Two" ;
+    pv:hasSupplier ex:supplier1 .
+
+ex:supplier1 a pv:Supplier ;
+    rdfs:label "ACME" .
+
+ex:part1 pv:hasSupplier ex:supplier1 .
+
+<http://other.org/thing> rdfs:label "No prefix" .
+"""
+
+VOCABULARY = """@prefix pv: <http://ld.company.org/prod-vocab/> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+
+pv:Hardware rdfs:label "Hardware" .
+<http://ex.org/part2> pv:weight "3" .
+"""
+
+
+def graph_chunks(paths) -> Tuple[Dict[str, Tuple[str, Set[str]]], Dict[str, Set[str]]]:
+    """Чанки и названия, как их строит GPTEnhancedSemanticSearcher.load_ttl + create_chunks через rdflib Graph"""
+    graph = Graph()
+    for path in paths:
+        graph.parse(path, format="turtle")
+    trie = NamespaceTrie((prefix, str(ns)) for prefix, ns in graph.namespaces())
+
+    def render(term):
+        return trie.compact(term) if isinstance(term, URIRef) else f"<{term}>"
+
+    chunks = {}
+    for entity in set(graph.subjects()):
+        if isinstance(entity, (URIRef, BNode)):
+            lines = {f"{render(p)} {render(o)}" for p, o in graph.predicate_objects(entity)}
+            chunks[str(entity)] = (f"Entity: {render(entity)}", lines)
+    labels = {}
+    for predicate in LABEL_PREDICATES:
+        for entity, label in graph.subject_objects(URIRef(predicate)):
+            labels.setdefault(str(label), set()).add(str(entity))
+    return chunks, labels
+
+
+def streamed_chunks(paths, **kwargs):
+    batches = []
+    chunker = StreamingChunker(batches.append, **kwargs).run(paths)
+    chunks = {}
+    for chunk, metadata in zip(chunker.chunks, chunker.metadata):
+        header, *lines = chunk.split("\n")
+        assert metadata["source"] not in chunks
+        chunks[metadata["source"]] = (header, set(lines))
+    labels = {label: {chunker.metadata[chunk_id]["source"] for chunk_id in chunk_ids}
+              for label, chunk_ids in chunker.labels.items()}
+    return chunker, batches, chunks, labels
+
+
+@pytest.fixture
+def sources(tmp_path):
+    paths = []
+    for name, text in (("inst.ttl", INSTANCES), ("vocab.ttl", VOCABULARY)):
+        path = tmp_path / name
+        path.write_text(text, encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("window,batch_size", [(10000, 512), (2, 2), (1, 1)])
+def test_same_chunks_as_graph(sources, window, batch_size):
+    chunker, batches, chunks, labels = streamed_chunks(sources, window=window, batch_size=batch_size)
+    expected_chunks, expected_labels = graph_chunks(sources)
+    assert chunks == expected_chunks
+    assert labels == expected_labels
+    # Каждый чанк передан на кодирование один раз, пачками не больше batch_size, по возрастанию номеров
+    assert all(len(batch) <= batch_size for batch in batches)
+    assert [text.split("\n")[0] for batch in batches for text in batch] == \
+        [chunk.split("\n")[0] for chunk in chunker.chunks]
+
+
+def test_reopened_chunks_are_reported(sources):
+    chunker, _, _, _ = streamed_chunks(sources, window=1)
+    reopened = {chunker.metadata[chunk_id]["source"] for chunk_id in chunker.reopened}
+    assert reopened == {"http://ex.org/part1", "http://ex.org/part2"}
+
+
+def test_prefixes_applied_from_the_first_triple(sources):
+    _, _, chunks, _ = streamed_chunks(sources)
+    header, lines = chunks["http://ex.org/part1"]
+    assert header == "Entity: ex:part1"
+    assert "rdf:type pv:Hardware" in lines
+    assert chunks["http://other.org/thing"][0] == "Entity: <http://other.org/thing>"
+
+
+def test_same_chunks_as_graph_on_vocabulary():
+    paths = [os.path.join(APP_DIR, "prod-vocab.ttl")]
+    _, _, chunks, labels = streamed_chunks(paths)
+    assert (chunks, labels) == graph_chunks(paths)
+
+
+def test_empty_file_gives_no_chunks(tmp_path):
+    path = tmp_path / "empty.ttl"
+    path.write_text("@prefix ex: <http://ex.org/> .\n", encoding="utf-8")
+    chunker, batches, chunks, labels = streamed_chunks([str(path)])
+    assert chunks == {} and labels == {} and batches == []
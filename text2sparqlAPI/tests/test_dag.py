@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from t2sparql_dag import StageExecutor, StageGraph
+
+
+async def delayed(value, seconds=0.1):
+    await asyncio.sleep(seconds)
+    return value
+
+
+def speculative_graph():
+    graph = StageGraph(inputs=("question",))
+    graph.add("left", lambda question: delayed(question + "-left"), after=("question",))
+    graph.add("right", lambda question: delayed(question + "-right"), after=("question",))
+    graph.add("guess", lambda question: delayed(question + "-guess", 0.2), after=("question",), speculative=True)
+
+    async def answer(left, right, guess):
+        if left.startswith("skip"):
+            guess.cancel()
+            return f"{left}+{right}"
+        return await guess.result()
+
+    graph.add("answer", answer, after=("left", "right"), speculations=("guess",))
+    return graph
+
+
+def test_independent_stages_run_in_parallel():
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await StageExecutor().run(speculative_graph(), {"question": "skip"})
+        return results, loop.time() - started
+
+    results, elapsed = asyncio.run(run())
+    assert results["answer"] == "skip-left+skip-right"
+    # left и right идут одновременно, guess не запускался
+    assert elapsed < 0.18
+
+
+def test_eager_speculation_is_used_or_cancelled():
+    executor = StageExecutor(speculative=("guess",))
+    assert asyncio.run(executor.run(speculative_graph(), {"question": "go"}))["answer"] == "go-guess"
+    assert asyncio.run(executor.run(speculative_graph(), {"question": "skip"}))["answer"] == "skip-left+skip-right"
+    assert executor.stats() == {"guess": {"started": 2, "used": 1, "cancelled": 1}}
+
+
+def test_lazy_speculation_starts_on_demand():
+    executor = StageExecutor()
+    assert asyncio.run(executor.run(speculative_graph(), {"question": "go"}))["answer"] == "go-guess"
+    assert executor.stats() == {"guess": {"started": 1, "used": 1, "cancelled": 0}}
+
+
+def test_precomputed_stage_is_not_run_and_completions_are_reported():
+    completed = []
+    results = asyncio.run(StageExecutor().run(
+        speculative_graph(), {"question": "skip", "left": "skip-given"},
+        on_complete=lambda name, value: completed.append(name)))
+
+    assert results["answer"] == "skip-given+skip-right"
+    assert sorted(completed) == ["answer", "right"]
+
+
+def test_stage_error_cancels_the_rest():
+    cancelled = []
+
+    async def slow(question):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    async def broken(question):
+        raise RuntimeError("stage failed")
+
+    graph = StageGraph(inputs=("question",))
+    graph.add("slow", slow, after=("question",))
+    graph.add("broken", broken, after=("question",))
+
+    with pytest.raises(RuntimeError, match="stage failed"):
+        asyncio.run(StageExecutor().run(graph, {"question": "q"}))
+    assert cancelled == ["slow"]
+
+
+def test_graph_rejects_invalid_dependencies():
+    graph = StageGraph(inputs=("question",))
+    graph.add("guess", lambda question: question, after=("question",), speculative=True)
+
+    with pytest.raises(ValueError, match="unknown stage"):
+        graph.add("answer", lambda missing: missing, after=("missing",))
+    with pytest.raises(ValueError, match="via speculations"):
+        graph.add("answer", lambda guess: guess, after=("guess",))
+    with pytest.raises(ValueError, match="already defined"):
+        graph.add("question", lambda: None)
+    with pytest.raises(ValueError, match="Missing stage graph inputs"):
+        asyncio.run(StageExecutor().run(graph, {}))
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import pytest
+
+from t2sparql_deadline import Deadline, DeadlineExceeded, bounded_timeout, current_deadline, stage_allowed, \
+    timeout_kwargs
+
+
+def test_no_deadline_allows_everything():
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.allows("query_rewriting")
+    assert deadline.bound(15) == 15
+    assert not deadline.degraded
+
+
+def test_optional_stage_skipped_without_enough_time():
+    deadline = Deadline(timeout=5)
+    assert not deadline.allows("query_rewriting")
+    assert deadline.allows("unreserved_stage")
+    assert not deadline.allows("query_rewriting")
+    assert deadline.skipped == ["query_rewriting"]
+    assert deadline.degraded
+
+
+def test_custom_reserves_override_defaults():
+    deadline = Deadline(timeout=5, reserves={"query_rewriting": 1})
+    assert deadline.allows("query_rewriting")
+    assert not deadline.allows("neighbours")
+
+
+def test_bound_caps_call_timeouts_and_fails_after_expiry():
+    deadline = Deadline(timeout=1)
+    assert deadline.bound(15) <= 1
+    assert deadline.bound(0.5) == 0.5
+
+    deadline.expires_at = time.monotonic() - 1
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceeded):
+        deadline.bound(15)
+
+
+def test_active_deadline_is_visible_to_helpers_and_tasks():
+    deadline = Deadline(timeout=5)
+    assert current_deadline() is None
+    assert bounded_timeout(15) == 15
+    assert timeout_kwargs() == {}
+
+    async def in_task():
+        return current_deadline(), stage_allowed("neighbours")
+
+    with deadline.activate():
+        assert bounded_timeout(15) <= 5
+        assert 0 < timeout_kwargs()["timeout"] <= 5
+        assert asyncio.run(in_task()) == (deadline, False)
+
+    assert current_deadline() is None
+    assert stage_allowed("neighbours")
+    assert deadline.skipped == ["neighbours"]
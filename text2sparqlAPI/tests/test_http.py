@@ -0,0 +1,141 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+import requests
+
+import t2sparql_http
+from t2sparql_http import CircuitBreaker, HttpTransport
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def breaker(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(t2sparql_http.time, "monotonic", clock)
+    return CircuitBreaker(**kwargs), clock
+
+
+def test_opens_after_consecutive_failures(monkeypatch):
+    cb, _ = breaker(monkeypatch, failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        cb.record_failure()
+    cb.record_success()
+    for _ in range(2):
+        cb.record_failure()
+    assert cb.state == "closed" and cb.allow()
+    cb.record_failure()
+    assert cb.state == "open" and not cb.allow()
+
+
+def test_half_open_allows_a_single_trial(monkeypatch):
+    cb, clock = breaker(monkeypatch, failure_threshold=1, reset_timeout=30)
+    cb.record_failure()
+    clock.now += 30
+    assert cb.state == "half-open"
+    assert cb.allow()
+    assert not cb.allow()
+    cb.record_success()
+    assert cb.state == "closed" and cb.allow()
+
+
+def test_failed_trial_reopens(monkeypatch):
+    cb, clock = breaker(monkeypatch, failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        cb.record_failure()
+    clock.now += 30
+    assert cb.allow()
+    cb.record_failure()
+    assert cb.state == "open" and not cb.allow()
+
+
+def test_stuck_trial_stops_blocking_after_timeout(monkeypatch):
+    cb, clock = breaker(monkeypatch, failure_threshold=1, reset_timeout=30)
+    cb.record_failure()
+    clock.now += 30
+    assert cb.allow()
+    clock.now += 30
+    assert cb.allow()
+
+
+@pytest.fixture
+def server():
+    """Локальный сервер: отвечает статусами из server.statuses по очереди (последний - дальше), считает запросы"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status = srv.statuses[min(srv.hits, len(srv.statuses) - 1)]
+            srv.hits += 1
+            self.send_response(status)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.hits, srv.statuses = 0, [200]
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}/sparql"
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def transport():
+    return HttpTransport(retries=2, backoff_base=0, failure_threshold=2)
+
+
+def arequest(http: HttpTransport, url: str):
+    async def run():
+        try:
+            return await http.arequest("GET", url)
+        finally:
+            await http.aclose()
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("status", [400, 500])
+def test_query_errors_are_returned_without_retries(server, status):
+    server.statuses = [status]
+    http = transport()
+    for _ in range(3):
+        assert http.request("GET", server.url).status_code == status
+    assert arequest(http, server.url).status_code == status
+    assert server.hits == 4
+    assert http.breaker(server.url).state == "closed"
+
+
+def test_transient_statuses_are_retried(server):
+    server.statuses = [503, 502, 200]
+    assert transport().request("GET", server.url).status_code == 200
+    assert server.hits == 3
+
+
+def test_transient_statuses_trip_the_breaker(server):
+    server.statuses = [503]
+    http = transport()
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            http.request("GET", server.url)
+    assert server.hits == 6
+    assert http.breaker(server.url).state == "open"
+    with pytest.raises(t2sparql_http.CircuitOpenError):
+        http.request("GET", server.url)
+
+
+def test_async_transient_statuses_are_retried_and_raised(server):
+    server.statuses = [504]
+    with pytest.raises(httpx.HTTPStatusError):
+        arequest(transport(), server.url)
+    assert server.hits == 3
@@ -0,0 +1,45 @@
+from rdflib import Graph, Literal, URIRef
+from rdflib.namespace import RDFS
+
+from t2sparql_labels import LabelIndex
+
+LABELS = {
+    "Sensor": [0],
+    "Sensor Unit X2": [1],
+    "Unit": [2],
+    "he": [3],
+    "Shared Name": [4, 5, 6, 7],
+}
+
+
+def test_leftmost_longest_matches_on_word_boundaries():
+    matches = LabelIndex(LABELS).find("Which supplier makes the  sensor unit x2 and the Unit? They")
+
+    assert [(match["label"], match["chunks"]) for match in matches] == [("Sensor Unit X2", [1]), ("Unit", [2])]
+    # Позиции - в нормализованном тексте (нижний регистр, одиночные пробелы)
+    assert matches[0]["start"] == len("which supplier makes the ")
+
+
+def test_pinned_skips_ambiguous_labels_and_respects_limit():
+    index = LabelIndex(LABELS, max_targets=3)
+    assert index.pinned("Shared Name of the Sensor and the Unit") == [(0, "Sensor"), (2, "Unit")]
+    assert index.pinned("Sensor and Unit", limit=1) == [(0, "Sensor")]
+
+
+def test_labels_differing_in_case_are_merged():
+    index = LabelIndex({"Gear": [0], "GEAR": [1, 0]})
+    assert index.pinned("the gear") == [(0, "Gear"), (1, "Gear")]
+
+
+def test_from_graph_and_from_chunks_agree():
+    graph = Graph()
+    graph.add((URIRef("http://ex.org/a"), RDFS.label, Literal("Flux Capacitor")))
+    graph.add((URIRef("http://ex.org/b"), URIRef("http://ld.company.org/prod-vocab/name"), Literal("Rotor")))
+    chunks = ["Entity: <http://ex.org/a>\nrdfs:label <Flux Capacitor>",
+              "Entity: <http://ex.org/b>\npv:name <Rotor>"]
+    namespaces = [("rdfs", str(RDFS)), ("pv", "http://ld.company.org/prod-vocab/")]
+
+    from_graph = LabelIndex.from_graph(graph, {"http://ex.org/a": 0, "http://ex.org/b": 1})
+    from_chunks = LabelIndex.from_chunks(chunks, namespaces)
+
+    assert from_graph.labels == from_chunks.labels == {"Flux Capacitor": [0], "Rotor": [1]}
@@ -0,0 +1,37 @@
+import pytest
+
+from t2sparql_langid import LanguageRouter, detect_language
+
+
+@pytest.mark.parametrize("question,expected", [
+    ("Who is the mayor of Berlin?", "en"),
+    ("Wer ist der Bürgermeister von Berlin?", "de"),
+    ("Quelle est la capitale de la France?", "fr"),
+    ("¿Cuántos habitantes tiene la ciudad de Madrid?", "es"),
+    ("Кто является мэром Берлина?", "ru"),
+    ("Хто є мером Берліна?", "uk"),
+    ("Хто з'яўляецца мэрам Берліна?", "be"),
+    ("Ποιος είναι ο δήμαρχος του Βερολίνου;", "el"),
+    ("柏林市长是谁？", "zh"),
+])
+def test_detect_language(question, expected):
+    lang, confidence = detect_language(question)
+    assert lang == expected
+    assert confidence > 0.5
+
+
+@pytest.mark.parametrize("text", ["", "   ", "42?", "Berlin"])
+def test_no_confident_language_without_evidence(text):
+    assert detect_language(text)[1] == 0.0
+
+
+def test_router_bypasses_only_confident_english():
+    router = LanguageRouter()
+    assert not router.needs_translation("Which rivers flow through Germany?")
+    assert router.needs_translation("Welche Flüsse fließen durch Deutschland?")
+    assert router.needs_translation("Berlin")
+    assert router.stats() == {
+        "en": {"requests": 1, "translated": 0, "bypassed": 1},
+        "de": {"requests": 1, "translated": 1, "bypassed": 0},
+        "unknown": {"requests": 1, "translated": 1, "bypassed": 0},
+    }
@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from t2sparql_metrics import Histogram, StageMetrics
+
+
+def test_histogram_is_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value)
+
+    assert histogram.cumulative() == [(0.1, 1), (1.0, 3), (float("inf"), 4)]
+    assert histogram.count == 4
+    assert histogram.total == pytest.approx(4.25)
+
+
+def test_stage_records_latency_errors_and_notifies_observers():
+    metrics = StageMetrics(buckets=(1.0,))
+    seen = []
+    metrics.add_observer(lambda *args: seen.append(args))
+
+    with metrics.stage("dbpedia", "ner"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.stage("dbpedia", "ner"):
+            raise ValueError("bad reply")
+
+    assert [(pipeline, stage, error) for pipeline, stage, _, error in seen] == [
+        ("dbpedia", "ner", False), ("dbpedia", "ner", True)]
+    text = metrics.render()
+    assert 't2sparql_stage_duration_seconds_count{pipeline="dbpedia",stage="ner"} 2' in text
+    assert 't2sparql_stage_duration_seconds_bucket{pipeline="dbpedia",stage="ner",le="+Inf"} 2' in text
+    assert 't2sparql_stage_errors_total{pipeline="dbpedia",stage="ner"} 1' in text
+
+
+def test_cancellation_is_not_an_error():
+    metrics = StageMetrics()
+
+    async def cancelled():
+        with metrics.stage("corporate", "search"):
+            raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancelled())
+    assert "t2sparql_stage_errors_total{" not in metrics.render()
+
+
+def test_tokens_and_cache_counters():
+    metrics = StageMetrics()
+    metrics.record_tokens("corporate", "generate", SimpleNamespace(prompt_tokens=120, completion_tokens=30))
+    metrics.record_tokens("corporate", "generate", SimpleNamespace(prompt_tokens=80, completion_tokens=None))
+    metrics.record_tokens("corporate", "generate", None)
+    metrics.record_cache("llm", "corporate", "generate", "hit")
+
+    text = metrics.render()
+    assert 't2sparql_llm_tokens_total{pipeline="corporate",stage="generate",type="prompt"} 200' in text
+    assert 't2sparql_llm_tokens_total{pipeline="corporate",stage="generate",type="completion"} 30' in text
+    assert 't2sparql_cache_requests_total{cache="llm",pipeline="corporate",stage="generate",outcome="hit"} 1' in text
+
+
+def test_label_values_are_escaped():
+    metrics = StageMetrics()
+    metrics.observe('odd"pipe', "line\nbreak", 0.01)
+    assert 'pipeline="odd\\"pipe",stage="line\\nbreak"' in metrics.render()
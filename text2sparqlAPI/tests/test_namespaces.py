@@ -0,0 +1,32 @@
+from t2sparql_namespaces import NamespaceTrie
+
+NAMESPACES = [
+    ("pv", "http://ld.company.org/prod-vocab/"),
+    ("prodi", "http://ld.company.org/prod-instances/"),
+    ("co", "http://ld.company.org/"),
+    ("vocab", "http://ld.company.org/prod-vocab/"),
+    ("empty", ""),
+]
+
+
+def test_longest_namespace_wins():
+    trie = NamespaceTrie(NAMESPACES)
+    assert trie.split("http://ld.company.org/prod-vocab/name") == ("pv", "name")
+    assert trie.split("http://ld.company.org/other/thing") == ("co", "other/thing")
+
+
+def test_first_prefix_of_a_namespace_is_used():
+    assert NamespaceTrie(NAMESPACES).compact("http://ld.company.org/prod-vocab/price") == "pv:price"
+
+
+def test_unknown_uri_stays_full_and_is_cached():
+    trie = NamespaceTrie(NAMESPACES)
+    assert trie.compact("http://example.org/x") == "<http://example.org/x>"
+    assert trie.split("http://ld.company.org") is None
+    assert "http://example.org/x" in trie._cache
+
+
+def test_header_lists_all_prefixes():
+    header = NamespaceTrie(NAMESPACES[:2]).header
+    assert header == ("PREFIX pv: <http://ld.company.org/prod-vocab/>\n"
+                      "PREFIX prodi: <http://ld.company.org/prod-instances/>")
@@ -0,0 +1,37 @@
+import pytest
+
+from t2sparql_probe import make_probe
+
+
+@pytest.mark.parametrize("query,expected", [
+    ("PREFIX dbo: <http://dbpedia.org/ontology/>\nSELECT DISTINCT ?x WHERE { ?x a dbo:City } ORDER BY ?x",
+     ("ask", "PREFIX dbo: <http://dbpedia.org/ontology/>\nASK WHERE { ?x a dbo:City }")),
+    ("SELECT ?x WHERE { ?x a ?t } LIMIT 10", ("ask", "ASK WHERE { ?x a ?t }")),
+    # Строки не разбираются как часть запроса
+    ('SELECT ?x WHERE { ?x rdfs:label "a } LIMIT 5" }', ("ask", 'ASK WHERE { ?x rdfs:label "a } LIMIT 5" }')),
+])
+def test_ask_when_row_count_does_not_depend_on_modifiers(query, expected):
+    assert make_probe(query) == expected
+
+
+@pytest.mark.parametrize("query,expected", [
+    ("SELECT (COUNT(?x) AS ?c) WHERE { ?x a ?t }", "SELECT (COUNT(?x) AS ?c) WHERE { ?x a ?t } LIMIT 1"),
+    ("SELECT ?t WHERE { ?x a ?t } GROUP BY ?t", "SELECT ?t WHERE { ?x a ?t } GROUP BY ?t LIMIT 1"),
+    ("SELECT ?x WHERE { ?x a ?t } OFFSET 5", "SELECT ?x WHERE { ?x a ?t } OFFSET 5 LIMIT 1"),
+    ("SELECT ?t (COUNT(?x) AS ?c) WHERE { ?x a ?t } GROUP BY ?t LIMIT 20",
+     "SELECT ?t (COUNT(?x) AS ?c) WHERE { ?x a ?t } GROUP BY ?t LIMIT 1"),
+    ("SELECT ?x WHERE { ?x a ?t } VALUES ?t { <http://a> }",
+     "SELECT ?x WHERE { ?x a ?t } LIMIT 1 VALUES ?t { <http://a> }"),
+])
+def test_limit_one_when_modifiers_change_rows(query, expected):
+    assert make_probe(query) == ("limit", expected)
+
+
+@pytest.mark.parametrize("query", [
+    "ASK { ?x a ?t }",
+    "SELECT ?x WHERE { ?x a ?t } LIMIT 0",
+    "SELECT (COUNT(?x) AS ?c) WHERE { ?x a ?t } LIMIT 1",
+    "not a query",
+])
+def test_full_query_otherwise(query):
+    assert make_probe(query) == ("full", query)
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from t2sparql_registry import PipelineRegistry
+
+
+class Pipeline:
+    def __init__(self):
+        self.closed = False
+
+    async def aclose(self):
+        self.closed = True
+
+    def memory_usage(self):
+        return {"index": 1}
+
+
+def test_pipeline_is_built_once_under_concurrent_requests():
+    builds = []
+
+    def build():
+        builds.append(threading.get_ident())
+        time.sleep(0.05)
+        return Pipeline()
+
+    registry = PipelineRegistry({"dbpedia": build})
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("dbpedia"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert len(results) == 8 and all(result is results[0] for result in results)
+
+
+def test_failed_build_is_reported_and_retried():
+    attempts = []
+
+    def build():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("index missing")
+        return Pipeline()
+
+    registry = PipelineRegistry({"corporate": build})
+    with pytest.raises(OSError):
+        registry.get("corporate")
+    assert registry.status() == {"ready": False, "datasets": {"corporate": {"ready": False, "error": "index missing"}}}
+
+    registry.get("corporate")
+    assert registry.status() == {"ready": True, "datasets": {"corporate": {"ready": True, "error": None}}}
+
+
+def test_warm_up_builds_all_and_survives_failures():
+    def broken():
+        raise RuntimeError("no snapshot")
+
+    registry = PipelineRegistry({"dbpedia": Pipeline, "corporate": broken})
+    asyncio.run(registry.warm_up())
+
+    assert registry.is_ready("dbpedia")
+    assert not registry.is_ready("corporate")
+    assert not registry.is_ready()
+    assert "corporate" in registry and "wikidata" not in registry
+    assert registry.memory_usage() == {"dbpedia": {"index": 1}}
+
+
+def test_aclose_closes_built_pipelines():
+    registry = PipelineRegistry({"dbpedia": Pipeline, "corporate": Pipeline})
+    pipeline = registry.get("dbpedia")
+    asyncio.run(registry.aclose())
+    assert pipeline.closed
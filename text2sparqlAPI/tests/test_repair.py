@@ -0,0 +1,54 @@
+import asyncio
+
+from t2sparql_repair import QueryRepairEngine, extract_sparql
+
+QUERY = "SELECT ?x WHERE { ?x a <http://dbpedia.org/ontology/City> }"
+
+
+def test_fenced_block():
+    text = f"Thought Process: the answer is a city.\n```sparql\n{QUERY}\n```\nDone."
+    assert extract_sparql(text) == QUERY
+
+
+def test_last_fenced_block_with_query_wins():
+    text = f"```sparql\nSELECT ?old WHERE {{ ?old ?p ?o }}\n```\nFixed:\n```\n{QUERY}\n```"
+    assert extract_sparql(text) == QUERY
+
+
+def test_marker_on_its_own_line():
+    assert extract_sparql(f"Thought Process: cities.\nSPARQL:\n{QUERY}") == QUERY
+
+
+def test_marker_on_the_same_line():
+    assert extract_sparql(f"SPARQL: {QUERY}") == QUERY
+    assert extract_sparql(f"Thought Process: cities. CORRECTED SPARQL: {QUERY}") == QUERY
+
+
+def test_bare_query():
+    assert extract_sparql(f"  {QUERY}\n") == QUERY
+
+
+def test_prefixes_kept_and_comment_lines_dropped():
+    text = f"PREFIX dbo: <http://dbpedia.org/ontology/>\n# find cities\n{QUERY}"
+    assert extract_sparql(text) == f"PREFIX dbo: <http://dbpedia.org/ontology/>\n\n{QUERY}"
+
+
+def test_empty_reply():
+    assert extract_sparql(None) is None
+    assert extract_sparql("   ") is None
+
+
+def test_async_run_rejects_unparsable_candidate_locally():
+    validated = []
+
+    async def validate(query):
+        validated.append(query)
+        return True, None
+
+    async def repair(query, error):
+        return QUERY
+
+    result = asyncio.run(QueryRepairEngine().arun("SELECT ?x WHERE { ?x", validate, repair))
+
+    assert result == {"valid": True, "sparql": QUERY, "error": None, "attempts": 2}
+    assert validated == [QUERY]